@@ -0,0 +1,186 @@
+import os
+import json
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import metrics
+import visa_dashboard as dashboard
+
+# 可选的 ASGI 入口，不依赖任何 Web 框架，例如:
+#   uvicorn asgi:app --host 0.0.0.0 --port 8000
+#   gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+# 提供与 Flask 应用相同的 /、/api/data、/api/last_update、/api/search 和 /metrics 接口。
+# 空闲或很慢的连接只占用事件循环中的一个协程；SQLite 读取、快照加载和限流 (文件锁) 在线程池中执行，
+# 后台线程已发布数据代数时，已缓存的结果直接在事件循环中返回，不进入线程池。
+
+# SQLite 读取线程池的大小
+READ_POOL_SIZE = int(os.environ.get("ASGI_READ_THREADS", 8))
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(dashboard.__file__)), 'templates', 'index.html')
+JSON_TYPE = b'application/json'
+HTML_TYPE = b'text/html; charset=utf-8'
+METRICS_TYPE = b'text/plain; version=0.0.4; charset=utf-8'
+
+_executor = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix='sqlite-read')
+_template = None
+
+
+def encode_json(payload):
+    """与 Flask jsonify 相同的编码方式 (键排序、紧凑格式、末尾换行)"""
+    return (json.dumps(payload, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+async def run_blocking(func, *args):
+    """在读取线程池中执行可能阻塞的函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def serving_generation():
+    """请求使用的数据代数；后台线程尚未发布时需要读取快照，放到线程池中"""
+    generation = dashboard.get_published_generation()
+    if generation is None:
+        generation = await run_blocking(dashboard.get_serving_generation)
+    return generation
+
+
+def _arg(query, name):
+    values = query.get(name)
+    return values[0] if values else ''
+
+
+def _read_template():
+    with open(TEMPLATE_PATH, 'rb') as f:
+        return f.read()
+
+
+async def handle_index(query):
+    global _template
+    if _template is None:
+        _template = await run_blocking(_read_template)
+    return 200, HTML_TYPE, _template
+
+
+async def handle_data(query):
+    as_of = _arg(query, 'as_of')
+    if not as_of.strip():
+        cached = dashboard.aggregate_cache.peek('data', await serving_generation())
+        if cached is not None:
+            return 200, JSON_TYPE, encode_json(cached)
+    payload, status = await run_blocking(dashboard.data_payload, as_of)
+    return status, JSON_TYPE, encode_json(payload)
+
+
+async def handle_last_update(query):
+    payload = await run_blocking(dashboard.last_update_payload)
+    return 200, JSON_TYPE, encode_json(payload)
+
+
+async def handle_search(query):
+    app_number = _arg(query, 'app_number').strip()
+    as_of = _arg(query, 'as_of')
+    if app_number and not as_of.strip():
+        cached = dashboard.search_cache.peek(await serving_generation(), app_number)
+        if cached is not None:
+            return 200, JSON_TYPE, encode_json(cached)
+    payload = await run_blocking(dashboard.search_payload, app_number, as_of)
+    return 200, JSON_TYPE, encode_json(payload)
+
+
+async def handle_metrics(query):
+    body = await run_blocking(lambda: metrics.render(dashboard.metric_gauges()).encode('utf-8'))
+    return 200, METRICS_TYPE, body
+
+
+# 需要限流的接口，与 Flask 应用共用同一组共享令牌桶
+RATE_LIMITED_PATHS = {'/api/search'}
+
+ROUTES = {
+    '/': handle_index,
+    '/api/data': handle_data,
+    '/api/last_update': handle_last_update,
+    '/api/search': handle_search,
+    '/metrics': handle_metrics,
+}
+
+
+async def send_response(send, status, content_type, body, include_body=True):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type),
+            (b'content-length', str(len(body)).encode('ascii')),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body if include_body else b''})
+
+
+async def handle_lifespan(receive, send):
+    """启动时在线程池中预热缓存并启动后台监视线程，关闭时释放线程池"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await run_blocking(dashboard.start_watcher)
+            except Exception as e:
+                print(f"缓存预热失败: {e}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 应用入口"""
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    start = time.perf_counter()
+    status = await handle_http(scope, send)
+    route = scope['path'] if scope['path'] in ROUTES else 'unmatched'
+    dashboard.record_request(route, scope['method'], status, time.perf_counter() - start)
+
+
+async def handle_http(scope, send):
+    """处理一个 HTTP 请求，返回响应状态码 (用于记录监控指标)"""
+    handler = ROUTES.get(scope['path'])
+    if handler is None:
+        await send_response(send, 404, JSON_TYPE, encode_json({'success': False, 'message': '接口不存在'}))
+        return 404
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send_response(send, 405, JSON_TYPE, encode_json({'success': False, 'message': '只支持 GET 请求'}))
+        return 405
+
+    if scope['path'] in RATE_LIMITED_PATHS:
+        client = scope.get('client')
+        # 令牌桶在共享文件中，加锁可能阻塞
+        allowed, retry_after = await run_blocking(dashboard.search_limiter.allow, client[0] if client else 'unknown')
+        if not allowed:
+            await send({
+                'type': 'http.response.start',
+                'status': 429,
+                'headers': [
+                    (b'content-type', JSON_TYPE),
+                    (b'content-length', str(len(dashboard.THROTTLED_BODY)).encode('ascii')),
+                    (b'retry-after', str(max(1, math.ceil(retry_after))).encode('ascii')),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': dashboard.THROTTLED_BODY})
+            return 429
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        status, content_type, body = await handler(query)
+    except Exception as e:
+        print(f"处理请求 {scope['path']} 时发生错误: {e}")
+        status, content_type, body = 500, JSON_TYPE, encode_json({'success': False, 'message': '服务器内部错误'})
+    await send_response(send, status, content_type, body, include_body=scope['method'] != 'HEAD')
+    return status
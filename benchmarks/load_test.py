@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import multiprocessing
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_pdfs import generate_dataset
+from run_benchmarks import latency_summary
+
+# 本地 HTTP 压测: 用与 docker-compose.yml 相同的方式 (gunicorn -c gunicorn.conf.py visa_dashboard:app)
+# 在合成数据集上启动服务，按固定并发数回放页面访问与查询的混合请求，
+# 对每种服务配置 (worker 数 x 线程数) 和每个并发级别报告吞吐量与各接口的延迟分位数。
+
+DEFAULT_REPORT = os.path.join(BENCH_DIR, "results", "load-latest.json")
+DEFAULT_CONFIGS = "1x4,2x4,4x4"
+DEFAULT_CONCURRENCY = "1,8,32"
+LOAD_PERCENTILES = (50, 95, 99)
+
+# 发布日的请求构成: 大部分是查询，其次是图表数据；绝大多数查询的申请号还没有结果
+REQUEST_MIX = (
+    ('/', 0.05),
+    ('/api/data', 0.25),
+    ('/api/last_update', 0.20),
+    ('/api/search', 0.50),
+)
+SEARCH_HIT_RATIO = 0.1
+PATHS_PER_CLIENT = 5000
+STARTUP_TIMEOUT = 120
+
+
+def parse_configs(value):
+    """'1x4,2x4' -> [(1, 4), (2, 4)]"""
+    configs = []
+    for item in value.split(','):
+        workers, _, threads = item.strip().lower().partition('x')
+        configs.append((int(workers), int(threads or 1)))
+    return configs
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prepare_dataset(workdir, weeks, rows_per_week, seed):
+    """在工作目录中生成并解析合成数据；数据库已存在时直接复用"""
+    if os.path.exists(os.path.join(workdir, "data", "visas.db")):
+        print(f"复用已有数据集: {workdir}")
+        return
+    pdf_dir = os.path.join(workdir, "data", "visa_pdfs")
+    files = generate_dataset(pdf_dir, weeks, rows_per_week, seed=seed)
+    print(f"已生成 {len(files)} 个 PDF，正在解析...")
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, "parse_pdfs.py")], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def load_search_pool(workdir, size, seed):
+    """查询用的申请号: (已有结果的号码, 没有结果的号码)"""
+    conn = sqlite3.connect(os.path.join(workdir, "data", "visas.db"))
+    numbers = [row[0] for row in conn.execute("SELECT DISTINCT application_number FROM visa_decisions")]
+    conn.close()
+    rng = random.Random(seed)
+    existing = set(numbers)
+    hits = rng.choices(numbers, k=size)
+    low, high = min(numbers), max(numbers)
+    span = high - low
+    misses = []
+    while len(misses) < size:
+        # 包括尚未出结果的较新号码 (高于当前最大值)
+        number = rng.randint(low, high + span // 10)
+        if number not in existing:
+            misses.append(number)
+    return hits, misses
+
+
+def build_paths(hits, misses, count, seed):
+    """按 REQUEST_MIX 生成一个客户端要回放的请求序列"""
+    rng = random.Random(seed)
+    endpoints = [path for path, _ in REQUEST_MIX]
+    weights = [weight for _, weight in REQUEST_MIX]
+    paths = []
+    for endpoint in rng.choices(endpoints, weights=weights, k=count):
+        if endpoint == '/api/search':
+            pool = hits if rng.random() < SEARCH_HIT_RATIO else misses
+            endpoint = f'/api/search?app_number={rng.choice(pool)}'
+        paths.append(endpoint)
+    return paths
+
+
+def client_loop(port, paths, start_at, measure_from, stop_at, samples):
+    """
+    一个闭环客户端: 在一个 keep-alive 连接上依次发送请求，收到响应后立即发下一个。
+    measure_from 之前的请求只用于预热，不计入结果。
+    """
+    conn = None
+    index = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while time.time() < stop_at:
+        path = paths[index % len(paths)]
+        index += 1
+        endpoint = path.split('?', 1)[0]
+        started = time.perf_counter()
+        sent_at = time.time()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader('connection', '').lower() == 'close':
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            status = 0
+            if conn is not None:
+                conn.close()
+            conn = None
+        if sent_at >= measure_from:
+            samples.append((endpoint, (time.perf_counter() - started) * 1000, status))
+    if conn is not None:
+        conn.close()
+
+
+def client_process(args):
+    """一个压测进程运行若干客户端线程 (多进程避免压测端本身受 GIL 限制)"""
+    port, path_lists, start_at, measure_from, stop_at = args
+    samples = []
+    threads = [
+        threading.Thread(target=client_loop, args=(port, paths, start_at, measure_from, stop_at, samples))
+        for paths in path_lists
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def run_level(port, concurrency, duration, warmup, hits, misses, seed, client_processes):
+    """以固定并发数压测一段时间，返回按接口汇总的结果"""
+    path_lists = [build_paths(hits, misses, PATHS_PER_CLIENT, seed + i) for i in range(concurrency)]
+    processes = max(1, min(client_processes, concurrency))
+    start_at = time.time() + 0.5
+    measure_from = start_at + warmup
+    stop_at = measure_from + duration
+    jobs = [(port, path_lists[i::processes], start_at, measure_from, stop_at) for i in range(processes)]
+    with multiprocessing.Pool(processes) as pool:
+        samples = [sample for chunk in pool.map(client_process, jobs) for sample in chunk]
+
+    result = {'concurrency': concurrency, 'duration_s': duration, 'endpoints': {}}
+    for endpoint, _ in REQUEST_MIX:
+        latencies = [ms for name, ms, status in samples if name == endpoint and status == 200]
+        errors = sum(1 for name, _, status in samples if name == endpoint and status != 200)
+        summary = latency_summary(latencies, LOAD_PERCENTILES)
+        summary['errors'] = errors
+        summary['throughput_rps'] = round(len(latencies) / duration, 1)
+        result['endpoints'][endpoint] = summary
+    ok = [ms for _, ms, status in samples if status == 200]
+    result['total'] = latency_summary(ok, LOAD_PERCENTILES)
+    result['total']['errors'] = len(samples) - len(ok)
+    result['total']['throughput_rps'] = round(len(ok) / duration, 1)
+    return result
+
+
+def start_server(workdir, port, workers, threads):
+    """按 docker-compose.yml 中的命令启动 gunicorn，等待服务就绪"""
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        SEARCH_RATE_LIMIT="0",     # 所有压测请求来自同一个 IP，不应被限流
+    )
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+               'visa_dashboard:app']
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn 启动失败，退出码 {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/data')
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return server, time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError("等待 gunicorn 就绪超时")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def print_level(label, result):
+    print(f"\n[{label}] 并发 {result['concurrency']}: "
+          f"{result['total']['throughput_rps']} 请求/秒，错误 {result['total']['errors']}")
+    for endpoint, summary in result['endpoints'].items():
+        if not summary['samples']:
+            continue
+        print(f"  {endpoint:<18} {summary['throughput_rps']:>8} rps  "
+              f"p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms  p99 {summary['p99_ms']:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="签证数据看板 HTTP 压测")
+    parser.add_argument('--configs', default=DEFAULT_CONFIGS, help="服务配置列表，格式 worker数x线程数，例如 1x4,4x4")
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, help="并发客户端数列表，例如 1,8,32")
+    parser.add_argument('--duration', type=float, default=20, help="每个并发级别的测量时长 (秒)")
+    parser.add_argument('--warmup', type=float, default=3, help="每个并发级别开始测量前的预热时长 (秒)")
+    parser.add_argument('--weeks', type=int, default=52)
+    parser.add_argument('--rows-per-week', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--client-processes', type=int, default=os.cpu_count() or 1, help="压测客户端进程数")
+    parser.add_argument('--output', default=DEFAULT_REPORT, help="JSON 报告路径")
+    parser.add_argument('--workdir', help="工作目录 (已有 data/visas.db 时直接复用；默认使用临时目录)")
+    args = parser.parse_args()
+
+    configs = parse_configs(args.configs)
+    levels = [int(value) for value in args.concurrency.split(',')]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="visa_load_")
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'weeks': args.weeks, 'rows_per_week': args.rows_per_week, 'seed': args.seed,
+            'duration_s': args.duration, 'warmup_s': args.warmup,
+            'request_mix': dict(REQUEST_MIX), 'search_hit_ratio': SEARCH_HIT_RATIO,
+            'cpu_count': os.cpu_count(),
+        },
+        'runs': [],
+    }
+    try:
+        prepare_dataset(workdir, args.weeks, args.rows_per_week, args.seed)
+        hits, misses = load_search_pool(workdir, 2000, args.seed)
+        for workers, threads in configs:
+            label = f"{workers}x{threads}"
+            port = free_port()
+            # 每种配置从空的共享缓存开始
+            shutil.rmtree(os.path.join(workdir, "data", "cache"), ignore_errors=True)
+            server, startup_s = start_server(workdir, port, workers, threads)
+            print(f"\n== gunicorn {workers} worker x {threads} 线程，就绪用时 {startup_s:.1f} 秒 ==")
+            run = {'workers': workers, 'threads': threads, 'startup_s': round(startup_s, 3), 'levels': []}
+            try:
+                for concurrency in levels:
+                    result = run_level(port, concurrency, args.duration, args.warmup, hits, misses,
+                                       args.seed, args.client_processes)
+                    print_level(label, result)
+                    run['levels'].append(result)
+            finally:
+                stop_server(server)
+            report['runs'].append(run)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n报告已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import contextlib
+import unicodedata
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+# 性能回归检查: 与仓库中保存的基线比较，超出容差时以非零状态退出。
+# 全部离线运行: 提取使用仓库自带的 PDF，聚合与查询使用本地生成的数据库。
+#   python benchmarks/regression.py            # 与基线比较
+#   python benchmarks/regression.py --update   # 重新生成基线 (确认变慢是预期的之后)
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baselines", "regression.json")
+BUNDLED_PDF_DIR = os.path.join(REPO_DIR, "data", "visa_pdfs")
+
+DEFAULT_ROWS = 1_000_000
+DEFAULT_WEEKS = 52
+DEFAULT_REPEATS = 5
+EXTRACT_REPEATS = 3
+LOOKUPS_PER_SAMPLE = 2000
+# 单个样本的最短耗时: 很快的操作在一个样本内重复多次，减小计时误差
+MIN_SAMPLE_S = 0.05
+
+# 容差: 相对基线允许变慢的比例，加上 NOISE_K 倍的噪声 (中位数绝对偏差)
+DEFAULT_TOLERANCE = 0.5
+NOISE_K = 3.0
+
+
+def summarize(samples):
+    """样本的中位数与中位数绝对偏差 (MAD)，对个别离群值不敏感"""
+    values = np.asarray(samples, dtype=float)
+    median = float(np.median(values))
+    return {
+        'median': median,
+        'mad': float(np.median(np.abs(values - median))),
+        'samples': len(values),
+    }
+
+
+def measure(func, repeats, per=1):
+    """
+    重复运行 func，返回每次耗时 (秒) 除以 per 的样本列表。
+    先运行一次预热并估计耗时，很快的函数在每个样本内连续运行多次。
+    """
+    start = time.perf_counter()
+    func()
+    inner = max(1, math.ceil(MIN_SAMPLE_S / max(time.perf_counter() - start, 1e-9)))
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(inner):
+            func()
+        samples.append((time.perf_counter() - start) / (inner * per))
+    return samples
+
+
+def calibration_workload():
+    """固定的 CPU 基准 (纯 Python、SQLite、numpy 各一部分)，用于换算不同机器上的基线"""
+    rng = random.Random(0)
+    sorted(rng.random() for _ in range(200_000))
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (a INTEGER PRIMARY KEY, b INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", ((i, i * 7 % 1000) for i in range(100_000)))
+    conn.execute("SELECT b, COUNT(*) FROM t GROUP BY b").fetchall()
+    conn.close()
+    np.sort(np.random.default_rng(0).integers(0, 1 << 40, 1_000_000))
+
+
+def build_database(rows, weeks, seed):
+    """
+    在当前目录生成 data/visas.db: weeks 周、共约 rows 条决定，结构与 parse_pdfs.py 写入的一致。
+    返回全部申请号 (用于构造查询)。
+    """
+    import parse_pdfs
+    from trends import update_week_trends, REFUSED
+
+    rng = np.random.default_rng(seed)
+    os.makedirs("data", exist_ok=True)
+    conn = parse_pdfs.setup_database(rebuild=True)
+    cursor = conn.cursor()
+    codes = {}
+    approved = parse_pdfs.get_decision_code(cursor, 'Approved', codes)
+    refused = parse_pdfs.get_decision_code(cursor, REFUSED, codes)
+
+    per_week = rows // weeks
+    all_numbers = []
+    batches = []
+    week_counts = {}
+    first_monday = date(2023, 1, 2)
+    for week in range(weeks):
+        start_date = first_monday + timedelta(weeks=week)
+        end_date = start_date + timedelta(days=6)
+        source_id = parse_pdfs.register_source_file(
+            cursor, f"synthetic_week_{week:03d}.pdf", f"hash{week}", start_date, end_date, "filename"
+        )
+        center = 60_000_000 + week * per_week * 10
+        numbers = np.sort(rng.choice(np.arange(center - per_week * 20, center + per_week * 20), per_week, replace=False))
+        decision_codes = np.where(rng.random(per_week) < 0.07, refused, approved)
+        batches.append(np.column_stack([numbers, np.full(per_week, source_id), decision_codes]))
+        parse_pdfs.store_week_stats(cursor, start_date, end_date, numbers.tolist())
+        week_counts[(str(start_date), str(end_date))] = (per_week, int((decision_codes == refused).sum()))
+        all_numbers.append(numbers)
+
+    table = np.concatenate(batches)
+    # 按主键顺序插入，WITHOUT ROWID 表的 B 树不需要分裂重排
+    table = table[np.lexsort((table[:, 1], table[:, 0]))]
+    cursor.executemany(
+        f"INSERT INTO {parse_pdfs.TABLE_NAME} (application_number, source_id, decision_code) VALUES (?, ?, ?)",
+        table.tolist()
+    )
+    update_week_trends(cursor, week_counts)
+    conn.commit()
+    return conn, np.concatenate(all_numbers)
+
+
+def lookup_numbers(existing, count, seed):
+    """一半为已有的申请号，一半为不存在的申请号"""
+    rng = random.Random(seed)
+    hits = rng.choices(existing.tolist(), k=count // 2)
+    known = set(existing.tolist())
+    low, high = int(existing.min()), int(existing.max())
+    misses = []
+    while len(misses) < count - len(hits):
+        number = rng.randint(low, high)
+        if number not in known:
+            misses.append(number)
+    numbers = hits + misses
+    rng.shuffle(numbers)
+    return numbers
+
+
+def bench_extraction(repeats):
+    """提取仓库自带 PDF 的每页耗时"""
+    import pdfplumber
+    from parse_pdfs import extract_rows
+
+    files = sorted(os.path.join(BUNDLED_PDF_DIR, f) for f in os.listdir(BUNDLED_PDF_DIR) if f.endswith('.pdf'))
+    pages = 0
+    for path in files:
+        with pdfplumber.open(path) as pdf:
+            pages += len(pdf.pages)
+
+    def extract_all():
+        # extract_rows 会打印每页的进度，这里丢弃
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in files:
+                extract_rows(path)
+
+    return {'extract_per_page': measure(extract_all, repeats, per=pages)}
+
+
+def bench_storage(rows, weeks, seed, repeats):
+    """在临时目录中的大数据库上测量聚合与查询"""
+    results = {}
+    conn, numbers = build_database(rows, weeks, seed)
+
+    import visa_dashboard
+    from snapshot import write_snapshot, SNAPSHOT_PATH
+    from search_cache import MembershipFilter
+
+    lookups = lookup_numbers(numbers, LOOKUPS_PER_SAMPLE, seed)
+
+    def search_all():
+        for number in lookups:
+            visa_dashboard.search_application(number)
+
+    # 没有快照时走数据库
+    results['db_weekly_counts'] = measure(visa_dashboard.load_weekly_counts, repeats)
+    results['db_search'] = measure(search_all, repeats, per=len(lookups))
+    results['trends'] = measure(visa_dashboard.build_trends, repeats)
+
+    results['snapshot_build'] = measure(lambda: write_snapshot(conn), repeats)
+    conn.close()
+    assert visa_dashboard.load_snapshot() is not None, f"未能加载快照 {SNAPSHOT_PATH}"
+    results['snapshot_weekly_counts'] = measure(visa_dashboard.load_weekly_counts, repeats)
+    results['visa_data'] = measure(visa_dashboard.get_visa_data, repeats)
+    results['snapshot_search'] = measure(search_all, repeats, per=len(lookups))
+
+    membership = MembershipFilter(visa_dashboard.load_application_numbers())
+
+    def filter_all():
+        for number in lookups:
+            membership.might_contain(number)
+
+    results['filter_lookup'] = measure(filter_all, repeats, per=len(lookups))
+    return results
+
+
+def run_suite(rows, weeks, seed, repeats, extract_repeats, workdir):
+    samples = {'calibration': measure(calibration_workload, repeats)}
+    samples.update(bench_extraction(extract_repeats))
+
+    # 相对路径 (data/...) 全部指向临时工作目录，不会改动仓库中的数据库
+    previous_dir = os.getcwd()
+    os.environ.setdefault("SEARCH_RATE_LIMIT", "0")
+    os.environ.setdefault("METRICS_DIR", os.path.join(workdir, "metrics"))
+    os.chdir(workdir)
+    try:
+        samples.update(bench_storage(rows, weeks, seed, repeats))
+    finally:
+        os.chdir(previous_dir)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def format_seconds(value):
+    if value >= 1:
+        return f"{value:.2f} s"
+    if value >= 1e-3:
+        return f"{value * 1e3:.2f} ms"
+    return f"{value * 1e6:.1f} µs"
+
+
+def compare(baseline, current, tolerance):
+    """
+    逐项比较，返回 (表格行, 是否有回归, 机器换算系数)。
+    上限 = 基线中位数 x 机器换算系数 x (1 + 容差) + NOISE_K x 噪声，
+    噪声取基线与本次 MAD 的较大值，换算系数为本次与基线校准耗时之比。
+    """
+    scale = current['calibration']['median'] / baseline['calibration']['median']
+    rows = []
+    failed = False
+    for name, result in current.items():
+        if name == 'calibration':
+            continue
+        reference = baseline.get(name)
+        if reference is None:
+            rows.append((name, '-', format_seconds(result['median']), '-', '-', '新增'))
+            continue
+        expected = reference['median'] * scale
+        noise = max(reference['mad'], result['mad']) * scale
+        limit = expected * (1 + tolerance) + NOISE_K * noise
+        change = (result['median'] - expected) / expected * 100
+        if result['median'] > limit:
+            status = '回归'
+            failed = True
+        elif result['median'] < expected * (1 - tolerance) - NOISE_K * noise:
+            status = '变快'
+        else:
+            status = 'OK'
+        rows.append((name, format_seconds(expected), format_seconds(result['median']),
+                     f"{change:+.1f}%", format_seconds(limit), status))
+    return rows, failed, scale
+
+
+def _display_width(text):
+    """终端中的显示宽度 (中文字符占两列)"""
+    return sum(2 if unicodedata.east_asian_width(char) in 'WF' else 1 for char in text)
+
+
+def _pad(text, width):
+    return text + ' ' * (width - _display_width(text))
+
+
+def print_table(rows):
+    headers = ('指标', '基线(换算后)', '本次', '变化', '上限', '结果')
+    rows = [tuple(str(value) for value in row) for row in rows]
+    widths = [max(_display_width(row[i]) for row in rows + [headers]) for i in range(len(headers))]
+    line = '  '.join(_pad(header, width) for header, width in zip(headers, widths))
+    print(line)
+    print('-' * _display_width(line))
+    for row in rows:
+        print('  '.join(_pad(value, width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能回归检查")
+    parser.add_argument('--update', action='store_true', help="用本次结果覆盖基线文件")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="生成数据库的行数")
+    parser.add_argument('--weeks', type=int, default=DEFAULT_WEEKS)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="每项指标的重复次数")
+    parser.add_argument('--extract-repeats', type=int, default=EXTRACT_REPEATS, help="PDF 提取的重复次数")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="允许变慢的比例")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="visa_regression_")
+    try:
+        print(f"正在运行基准测试 ({args.rows} 行, 重复 {args.repeats} 次)...")
+        results = run_suite(args.rows, args.weeks, args.seed, args.repeats, args.extract_repeats, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {'rows': args.rows, 'weeks': args.weeks, 'seed': args.seed}
+    if args.update:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+                'config': config,
+                'metrics': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"基线已写入 {args.baseline}")
+        for name, result in results.items():
+            print(f"  {name:<24} {format_seconds(result['median'])}")
+        return 0
+
+    try:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"无法读取基线文件 {args.baseline}: {e}")
+        return 2
+    if baseline.get('config') != config:
+        print(f"警告: 基线的数据规模 {baseline.get('config')} 与本次 {config} 不同，比较结果仅供参考")
+
+    rows, failed, scale = compare(baseline['metrics'], results, args.tolerance)
+    print(f"\n机器换算系数: {scale:.2f} (本次校准耗时 / 基线校准耗时)\n")
+    print_table(rows)
+    if failed:
+        print("\n❌ 发现性能回归")
+        return 1
+    print("\n✅ 没有发现性能回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,629 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from download_visas import DEFAULT_URL
+
+# 领事馆签证结果页面的离线替身: 录制 (或用本地 PDF 生成) 一份索引页和 PDF，
+# 再由本地 HTTP 服务器按原路径回放，可配置延迟、带宽、ETag 行为和故障注入。
+# download_visas.py 通过 VISA_DECISIONS_URL 指向回放服务器后，
+# 并发下载、条件请求 (304) 和断点续传都可以离线、可重复地测试与压测。
+
+RECORDING_FILE = "recording.json"
+INDEX_FILE = "index.html"
+PDF_SUBDIR = "pdfs"
+DEFAULT_PDF_PREFIX = "/app/uploads/visa-decisions/"
+DEFAULT_REPORT = os.path.join(BENCH_DIR, "results", "replay-latest.json")
+STATS_PATH = "/__replay__/stats"
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
+
+# ETag 行为:
+#   strong         ETag + Last-Modified，条件请求命中时返回 304
+#   last-modified  只有 Last-Modified
+#   none           不返回任何校验信息
+#   ignore         返回 ETag 和 Last-Modified，但从不返回 304
+#   changing       每次请求 ETag 都不同 (配置不当的 CDN)
+ETAG_MODES = ('strong', 'last-modified', 'none', 'ignore', 'changing')
+
+DEFAULT_SETTINGS = {
+    'latency_ms': 0.0,        # 每个请求返回响应头之前的等待时间
+    'bandwidth_kib': 0.0,     # 每个连接的带宽上限 (KiB/秒)，0 表示不限
+    'etag': 'strong',
+    'ranges': True,           # 是否支持 Range 请求 (关闭后续传请求总是收到完整文件)
+    'error_rate': 0.0,        # 返回 503 的比例
+    'reset_rate': 0.0,        # 不返回响应直接断开连接的比例
+    'truncate_rate': 0.0,     # 只发送一半内容就断开连接的比例
+    'fail_index': False,      # 故障是否也注入到索引页 (默认只注入到 PDF)
+    'seed': 0,
+}
+
+WRITE_CHUNK = 16 * 1024
+
+
+# ---------------------------------------------------------------------------
+# 录制
+# ---------------------------------------------------------------------------
+
+def _write_recording(out_dir, url, index_html, pdfs, last_modified):
+    """写出录制目录: index.html、pdfs/ 和 recording.json。pdfs 为 [(URL 路径, 文件名, 内容)]"""
+    os.makedirs(os.path.join(out_dir, PDF_SUBDIR), exist_ok=True)
+    with open(os.path.join(out_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        f.write(index_html)
+    files = {}
+    for path, filename, body in pdfs:
+        with open(os.path.join(out_dir, PDF_SUBDIR, filename), 'wb') as f:
+            f.write(body)
+        files[path] = {'file': f"{PDF_SUBDIR}/{filename}", 'bytes': len(body)}
+    recording = {
+        'url': url,
+        'index_path': urlsplit(url).path or '/',
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'last_modified': last_modified,
+        'files': files,
+    }
+    with open(os.path.join(out_dir, RECORDING_FILE), 'w', encoding='utf-8') as f:
+        json.dump(recording, f, ensure_ascii=False, indent=2)
+    return recording
+
+
+def record_site(url, out_dir):
+    """从线上页面录制索引页和其中列出的全部 PDF"""
+    import requests
+    from bs4 import BeautifulSoup
+
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    response = session.get(url, timeout=15)
+    response.raise_for_status()
+    index_html = response.text
+    soup = BeautifulSoup(index_html, 'html.parser')
+    summary_div = soup.find('div', class_='rich_text__summary')
+    if not summary_div:
+        raise RuntimeError("未在页面上找到 'rich_text__summary' 部分")
+
+    pdfs = []
+    for link in summary_div.find_all('a', href=lambda href: href and href.endswith('.pdf')):
+        href = link['href']
+        pdf_url = urljoin(url, href)
+        path = urlsplit(pdf_url).path
+        if urlsplit(href).netloc:
+            # 指向其他域名的链接改为站内路径，回放时全部由本地服务器提供
+            index_html = index_html.replace(f'"{href}"', f'"{path}"')
+        print(f"正在录制: {os.path.basename(path)}")
+        pdf_response = session.get(pdf_url, timeout=30)
+        pdf_response.raise_for_status()
+        pdfs.append((path, os.path.basename(path), pdf_response.content))
+
+    last_modified = response.headers.get('Last-Modified') or formatdate(usegmt=True)
+    return _write_recording(out_dir, url, index_html, pdfs, last_modified)
+
+
+def render_index(links):
+    """生成与线上页面结构相同的索引页 (链接位于 div.rich_text__summary 中)"""
+    items = '\n'.join(f'      <li><a href="{href}">{text}</a></li>' for href, text in links)
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>Visa Decisions</title></head>
+<body>
+  <h1>Visa Decisions</h1>
+  <div class="rich_text__summary">
+    <ul>
+{items}
+    </ul>
+  </div>
+</body>
+</html>
+"""
+
+
+def build_recording(pdf_dir, out_dir, url=DEFAULT_URL, pdf_prefix=DEFAULT_PDF_PREFIX):
+    """用本地 PDF (例如 data/visa_pdfs 或合成数据) 生成一份录制，不需要访问网络"""
+    filenames = sorted((name for name in os.listdir(pdf_dir) if name.lower().endswith('.pdf')), reverse=True)
+    pdfs = []
+    for filename in filenames:
+        with open(os.path.join(pdf_dir, filename), 'rb') as f:
+            pdfs.append((pdf_prefix + filename, filename, f.read()))
+    links = [(path, os.path.splitext(filename)[0].replace('_', ' ')) for path, filename, _ in pdfs]
+    # 固定的 Last-Modified，同一批文件生成的录制完全相同
+    return _write_recording(out_dir, url, render_index(links), pdfs, formatdate(0, usegmt=True))
+
+
+# ---------------------------------------------------------------------------
+# 回放服务器
+# ---------------------------------------------------------------------------
+
+class ReplaySite:
+    """加载到内存的录制: URL 路径 -> (内容, 类型, ETag)"""
+
+    def __init__(self, recording_dir):
+        with open(os.path.join(recording_dir, RECORDING_FILE), 'r', encoding='utf-8') as f:
+            self.recording = json.load(f)
+        self.index_path = self.recording['index_path']
+        self.last_modified = self.recording['last_modified']
+        self.entries = {}
+        with open(os.path.join(recording_dir, INDEX_FILE), 'rb') as f:
+            self._add(self.index_path, f.read(), 'text/html; charset=utf-8')
+        for path, info in self.recording['files'].items():
+            with open(os.path.join(recording_dir, info['file']), 'rb') as f:
+                self._add(path, f.read(), 'application/pdf')
+
+    def _add(self, path, body, content_type):
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        self.entries[path] = {'body': body, 'type': content_type, 'etag': etag}
+
+    @property
+    def pdf_bytes(self):
+        return sum(len(entry['body']) for path, entry in self.entries.items() if path != self.index_path)
+
+    @property
+    def pdf_count(self):
+        return len(self.entries) - 1
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """回放服务器。settings 可在运行中修改；统计信息可通过 stats() 或 /__replay__/stats 读取"""
+    daemon_threads = True
+
+    def __init__(self, address, site, settings=None, verbose=False):
+        super().__init__(address, ReplayHandler)
+        self.site = site
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """清空统计和每个路径的请求计数 (故障注入按请求序号决定，重置后结果可重复)"""
+        with self._lock:
+            self._stats = {
+                'requests': 0, 'index_requests': 0, 'pdf_requests': 0,
+                'status': {}, 'bytes_sent': 0, 'range_requests': 0,
+                'injected': {'error': 0, 'reset': 0, 'truncate': 0},
+            }
+            self._attempts = {}
+            self._served = 0
+
+    def stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def count_status(self, status):
+        with self._lock:
+            key = str(status)
+            self._stats['status'][key] = self._stats['status'].get(key, 0) + 1
+
+    def begin_request(self, path, is_index):
+        """记录一次请求，返回要注入的故障 ('error' / 'reset' / 'truncate') 或 None"""
+        settings = self.settings
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['index_requests' if is_index else 'pdf_requests'] += 1
+            self._served += 1
+            attempt = self._attempts.get(path, 0)
+            self._attempts[path] = attempt + 1
+            if is_index and not settings['fail_index']:
+                return None
+            # 由 (种子, 路径, 第几次请求) 决定，与并发下请求到达的先后顺序无关
+            digest = hashlib.sha256(f"{settings['seed']}:{path}:{attempt}".encode()).digest()
+            roll = int.from_bytes(digest[:8], 'big') / 2 ** 64
+            for kind in ('error', 'reset', 'truncate'):
+                roll -= settings[f'{kind}_rate']
+                if roll < 0:
+                    self._stats['injected'][kind] += 1
+                    return kind
+        return None
+
+    def validators(self, entry):
+        """按 ETag 模式返回本次响应的 (ETag, Last-Modified)"""
+        mode = self.settings['etag']
+        if mode == 'none':
+            return None, None
+        if mode == 'last-modified':
+            return None, self.site.last_modified
+        if mode == 'changing':
+            with self._lock:
+                served = self._served
+            return f'{entry["etag"][:-1]}-{served}"', self.site.last_modified
+        return entry['etag'], self.site.last_modified
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'VisaReplay/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_status(self, status, extra_headers=()):
+        self.send_response(status)
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        self.server.count_status(status)
+
+    def _write_body(self, payload):
+        """按带宽上限分块发送"""
+        rate = self.server.settings['bandwidth_kib'] * 1024
+        for start in range(0, len(payload), WRITE_CHUNK):
+            chunk = payload[start:start + WRITE_CHUNK]
+            self.wfile.write(chunk)
+            self.server.count('bytes_sent', len(chunk))
+            if rate:
+                time.sleep(len(chunk) / rate)
+
+    def _not_modified(self, etag, last_modified):
+        if self.server.settings['etag'] == 'ignore':
+            return False
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # 有 If-None-Match 时忽略 If-Modified-Since (RFC 9110 13.2.2)
+            return etag is not None and etag in [value.strip() for value in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and last_modified:
+            try:
+                return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _byte_range(self, size, etag, last_modified):
+        """解析 Range: bytes=start-[end]，返回 (start, end) 或 None (返回完整内容)；无法满足时返回 False"""
+        header = self.headers.get('Range')
+        if not header or not self.server.settings['ranges'] or not header.startswith('bytes='):
+            return None
+        # If-Range 可以是 ETag 或 Last-Modified，不匹配时返回完整内容
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range not in (etag, last_modified):
+            return None
+        first, _, last = header[len('bytes='):].split(',')[0].strip().partition('-')
+        try:
+            start = int(first) if first else max(0, size - int(last))
+            end = int(last) if first and last else size - 1
+        except ValueError:
+            return None
+        if start >= size:
+            return False
+        return start, min(end, size - 1)
+
+    def do_GET(self):
+        server = self.server
+        path = urlsplit(self.path).path
+        if path == STATS_PATH:
+            body = json.dumps(server.stats()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if server.settings['latency_ms']:
+            time.sleep(server.settings['latency_ms'] / 1000)
+        entry = server.site.entries.get(path)
+        if entry is None:
+            server.count('requests')
+            self._send_status(404)
+            return
+
+        failure = server.begin_request(path, path == server.site.index_path)
+        if failure == 'error':
+            self._send_status(503, [('Retry-After', '1')])
+            return
+        if failure == 'reset':
+            self.close_connection = True
+            return
+
+        etag, last_modified = server.validators(entry)
+        headers = [('Content-Type', entry['type'])]
+        if etag:
+            headers.append(('ETag', etag))
+        if last_modified:
+            headers.append(('Last-Modified', last_modified))
+        if self._not_modified(etag, last_modified):
+            self._send_status(304, headers)
+            return
+
+        body = entry['body']
+        status = 200
+        byte_range = self._byte_range(len(body), etag, last_modified)
+        if byte_range is False:
+            self._send_status(416, [('Content-Range', f'bytes */{len(body)}')])
+            return
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers.append(('Content-Range', f'bytes {start}-{end}/{len(body)}'))
+            body = body[start:end + 1]
+            server.count('range_requests')
+        if server.settings['ranges']:
+            headers.append(('Accept-Ranges', 'bytes'))
+
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        server.count_status(status)
+        try:
+            if failure == 'truncate':
+                # 声明完整长度但只发送一半，然后断开连接
+                self._write_body(body[:len(body) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self._write_body(body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def start_server(site, settings=None, host='127.0.0.1', port=0, verbose=False):
+    """在后台线程中启动回放服务器，返回 (服务器, 索引页 URL)"""
+    server = ReplayServer((host, port), site, settings, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{site.index_path}"
+
+
+# ---------------------------------------------------------------------------
+# 下载器压测
+# ---------------------------------------------------------------------------
+
+def run_downloader(workdir, url, concurrency, retry_delay=0.05):
+    """
+    在 workdir 中运行一次 download_visas.py，返回 (退出码, 用时秒数)。
+    与 run_pipeline.sh 一样，需要解析时视为解析成功并保存页面校验信息 (不计入用时)
+    """
+    env = dict(
+        os.environ,
+        VISA_DECISIONS_URL=url,
+        DOWNLOAD_CONCURRENCY=str(concurrency),
+        DOWNLOAD_RETRY_DELAY=str(retry_delay),
+    )
+    script = os.path.join(REPO_DIR, "download_visas.py")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, script], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    seconds = time.perf_counter() - started
+    if result.returncode == 0:
+        subprocess.run([sys.executable, script, "--commit-validators"], cwd=workdir, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode, seconds
+
+
+def verify_download(workdir, site):
+    """核对下载目录中的文件与录制内容逐字节一致，返回 (一致的文件数, 残留的 .part 文件数)"""
+    download_dir = os.path.join(workdir, "data", "visa_pdfs")
+    matched = 0
+    for path, entry in site.entries.items():
+        if path == site.index_path:
+            continue
+        file_path = os.path.join(download_dir, os.path.basename(path))
+        if os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                matched += f.read() == entry['body']
+    partial = len([name for name in os.listdir(download_dir) if name.endswith('.part')]) if os.path.isdir(download_dir) else 0
+    return matched, partial
+
+
+def measure_run(server, site, workdir, url, concurrency):
+    server.reset_stats()
+    exit_code, seconds = run_downloader(workdir, url, concurrency)
+    matched, partial = verify_download(workdir, site)
+    stats = server.stats()
+    return {
+        'exit_code': exit_code,
+        'seconds': round(seconds, 3),
+        'files_ok': matched,
+        'files_expected': site.pdf_count,
+        'partial_files': partial,
+        'complete': matched == site.pdf_count and not partial,
+        'requests': stats['requests'],
+        'status': stats['status'],
+        'bytes_sent': stats['bytes_sent'],
+        'transfer_ratio': round(stats['bytes_sent'] / site.pdf_bytes, 3) if site.pdf_bytes else None,
+        'range_requests': stats['range_requests'],
+        'injected': stats['injected'],
+    }
+
+
+def run_bench(site, levels, network, failure_rates, seed):
+    """
+    三组场景 (每次运行都在新的工作目录中进行):
+      concurrency  空目录完整下载，比较不同并发数
+      conditional  已有文件和校验信息时重复运行，比较各种 ETag 行为下的请求数和传输量
+      resume       注入 503 / 断开 / 截断，比较支持与不支持 Range 时的总传输量
+    """
+    report = {'concurrency': [], 'conditional': [], 'resume': []}
+    server, url = start_server(site, dict(network, seed=seed))
+    workdirs = []
+
+    def new_workdir():
+        workdirs.append(tempfile.mkdtemp(prefix="visa_replay_"))
+        return workdirs[-1]
+
+    try:
+        for concurrency in levels:
+            result = measure_run(server, site, new_workdir(), url, concurrency)
+            result['concurrency'] = concurrency
+            report['concurrency'].append(result)
+            print(f"并发 {concurrency:>2}: {result['seconds']:>7.2f} 秒  文件 {result['files_ok']}/{result['files_expected']}  "
+                  f"请求 {result['requests']}  退出码 {result['exit_code']}")
+
+        top = max(levels)
+        for mode in ETAG_MODES:
+            server.settings['etag'] = mode
+            workdir = new_workdir()
+            # 第一次下载全部文件，第二次保存当前模式下的校验信息，测量第三次
+            run_downloader(workdir, url, top)
+            run_downloader(workdir, url, top)
+            result = measure_run(server, site, workdir, url, top)
+            result['etag'] = mode
+            report['conditional'].append(result)
+            print(f"ETag {mode:<13}: {result['seconds']:>7.2f} 秒  状态 {result['status']}  "
+                  f"传输 {result['bytes_sent']} 字节  退出码 {result['exit_code']}")
+        server.settings['etag'] = network.get('etag', 'strong')
+
+        server.settings.update(failure_rates)
+        for ranges in (True, False):
+            server.settings['ranges'] = ranges
+            result = measure_run(server, site, new_workdir(), url, top)
+            result['ranges'] = ranges
+            report['resume'].append(result)
+            print(f"续传{'开启' if ranges else '关闭'}: {result['seconds']:>7.2f} 秒  文件 {result['files_ok']}/{result['files_expected']}  "
+                  f"传输量/文件总量 {result['transfer_ratio']}  注入 {result['injected']}  退出码 {result['exit_code']}")
+    finally:
+        server.shutdown()
+        server.server_close()
+        for workdir in workdirs:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+# ---------------------------------------------------------------------------
+# 命令行
+# ---------------------------------------------------------------------------
+
+def add_network_arguments(parser, latency_ms, bandwidth_kib):
+    parser.add_argument('--latency-ms', type=float, default=latency_ms, help="每个请求的延迟 (毫秒)")
+    parser.add_argument('--bandwidth-kib', type=float, default=bandwidth_kib, help="每个连接的带宽上限 (KiB/秒)，0 表示不限")
+    parser.add_argument('--seed', type=int, default=42, help="故障注入的随机种子")
+
+
+def add_failure_arguments(parser, error_rate, reset_rate, truncate_rate):
+    parser.add_argument('--error-rate', type=float, default=error_rate, help="返回 503 的比例")
+    parser.add_argument('--reset-rate', type=float, default=reset_rate, help="直接断开连接的比例")
+    parser.add_argument('--truncate-rate', type=float, default=truncate_rate, help="只发送一半内容的比例")
+
+
+def load_or_build_site(args):
+    """bench 使用的录制: 指定的录制目录、合成数据或仓库自带的 data/visa_pdfs"""
+    if args.recording:
+        return ReplaySite(args.recording), None
+    tmp_dir = tempfile.mkdtemp(prefix="visa_recording_")
+    pdf_dir = os.path.join(REPO_DIR, "data", "visa_pdfs")
+    if args.synthetic_weeks:
+        from synthetic_pdfs import generate_dataset
+        pdf_dir = os.path.join(tmp_dir, "source")
+        generate_dataset(pdf_dir, args.synthetic_weeks, args.rows_per_week, seed=args.seed)
+    build_recording(pdf_dir, os.path.join(tmp_dir, "recording"))
+    return ReplaySite(os.path.join(tmp_dir, "recording")), tmp_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="签证结果页面的离线录制与回放")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help="从线上页面录制索引页和全部 PDF")
+    record.add_argument('--url', default=DEFAULT_URL)
+    record.add_argument('--out', required=True, help="录制目录")
+
+    build = commands.add_parser('build', help="用本地 PDF 生成录制 (不访问网络)")
+    build.add_argument('--pdf-dir', default=os.path.join(REPO_DIR, "data", "visa_pdfs"))
+    build.add_argument('--out', required=True, help="录制目录")
+    build.add_argument('--url', default=DEFAULT_URL, help="回放时使用的页面路径取自该 URL")
+
+    serve = commands.add_parser('serve', help="回放一份录制")
+    serve.add_argument('--recording', required=True, help="录制目录")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--etag', choices=ETAG_MODES, default='strong')
+    serve.add_argument('--no-ranges', action='store_true', help="不支持 Range 请求")
+    serve.add_argument('--fail-index', action='store_true', help="故障也注入到索引页")
+    serve.add_argument('--verbose', action='store_true', help="打印每个请求")
+    add_network_arguments(serve, 0, 0)
+    add_failure_arguments(serve, 0, 0, 0)
+
+    bench = commands.add_parser('bench', help="用回放服务器压测 download_visas.py")
+    bench.add_argument('--recording', help="录制目录 (默认使用 data/visa_pdfs 生成)")
+    bench.add_argument('--synthetic-weeks', type=int, default=0, help="改用合成 PDF 的周数")
+    bench.add_argument('--rows-per-week', type=int, default=1000)
+    bench.add_argument('--concurrency', default="1,2,4,8", help="并发下载数列表")
+    bench.add_argument('--output', default=DEFAULT_REPORT, help="JSON 报告路径")
+    add_network_arguments(bench, 50, 512)
+    add_failure_arguments(bench, 0.1, 0.05, 0.5)
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        recording = record_site(args.url, args.out)
+        print(f"已录制 {len(recording['files'])} 个 PDF 到 {args.out}")
+        return 0
+
+    if args.command == 'build':
+        recording = build_recording(args.pdf_dir, args.out, args.url)
+        print(f"已生成录制: {len(recording['files'])} 个 PDF，保存在 {args.out}")
+        return 0
+
+    if args.command == 'serve':
+        site = ReplaySite(args.recording)
+        settings = {
+            'latency_ms': args.latency_ms, 'bandwidth_kib': args.bandwidth_kib, 'etag': args.etag,
+            'ranges': not args.no_ranges, 'fail_index': args.fail_index, 'seed': args.seed,
+            'error_rate': args.error_rate, 'reset_rate': args.reset_rate, 'truncate_rate': args.truncate_rate,
+        }
+        server = ReplayServer((args.host, args.port), site, settings, args.verbose)
+        print(f"回放 {site.pdf_count} 个 PDF，使用: "
+              f"VISA_DECISIONS_URL=http://{args.host}:{server.server_address[1]}{site.index_path}")
+        print(f"统计信息: http://{args.host}:{server.server_address[1]}{STATS_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    site, tmp_dir = load_or_build_site(args)
+    network = {'latency_ms': args.latency_ms, 'bandwidth_kib': args.bandwidth_kib}
+    failure_rates = {'error_rate': args.error_rate, 'reset_rate': args.reset_rate, 'truncate_rate': args.truncate_rate}
+    levels = [int(value) for value in args.concurrency.split(',')]
+    print(f"回放 {site.pdf_count} 个 PDF ({site.pdf_bytes / 1024:.0f} KiB)，"
+          f"延迟 {args.latency_ms} 毫秒，每连接带宽 {args.bandwidth_kib or '不限'} KiB/秒")
+    try:
+        results = run_bench(site, levels, network, failure_rates, args.seed)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'config': dict(network, **failure_rates, seed=args.seed, pdf_count=site.pdf_count, pdf_bytes=site.pdf_bytes),
+        **results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n报告已写入 {args.output}")
+
+    # 任何一次运行结束后下载目录与录制内容不一致 (缺文件、内容不同或残留 .part) 都视为失败
+    incomplete = [f"{scenario}[{index}]" for scenario in ('concurrency', 'conditional', 'resume')
+                  for index, result in enumerate(results[scenario]) if not result['complete']]
+    if incomplete:
+        print(f"错误: {len(incomplete)} 次运行未得到与录制一致的全部文件: {', '.join(incomplete)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
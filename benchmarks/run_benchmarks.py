@@ -0,0 +1,247 @@
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_pdfs import generate_dataset
+
+# 端到端基准测试: 生成合成 PDF -> 解析入库 -> 测量 Web 接口。
+# 所有步骤都在临时工作目录中运行 (仓库中的相对路径 data/... 指向该目录)，
+# 解析和 Web 测量各在独立子进程中执行，峰值内存互不影响。
+
+DEFAULT_REPORT = os.path.join(BENCH_DIR, "results", "latest.json")
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# 编码格式对比: 每种格式重复编码的次数，以及批量查询的申请号数量
+ENCODE_REPEATS = 50
+BATCH_SIZE = 100
+
+
+def latency_summary(samples_ms, percentiles=LATENCY_PERCENTILES):
+    """延迟样本 (毫秒) 的分位数汇总"""
+    values = np.asarray(samples_ms, dtype=float)
+    if not len(values):
+        return {'samples': 0}
+    summary = {f"p{q}_ms": round(float(np.percentile(values, q)), 3) for q in percentiles}
+    summary['mean_ms'] = round(float(values.mean()), 3)
+    summary['samples'] = int(len(values))
+    return summary
+
+
+def child_peak_rss_mb():
+    """已结束子进程中最大的峰值常驻内存 (MB)；解析是第一个子进程，因此即为解析的峰值"""
+    return round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+
+def run_step(args, workdir, env=None):
+    """在工作目录中运行一个子进程，返回 (耗时秒数, 峰值内存 MB, 标准输出)"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        args, cwd=workdir, env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    return time.perf_counter() - start, child_peak_rss_mb(), result.stdout
+
+
+def compare_wire_formats(dashboard, payloads):
+    """
+    对比 /api/data 与批量查询的各种编码: 响应体大小、gzip 后大小和编码耗时 (中位数)。
+    payloads 为 {名称: (返回内容, 转换为列式文档的函数)}。
+    """
+    import wire_format
+
+    formats = ['json', 'columnar'] + (['msgpack'] if wire_format.msgpack_available() else [])
+    encoders = {
+        'json': lambda payload, _: dashboard.jsonify(payload).get_data(),
+        'columnar': lambda payload, convert: wire_format.encode(convert(payload), 'columnar')[0],
+        'msgpack': lambda payload, convert: wire_format.encode(convert(payload), 'msgpack')[0],
+    }
+    result = {}
+    with dashboard.app.app_context():
+        for name, (payload, convert) in payloads.items():
+            result[name] = {}
+            for fmt in formats:
+                samples = []
+                for _ in range(ENCODE_REPEATS):
+                    t = time.perf_counter()
+                    body = encoders[fmt](payload, convert)
+                    samples.append((time.perf_counter() - t) * 1000)
+                result[name][fmt] = {
+                    'bytes': len(body),
+                    'gzip_bytes': len(gzip.compress(body, compresslevel=6, mtime=0)),
+                    'encode_p50_ms': round(float(np.percentile(samples, 50)), 4),
+                }
+    return result
+
+
+def probe_web(searches, seed):
+    """
+    (在工作目录的子进程中运行) 测量 Web 接口:
+    冷启动 = 导入应用 + 第一次 /api/data；之后测量 /api/data 与 /api/search 的延迟分布。
+    """
+    start = time.perf_counter()
+    sys.path.insert(0, REPO_DIR)
+    import visa_dashboard
+    client = visa_dashboard.app.test_client()
+    import_s = time.perf_counter() - start
+    response = client.get('/api/data')
+    cold_start_s = time.perf_counter() - start
+    assert response.status_code == 200
+
+    def timed(path, repeat):
+        samples = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            client.get(path)
+            samples.append((time.perf_counter() - t) * 1000)
+        return samples
+
+    conn = sqlite3.connect(visa_dashboard.DB_NAME)
+    numbers = [row[0] for row in conn.execute(f"SELECT application_number FROM {visa_dashboard.TABLE_NAME}")]
+    conn.close()
+    rng = random.Random(seed)
+    existing = rng.choices(numbers, k=searches) if numbers else []
+    low, high = (min(numbers), max(numbers)) if numbers else (0, 1)
+    missing = [rng.randint(low, high) for _ in range(searches)]
+
+    # 每个申请号只查询一次，测量的是缓存未命中的路径
+    search_hit = []
+    for number in existing:
+        search_hit += timed(f'/api/search?app_number={number}', 1)
+    search_miss = []
+    for number in missing:
+        search_miss += timed(f'/api/search?app_number={number}', 1)
+
+    import wire_format
+    batch = existing[:BATCH_SIZE]
+    batch_payload = visa_dashboard.batch_search_payload(batch) if batch else {'success': True, 'results': [], 'count': 0}
+    formats = compare_wire_formats(visa_dashboard, {
+        'api_data': (visa_dashboard.get_cached_aggregate('data', visa_dashboard.build_visa_data), wire_format.columnar_data),
+        'api_search_batch': (batch_payload, wire_format.columnar_search),
+    })
+
+    return {
+        'import_s': round(import_s, 3),
+        'cold_start_s': round(cold_start_s, 3),
+        'api_data': latency_summary(timed('/api/data', 200)),
+        'api_search_existing': latency_summary(search_hit),
+        'api_search_random': latency_summary(search_miss),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'wire_formats': formats,
+    }
+
+
+def run_benchmarks(weeks, rows_per_week, searches, seed, workdir):
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {'weeks': weeks, 'rows_per_week': rows_per_week, 'searches': searches, 'seed': seed},
+    }
+
+    pdf_dir = os.path.join(workdir, "data", "visa_pdfs")
+    start = time.perf_counter()
+    files = generate_dataset(pdf_dir, weeks, rows_per_week, seed=seed)
+    report['dataset'] = {
+        'files': len(files),
+        'rows': sum(rows for _, rows in files),
+        'pdf_bytes': sum(os.path.getsize(os.path.join(pdf_dir, name)) for name, _ in files),
+        'generate_s': round(time.perf_counter() - start, 3),
+    }
+    print(f"已生成 {len(files)} 个 PDF，共 {report['dataset']['rows']} 条决定")
+
+    parse_script = os.path.join(REPO_DIR, "parse_pdfs.py")
+    parse_s, parse_rss, _ = run_step([sys.executable, parse_script], workdir)
+    conn = sqlite3.connect(os.path.join(workdir, "data", "visas.db"))
+    stored_rows = conn.execute("SELECT COUNT(*) FROM visa_decisions").fetchone()[0]
+    conn.close()
+    # 文件未变化时再次运行，测量增量入库的开销
+    reparse_s, _, _ = run_step([sys.executable, parse_script], workdir)
+    # 删除全部数据后重建，行来自提取缓存，不调用 pdfplumber
+    rebuild_s, _, _ = run_step([sys.executable, parse_script, '--rebuild'], workdir)
+    report['parse'] = {
+        'seconds': round(parse_s, 3),
+        'rows_stored': stored_rows,
+        'rows_per_s': round(stored_rows / parse_s, 1) if parse_s else None,
+        'peak_rss_mb': parse_rss,
+        'reparse_unchanged_s': round(reparse_s, 3),
+        'rebuild_from_cache_s': round(rebuild_s, 3),
+    }
+    print(f"解析完成: {stored_rows} 条记录，用时 {parse_s:.1f} 秒")
+
+    data_dir = os.path.join(workdir, "data")
+    report['storage'] = {
+        name: os.path.getsize(os.path.join(data_dir, name))
+        for name in ("visas.db", "visas.snapshot", "visas.parquet")
+        if os.path.exists(os.path.join(data_dir, name))
+    }
+
+    # 基准测试不应被限流
+    env = dict(os.environ, SEARCH_RATE_LIMIT="0")
+    _, _, output = run_step(
+        [sys.executable, os.path.abspath(__file__), '--probe-web', '--searches', str(searches), '--seed', str(seed)],
+        workdir, env
+    )
+    report['web'] = json.loads(output.strip().splitlines()[-1])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="签证数据看板端到端基准测试")
+    parser.add_argument('--weeks', type=int, default=52, help="生成的周数")
+    parser.add_argument('--rows-per-week', type=int, default=1000, help="每周平均决定数")
+    parser.add_argument('--searches', type=int, default=500, help="每种查询的次数")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=DEFAULT_REPORT, help="JSON 报告路径")
+    parser.add_argument('--workdir', help="工作目录 (默认使用临时目录并在结束后删除)")
+    parser.add_argument('--probe-web', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe_web:
+        # 子进程模式: 只输出一行 JSON
+        with open(os.devnull, 'w') as devnull:
+            stdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                result = probe_web(args.searches, args.seed)
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(result))
+        return 0
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="visa_bench_")
+    try:
+        report = run_benchmarks(args.weeks, args.rows_per_week, args.searches, args.seed, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"\n报告已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
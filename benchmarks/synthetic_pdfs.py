@@ -0,0 +1,146 @@
+import os
+import sys
+import random
+import argparse
+from datetime import date, timedelta
+
+# 生成与领事馆发布格式一致的合成决定 PDF: A4 页面，标题行 + 两列表格 (申请号, 决定)，
+# 单元格用矩形边框绘制，pdfplumber 的 extract_tables() 可以像读取真实文件一样识别。
+# 不依赖任何 PDF 库，直接写出 PDF 对象。
+
+PAGE_WIDTH = 595.2
+PAGE_HEIGHT = 841.8
+ROW_HEIGHT = 15.0
+TABLE_LEFT = 110.0
+COLUMN_WIDTHS = (200.0, 180.0)
+TOP_MARGIN = 60.0
+BOTTOM_MARGIN = 50.0
+FONT_SIZE = 10
+
+MISSION = "Beijing/Shanghai/Hong Kong"
+HEADER_ROW = ("Application Number", "Decision")
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _text(x, y, text, size=FONT_SIZE):
+    return f"BT /F1 {size} Tf {x:.1f} {y:.1f} Td ({_escape(text)}) Tj ET"
+
+
+def _page_content(rows, title_lines):
+    """一页的内容流: 标题文字 + 表格 (每个单元格一个矩形边框)"""
+    ops = ["0.5 w"]
+    y = PAGE_HEIGHT - TOP_MARGIN
+    for line in title_lines:
+        ops.append(_text(TABLE_LEFT, y, line, 12))
+        y -= 20
+    if title_lines:
+        y -= 10
+    for row in rows:
+        x = TABLE_LEFT
+        for value, width in zip(row, COLUMN_WIDTHS):
+            ops.append(f"{x:.1f} {y - ROW_HEIGHT:.1f} {width:.1f} {ROW_HEIGHT:.1f} re S")
+            ops.append(_text(x + 4, y - ROW_HEIGHT + 4, value))
+            x += width
+        y -= ROW_HEIGHT
+    return "\n".join(ops).encode('latin-1')
+
+
+def _rows_per_page(title_lines):
+    available = PAGE_HEIGHT - TOP_MARGIN - BOTTOM_MARGIN - (len(title_lines) * 20 + 10 if title_lines else 0)
+    return int(available // ROW_HEIGHT)
+
+
+def write_decision_pdf(path, start_date, end_date, decisions):
+    """写出一周的决定 PDF，decisions 为 [(申请号, 决定)]"""
+    title_lines = [
+        f"Decisions for period from {start_date:%d/%m/%Y} to {end_date:%d/%m/%Y}",
+        f"Mission: {MISSION}",
+    ]
+    table_rows = [HEADER_ROW] + [(str(number), decision) for number, decision in decisions]
+
+    pages = []
+    index = 0
+    first = True
+    while index < len(table_rows) or first:
+        titles = title_lines if first else []
+        count = _rows_per_page(titles)
+        pages.append(_page_content(table_rows[index:index + count], titles))
+        index += count
+        first = False
+
+    # 对象编号: 1 目录, 2 页面树, 3 字体, 之后每页占两个对象 (页面, 内容流)
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+    kids = []
+    for i, content in enumerate(pages):
+        page_id, content_id = 4 + i * 2, 5 + i * 2
+        kids.append(f"{page_id} 0 R")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode('latin-1')
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode('latin-1')
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(output)
+    count = max(objects) + 1
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % count
+    for object_id in range(1, count):
+        output += b"%010d 00000 n \n" % offsets[object_id]
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref_offset)
+
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def decision_filename(start_date, end_date):
+    """与领事馆一致的文件名，例如 Beijing_Visa_Decisions_02_June_to_08_June_2025.pdf"""
+    return f"Beijing_Visa_Decisions_{start_date:%d_%B}_to_{end_date:%d_%B_%Y}.pdf"
+
+
+def generate_dataset(out_dir, weeks=52, rows_per_week=1000, first_monday=date(2023, 1, 2),
+                     refusal_rate=0.07, seed=42):
+    """
+    生成 weeks 周的决定 PDF。申请号随时间整体递增 (排队处理)，
+    每周在一个滑动窗口内随机取号；每周的拒签率围绕 refusal_rate 波动。
+    返回 [(文件名, 行数)]。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    base_number = 60_000_000
+    spread = rows_per_week * 20
+    generated = []
+    for week in range(weeks):
+        start_date = first_monday + timedelta(weeks=week)
+        end_date = start_date + timedelta(days=6)
+        center = base_number + week * rows_per_week * 10
+        count = max(1, int(rng.gauss(rows_per_week, rows_per_week * 0.15)))
+        numbers = sorted(rng.sample(range(center - spread, center + spread), count))
+        week_rate = min(max(rng.gauss(refusal_rate, refusal_rate * 0.4), 0.0), 1.0)
+        decisions = [(n, 'Refused' if rng.random() < week_rate else 'Approved') for n in numbers]
+        filename = decision_filename(start_date, end_date)
+        write_decision_pdf(os.path.join(out_dir, filename), start_date, end_date, decisions)
+        generated.append((filename, len(decisions)))
+    return generated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成合成的签证决定 PDF")
+    parser.add_argument('out_dir', help="输出目录")
+    parser.add_argument('--weeks', type=int, default=52)
+    parser.add_argument('--rows-per-week', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    files = generate_dataset(args.out_dir, args.weeks, args.rows_per_week, seed=args.seed)
+    print(f"已生成 {len(files)} 个 PDF，共 {sum(rows for _, rows in files)} 条决定")
+    sys.exit(0)
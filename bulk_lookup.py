@@ -0,0 +1,280 @@
+import io
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+from itertools import chain
+
+import numpy as np
+
+from snapshot import DB_NAME, SNAPSHOT_PATH, Snapshot, write_snapshot
+from date_labels import format_date_range_chinese
+
+# 离线批量查询: 使用 Web 服务同一份列式快照 (data/visas.snapshot，不存在时从数据库生成)，
+# 按块读取输入文件或标准输入中的申请号，每块排序后用一次 searchsorted 完成全部查找，
+# 结果按输入顺序写成 CSV 或 JSON Lines。内存占用只与快照大小和块大小有关，与输入长度无关。
+
+# 每次读取的输入字节数 (约 50 万个申请号)
+CHUNK_BYTES = 4 * 1024 * 1024
+
+OUTPUT_COLUMNS = ('application_number', 'status', 'decision', 'week', 'date_range_start', 'date_range_end', 'source_file')
+STATUS_FOUND = 'found'
+STATUS_NOT_FOUND = 'not_found'
+STATUS_INVALID = 'invalid'
+
+# 超过 18 位的数字不可能是申请号，也放不进 int64
+MAX_DIGITS = 18
+DIGITS = b'0123456789'
+WHITESPACE = b' \t\r\n\f\v'
+POWERS_OF_TEN = 10 ** np.arange(1, MAX_DIGITS, dtype=np.int64)
+
+
+class LookupIndex:
+    """
+    快照之上的批量查询索引: 不同申请号的有序数组及每个申请号在快照中的首行和行数。
+    每行输出的内容只取决于 (源文件, 决定)，记录表按这一组合预先生成，查询时只处理整数数组。
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        numbers = snapshot.application_numbers
+        starts = np.flatnonzero(np.r_[True, numbers[1:] != numbers[:-1]]) if len(numbers) else np.empty(0, dtype=np.int64)
+        self.keys = numbers[starts]
+        self.starts = starts
+        self.counts = np.diff(np.r_[starts, len(numbers)])
+        self.n_codes = max(snapshot.decisions, default=0) + 1
+
+        # 记录编号 = 源文件下标 * n_codes + 决定编码；最后两个编号表示没有记录和格式错误
+        self.records = []
+        for source in snapshot.sources:
+            week = snapshot.weeks[source['week_id']] if source['week_id'] is not None else None
+            start, end = (week['start'], week['end']) if week else ('', '')
+            label = format_date_range_chinese(start, end) if week else ''
+            for code in range(self.n_codes):
+                self.records.append({
+                    'status': STATUS_FOUND,
+                    'decision': snapshot.decisions.get(code, 'N/A'),
+                    'week': label,
+                    'date_range_start': start,
+                    'date_range_end': end,
+                    'source_file': source['source_file'],
+                })
+        self.not_found_id = len(self.records)
+        self.invalid_id = self.not_found_id + 1
+        self.records.append({'status': STATUS_NOT_FOUND})
+        self.records.append({'status': STATUS_INVALID})
+
+    @property
+    def nbytes(self):
+        return int(self.keys.nbytes + self.starts.nbytes + self.counts.nbytes)
+
+    def lookup(self, queries):
+        """
+        查询一批申请号 (int64 数组)。返回 (每个输出行对应的查询下标, 每个输出行的记录编号)：
+        有记录的申请号每条记录输出一行 (按周排序)，没有记录的输出一行 not_found。
+        """
+        n = len(queries)
+        if not len(self.keys):
+            return np.arange(n), np.full(n, self.not_found_id, dtype=np.int64)
+
+        # 先排序再查找，二分查找按顺序访问索引，比随机访问快数倍
+        order = np.argsort(queries)
+        positions = np.empty(n, dtype=np.int64)
+        positions[order] = np.searchsorted(self.keys, queries[order])
+        positions = np.minimum(positions, len(self.keys) - 1)
+        found = self.keys[positions] == queries
+
+        counts = np.where(found, self.counts[positions], 0)
+        lines = np.maximum(counts, 1)
+        query_of_line = np.repeat(np.arange(n), lines)
+        first_line = np.cumsum(lines) - lines
+        offsets = np.arange(len(query_of_line)) - np.repeat(first_line, lines)
+        rows = np.repeat(np.where(found, self.starts[positions], 0), lines) + offsets
+        found_line = np.repeat(found, lines)
+        record_ids = np.where(
+            found_line,
+            self.snapshot.source_ids[rows].astype(np.int64) * self.n_codes + self.snapshot.decision_codes[rows],
+            self.not_found_id
+        )
+        return query_of_line, record_ids
+
+
+class CsvFormat:
+    """CSV 输出: 每个记录编号对应一段以逗号开头的行尾，行首为申请号"""
+
+    def __init__(self, records):
+        self.suffixes = [self._row([''] + [record.get(column, '') for column in OUTPUT_COLUMNS[1:]])
+                         for record in records]
+
+    @staticmethod
+    def _row(values):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerow(values)
+        return buffer.getvalue()
+
+    def header(self):
+        return self._row(OUTPUT_COLUMNS)
+
+    def prefixes(self, texts, valid=None):
+        """每行开头的申请号；格式错误的原文需要按 CSV 规则转义"""
+        if valid is None:
+            return texts
+        return [text if ok else self._row([text])[:-1] for text, ok in zip(texts, valid)]
+
+
+class JsonLinesFormat:
+    """JSON Lines 输出: 每行一个对象，键与 CSV 的列相同"""
+
+    def __init__(self, records):
+        self.suffixes = [',' + json.dumps(record, ensure_ascii=False, separators=(',', ':'))[1:] + '\n' for record in records]
+
+    def header(self):
+        return ''
+
+    def prefixes(self, texts, valid=None):
+        if valid is None:
+            return ['{"application_number":' + text for text in texts]
+        return ['{"application_number":' + text if ok else
+                '{"application_number":null,"input":' + json.dumps(text, ensure_ascii=False)
+                for text, ok in zip(texts, valid)]
+
+
+OUTPUT_FORMATS = {'csv': CsvFormat, 'jsonl': JsonLinesFormat}
+
+
+def open_index(snapshot_path=SNAPSHOT_PATH, db_path=DB_NAME, rebuild=False):
+    """加载 Web 服务使用的快照；快照不存在或 rebuild=True 时先从数据库生成"""
+    if rebuild or not os.path.exists(snapshot_path):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"数据库 '{db_path}' 不存在")
+        print(f"正在从 {db_path} 生成快照 {snapshot_path}...", file=sys.stderr)
+        conn = sqlite3.connect(db_path)
+        try:
+            write_snapshot(conn, snapshot_path)
+        finally:
+            conn.close()
+    return LookupIndex(Snapshot(snapshot_path))
+
+
+def iter_chunks(stream, chunk_bytes=CHUNK_BYTES):
+    """按块读取输入，每块截断在最后一个换行处，剩余部分并入下一块"""
+    pending = b''
+    while True:
+        data = stream.read(chunk_bytes)
+        if not data:
+            if pending.strip():
+                yield pending
+            return
+        data = pending + data
+        cut = data.rfind(b'\n')
+        if cut < 0:
+            pending = data
+            continue
+        pending = data[cut + 1:]
+        yield data[:cut + 1]
+
+
+def parse_chunk(chunk):
+    """
+    把一块输入拆成申请号 (空白或逗号分隔)。返回 (每个申请号的规范文本, int64 数组, 格式正确的掩码)；
+    全部正确时掩码为 None。整块都是规范的数字时用 np.fromstring 一次转换，不逐个构造 Python 整数；
+    有前导零、超长或其他字符时逐个检查。
+    """
+    chunk = chunk.replace(b',', b' ')
+    digits = chunk.translate(None, WHITESPACE)
+    if not digits.translate(None, DIGITS):
+        numbers = np.fromstring(chunk, dtype=np.int64, sep=' ')
+        # 每个数的规范位数之和等于输入的数字个数，说明没有前导零，也没有溢出
+        canonical = np.searchsorted(POWERS_OF_TEN, numbers, side='right') + 1
+        if not len(numbers) or (numbers.max() < 10 ** MAX_DIGITS and int(canonical.sum()) == len(digits)):
+            return chunk.decode('ascii').split(), numbers, None
+    tokens = chunk.decode('utf-8', 'replace').split()
+    valid = np.array([token.isdigit() and token.isascii() and len(token.lstrip('0')) <= MAX_DIGITS
+                      for token in tokens], dtype=bool)
+    numbers = np.array([int(token) if ok else -1 for token, ok in zip(tokens, valid)], dtype=np.int64)
+    texts = [str(number) if ok else token for token, number, ok in zip(tokens, numbers.tolist(), valid.tolist())]
+    return texts, numbers, valid
+
+
+def bulk_lookup(index, stream, out, output_format='csv', chunk_bytes=CHUNK_BYTES, header=True):
+    """查询 stream 中的全部申请号并写入 out (文本流)，返回统计信息"""
+    writer = OUTPUT_FORMATS[output_format](index.records)
+    suffixes = writer.suffixes
+    stats = {'numbers': 0, 'found': 0, 'not_found': 0, 'invalid': 0, 'lines': 0, 'lookup_s': 0.0}
+    started = time.perf_counter()
+    if header:
+        out.write(writer.header())
+
+    for chunk in iter_chunks(stream, chunk_bytes):
+        texts, numbers, valid = parse_chunk(chunk)
+        if not texts:
+            continue
+        t = time.perf_counter()
+        query_of_line, record_ids = index.lookup(numbers)
+        stats['lookup_s'] += time.perf_counter() - t
+
+        if valid is not None:
+            invalid_line = ~valid[query_of_line]
+            record_ids[invalid_line] = index.invalid_id
+            stats['invalid'] += int((~valid).sum())
+        # 每个申请号只有一行输出时 (最常见) 直接按输入顺序使用文本，不再按下标取
+        line_texts = texts if len(query_of_line) == len(texts) else list(map(texts.__getitem__, query_of_line.tolist()))
+        prefixes = writer.prefixes(line_texts, None if valid is None else valid[query_of_line].tolist())
+        out.write(''.join(chain.from_iterable(zip(prefixes, map(suffixes.__getitem__, record_ids.tolist())))))
+
+        first_lines = np.r_[True, query_of_line[1:] != query_of_line[:-1]]
+        stats['numbers'] += len(texts)
+        stats['not_found'] += int((record_ids == index.not_found_id).sum())
+        stats['found'] += int(((record_ids < index.not_found_id) & first_lines).sum())
+        stats['lines'] += len(record_ids)
+
+    stats['total_s'] = time.perf_counter() - started
+    return stats
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="离线批量查询申请号 (使用 Web 服务的快照索引)")
+    parser.add_argument('input', nargs='?', default='-', help="申请号文件，每行一个 (默认读取标准输入)")
+    parser.add_argument('-o', '--output', default='-', help="输出文件 (默认写到标准输出)")
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='csv', help="输出格式")
+    parser.add_argument('--no-header', action='store_true', help="CSV 不输出表头")
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help="快照路径")
+    parser.add_argument('--db', default=DB_NAME, help="快照不存在时用于生成快照的数据库")
+    parser.add_argument('--rebuild-index', action='store_true', help="先从数据库重新生成快照")
+    parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES, help="每次读取的输入字节数")
+    args = parser.parse_args()
+
+    try:
+        started = time.perf_counter()
+        index = open_index(args.snapshot, args.db, args.rebuild_index)
+        load_s = time.perf_counter() - started
+    except (OSError, ValueError) as e:
+        print(f"无法加载索引: {e}", file=sys.stderr)
+        return 1
+    print(f"索引: {len(index.keys)} 个申请号 / {len(index.snapshot)} 条记录，"
+          f"{index.nbytes / 1024 / 1024:.1f} MiB，加载用时 {load_s:.2f} 秒", file=sys.stderr)
+
+    stream = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+    try:
+        stats = bulk_lookup(index, stream, out, args.format, args.chunk_bytes, not args.no_header)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+        if out is not sys.stdout:
+            out.close()
+
+    lookup_rate = stats['numbers'] / stats['lookup_s'] if stats['lookup_s'] else 0
+    total_rate = stats['numbers'] / stats['total_s'] if stats['total_s'] else 0
+    print(f"查询 {stats['numbers']} 个申请号: 有记录 {stats['found']}，无记录 {stats['not_found']}，"
+          f"格式错误 {stats['invalid']}，输出 {stats['lines']} 行", file=sys.stderr)
+    print(f"用时 {stats['total_s']:.2f} 秒: 查找 {lookup_rate / 1e6:.2f} 百万次/秒，"
+          f"含读写 {total_rate / 1e6:.2f} 百万次/秒", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+# 日期范围的中文标签，Web 服务与离线批量查询共用 (不依赖 Flask 或 pandas)
+
+
+def format_date_range_chinese(start_date, end_date):
+    """将日期范围格式化为中文显示"""
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+        
+        # 月份映射
+        month_map = {
+            1: '1月', 2: '2月', 3: '3月', 4: '4月', 5: '5月', 6: '6月',
+            7: '7月', 8: '8月', 9: '9月', 10: '10月', 11: '11月', 12: '12月'
+        }
+        
+        start_month_cn = month_map[start.month]
+        end_month_cn = month_map[end.month]
+        
+        if start.month == end.month:
+            return f"{start_month_cn}{start.day}日-{end.day}日"
+        else:
+            return f"{start_month_cn}{start.day}日-{end_month_cn}{end.day}日"
+    except:
+        return f"{start_date} 至 {end_date}"
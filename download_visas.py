@@ -1,15 +1,229 @@
 # filepath: /Users/kkter/KKTer/Learn_File/Programing/Project/VisaResults/download_visas.py
 import os
+import sys
+import json
+import argparse
+import time
+import hashlib
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 
-# 目标网页 URL
-URL = "https://www.ireland.ie/en/china/beijing/services/visas/visa-decisions/"
+# 目标网页 URL，可用环境变量指向本地的回放服务器 (benchmarks/replay_site.py)
+DEFAULT_URL = "https://www.ireland.ie/en/china/beijing/services/visas/visa-decisions/"
+URL = os.environ.get("VISA_DECISIONS_URL", DEFAULT_URL)
+
+# 同时下载的 PDF 数量
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", 4))
+
+# 单个 PDF 下载中断后的重试次数与首次重试前的等待秒数 (之后每次翻倍)
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 3))
+RETRY_DELAY = float(os.environ.get("DOWNLOAD_RETRY_DELAY", 2))
+
+# 未下载完的文件先写入 <文件名>.part，下次从已下载的位置续传。
+# 连接中断时 urllib3 会丢弃正在读取的那一块，块越小续传时重复下载的越少
+PARTIAL_SUFFIX = ".part"
+CHUNK_SIZE = 16 * 1024
+
+# 开始写 .part 时服务器返回的 ETag / Last-Modified 保存在 <文件名>.part.validator，
+# 续传时作为 If-Range 发送：文件在服务器上变了时服务器返回完整的 200，从头下载
+PARTIAL_VALIDATOR_SUFFIX = ".validator"
 
 # PDF 文件将要保存的目录
 DOWNLOAD_DIR = "data/visa_pdfs"
 
+# 记录 ETag / Last-Modified，用于条件请求
+VALIDATORS_FILE = "data/http_validators.json"
+
+# 下载了新文件但尚未解析时，新的校验信息先写在这里，解析成功后由
+# `download_visas.py --commit-validators` 移到 VALIDATORS_FILE。
+# 文件存在即表示有已下载但未解析的文件，下次运行会要求重新解析
+PENDING_VALIDATORS_FILE = "data/http_validators.pending.json"
+
+# 记录已下载文件的内容哈希，领事馆换文件名重新发布同一份文件时不再重复保存；
+# 同时记录每个文件在第几次发现新文件的轮询中、位于页面上的第几个链接 (parse_pdfs.py 据此排列重新发布的版本)
+MANIFEST_FILE = "data/pdf_manifest.json"
+
+def load_validators(path=VALIDATORS_FILE):
+    """读取上一次请求保存的缓存校验信息"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_validators(validators, path=VALIDATORS_FILE):
+    """保存缓存校验信息"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(validators, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def parse_pending():
+    """上一次下载的文件是否还没有成功解析"""
+    return os.path.exists(PENDING_VALIDATORS_FILE)
+
+def commit_pending_validators():
+    """解析成功后调用：把待确认的校验信息设为正式的，之后页面未变化时才会得到 304"""
+    try:
+        os.replace(PENDING_VALIDATORS_FILE, VALIDATORS_FILE)
+    except FileNotFoundError:
+        print("没有待确认的页面校验信息。")
+        return 0
+    print("已保存页面校验信息。")
+    return 0
+
+def load_manifest():
+    """
+    读取下载清单: {'hashes': {哈希: 文件名}, 'aliases': {重复文件名: 已保存的文件名},
+    'published': {文件名: {'poll': 轮询序号, 'position': 页面位置}}, 'polls': 最近的轮询序号}。
+    删除已不在下载目录中的文件的记录；首次运行时根据下载目录中已有的文件重建哈希表。
+    """
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {'hashes': {}, 'aliases': {}}
+    manifest.setdefault('published', {})
+    manifest.setdefault('polls', 0)
+
+    on_disk = set()
+    if os.path.isdir(DOWNLOAD_DIR):
+        on_disk = {filename for filename in os.listdir(DOWNLOAD_DIR) if filename.endswith('.pdf')}
+    manifest['hashes'] = {content_hash: filename for content_hash, filename in manifest['hashes'].items()
+                          if filename in on_disk}
+    manifest['aliases'] = {alias: filename for alias, filename in manifest['aliases'].items() if filename in on_disk}
+    manifest['published'] = {filename: entry for filename, entry in manifest['published'].items()
+                             if filename in on_disk}
+
+    known_files = set(manifest['hashes'].values())
+    if on_disk:
+        for filename in sorted(on_disk):
+            if filename not in known_files:
+                with open(os.path.join(DOWNLOAD_DIR, filename), 'rb') as f:
+                    content_hash = hashlib.sha256(f.read()).hexdigest()
+                manifest['hashes'].setdefault(content_hash, filename)
+    return manifest
+
+def save_manifest(manifest):
+    """保存下载清单"""
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+_sessions = threading.local()
+
+def get_session():
+    """每个下载线程一个 Session，复用 keep-alive 连接"""
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+def load_partial_validator(validator_path):
+    """读取 .part 文件开始下载时保存的 If-Range 校验值，没有时返回 None"""
+    try:
+        with open(validator_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('if_range')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def save_partial_validator(validator_path, response):
+    """
+    保存响应的强 ETag (没有时用 Last-Modified)，作为续传时的 If-Range。
+    弱 ETag 不能用于 If-Range，两者都没有时删除旧值，之后不再续传而是从头下载。
+    """
+    etag = response.headers.get('ETag')
+    if_range = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+    if not if_range:
+        remove_file(validator_path)
+        return
+    with open(validator_path, 'w', encoding='utf-8') as f:
+        json.dump({'if_range': if_range}, f)
+
+def remove_file(path):
+    """删除文件，文件已不存在时忽略"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def fetch_pdf(pdf_url, file_path, headers):
+    """
+    下载一个 PDF 到 file_path.part，连接中断或服务器出错时按已下载的字节数续传
+    (Range 请求，并用 If-Range 确认服务器上的文件没有变化)。
+    返回 (临时文件路径, 内容哈希)，由调用方决定保存还是丢弃；重试次数用尽时抛出异常。
+    """
+    part_path = file_path + PARTIAL_SUFFIX
+    validator_path = part_path + PARTIAL_VALIDATOR_SUFFIX
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if_range = load_partial_validator(validator_path) if offset else None
+        request_headers = dict(headers)
+        if offset and if_range:
+            request_headers['Range'] = f'bytes={offset}-'
+            request_headers['If-Range'] = if_range
+        try:
+            with get_session().get(pdf_url, headers=request_headers, timeout=30, stream=True) as response:
+                if response.status_code == 416:
+                    # 临时文件与服务器上的文件不一致，重新下载
+                    remove_file(part_path)
+                    remove_file(validator_path)
+                    continue
+                response.raise_for_status()
+                resumed = (response.status_code == 206 and 'Range' in request_headers and
+                           response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'))
+                if response.status_code == 206 and not resumed:
+                    # 返回的范围与请求不符，丢弃临时文件重新下载
+                    remove_file(part_path)
+                    remove_file(validator_path)
+                    continue
+                if resumed:
+                    print(f"  从 {offset} 字节处续传: {os.path.basename(file_path)}")
+                else:
+                    # 从头下载 (包括服务器因 If-Range 不匹配返回完整的 200)，记录新的校验值
+                    if offset:
+                        print(f"  服务器返回完整文件，从头下载: {os.path.basename(file_path)}")
+                    save_partial_validator(validator_path, response)
+                with open(part_path, 'ab' if resumed else 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            break
+        except requests.exceptions.RequestException as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            delay = RETRY_DELAY * 2 ** attempt
+            print(f"  下载 {os.path.basename(file_path)} 中断 ({e})，{delay:g} 秒后重试...")
+            time.sleep(delay)
+    else:
+        raise requests.exceptions.RetryError(f"多次重试后仍无法下载 {pdf_url}")
+
+    remove_file(validator_path)
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return part_path, digest.hexdigest()
+
+def fetch_pdfs(pending, headers):
+    """并发下载 [(文件名, URL, 保存路径)]，按原顺序返回 [(文件名, 保存路径, 临时文件, 哈希, 异常)]"""
+    def fetch(item):
+        pdf_filename, pdf_url, file_path = item
+        print(f"正在下载新文件: {pdf_filename}...")
+        try:
+            part_path, content_hash = fetch_pdf(pdf_url, file_path, headers)
+            return pdf_filename, file_path, part_path, content_hash, None
+        except Exception as e:
+            return pdf_filename, file_path, None, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_CONCURRENCY)) as executor:
+        return list(executor.map(fetch, pending))
+
 def download_visa_pdfs():
     """
     从爱尔兰签证决策页面下载新的 PDF 文件。
@@ -27,8 +241,25 @@ def download_visa_pdfs():
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
         }
 
-        # 发送 HTTP 请求获取网页内容
-        response = requests.get(URL, headers=headers, timeout=15)
+        # 发送条件请求：页面未变化时服务器返回 304，不再重复解析。
+        # 上次下载的文件尚未解析成功时沿用当时待确认的校验信息
+        validators = load_validators()
+        if parse_pending():
+            validators = load_validators(PENDING_VALIDATORS_FILE) or validators
+        page_validators = validators.get(URL, {})
+        request_headers = dict(headers)
+        if page_validators.get('etag'):
+            request_headers['If-None-Match'] = page_validators['etag']
+        if page_validators.get('last_modified'):
+            request_headers['If-Modified-Since'] = page_validators['last_modified']
+
+        response = get_session().get(URL, headers=request_headers, timeout=15)
+        if response.status_code == 304:
+            if parse_pending():
+                print("页面自上次访问后未变化 (304)，但上次下载的文件尚未解析成功，重新解析。")
+                return 0
+            print("页面自上次访问后未变化 (304)，跳过。")
+            return 2
         response.raise_for_status()  # 如果请求失败则抛出异常
 
         # 使用 BeautifulSoup 解析 HTML
@@ -50,9 +281,19 @@ def download_visa_pdfs():
 
         print(f"找到 {len(pdf_links)} 个 PDF 链接。")
         new_files_downloaded = 0
+        manifest = load_manifest()
+
+        # 本次轮询中首次保存的文件记为第 poll 次轮询发布，页面上较新的文件排在前面
+        poll = manifest['polls'] + 1
+        positions = {}
+
+        def record_published(filename):
+            manifest['published'][filename] = {'poll': poll, 'position': positions[filename]}
+            manifest['polls'] = poll
 
-        # 遍历所有链接并下载文件
-        for link in pdf_links:
+        # 找出需要下载的文件
+        pending = []
+        for position, link in enumerate(pdf_links):
             # 构造完整的 PDF URL
             pdf_relative_url = link.get('href')
             pdf_url = urljoin(URL, pdf_relative_url)
@@ -60,28 +301,77 @@ def download_visa_pdfs():
             # 从 URL 中获取文件名
             pdf_filename = os.path.basename(pdf_relative_url)
             file_path = os.path.join(DOWNLOAD_DIR, pdf_filename)
+            positions.setdefault(pdf_filename, position)
+
+            # 已知的重复文件名无需再次下载
+            if pdf_filename in manifest['aliases']:
+                print(f"文件与 {manifest['aliases'][pdf_filename]} 内容相同，跳过: {pdf_filename}")
+                continue
 
             # 如果文件不存在，则下载它
             if not os.path.exists(file_path):
-                print(f"正在下载新文件: {pdf_filename}...")
-                pdf_response = requests.get(pdf_url, headers=headers, timeout=30)
-                pdf_response.raise_for_status()
-                
-                with open(file_path, 'wb') as f:
-                    f.write(pdf_response.content)
-                print(f"已保存到 {file_path}")
-                new_files_downloaded += 1
+                pending.append((pdf_filename, pdf_url, file_path))
             else:
                 print(f"文件已存在，跳过: {pdf_filename}")
+                if pdf_filename not in manifest['published']:
+                    # 旧版本下载的文件没有发布记录，按当前页面补上
+                    record_published(pdf_filename)
+        save_manifest(manifest)
 
-        if new_files_downloaded == 0:
+        # 并发下载，之后按页面顺序逐个去重和保存
+        failed = 0
+        for pdf_filename, file_path, part_path, content_hash, error in fetch_pdfs(pending, headers):
+            if error is not None:
+                print(f"下载 {pdf_filename} 失败: {error}")
+                failed += 1
+                continue
+
+            # 内容与已保存的文件相同时只记录别名，不再保存和解析
+            existing = manifest['hashes'].get(content_hash)
+            if existing and existing != pdf_filename:
+                print(f"内容与已有文件 {existing} 相同，不再保存: {pdf_filename}")
+                remove_file(part_path)
+                manifest['aliases'][pdf_filename] = existing
+                save_manifest(manifest)
+                continue
+
+            os.replace(part_path, file_path)
+            manifest['hashes'][content_hash] = pdf_filename
+            record_published(pdf_filename)
+            save_manifest(manifest)
+            print(f"已保存到 {file_path}")
+            new_files_downloaded += 1
+
+        # 有文件下载失败时不更新校验信息，下次运行会重新读取页面并下载失败的文件 (已下载的部分会续传)
+        if not failed:
+            validators[URL] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+
+        if new_files_downloaded == 0 and not parse_pending():
+            # 没有需要解析的文件，页面处理完即可保存校验信息
+            if failed:
+                print(f"\n{failed} 个文件下载失败。")
+                return 1
+            save_validators(validators)
             print("\n没有需要下载的新文件。")
             # 返回2表示没有新文件
             return 2
+
+        # 新文件解析成功后才保存校验信息 (见 --commit-validators)，
+        # 否则解析失败后的下一次轮询会得到 304 而跳过解析
+        save_validators(validators, PENDING_VALIDATORS_FILE)
+        if failed:
+            print(f"\n{failed} 个文件下载失败。")
+        if new_files_downloaded == 0:
+            print("\n没有需要下载的新文件，但上次下载的文件尚未解析成功，重新解析。")
+        elif failed:
+            print(f"已下载 {new_files_downloaded} 个新文件，先解析这些文件。")
         else:
             print(f"\n下载完成。共下载了 {new_files_downloaded} 个新文件。")
-            # 返回0表示成功下载
-            return 0
+        # 返回0表示有文件需要解析
+        return 0
 
     except requests.exceptions.RequestException as e:
         print(f"访问网页时出错: {e}")
@@ -91,6 +381,13 @@ def download_visa_pdfs():
         return 1
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="下载爱尔兰签证决定 PDF")
+    parser.add_argument('--commit-validators', action='store_true',
+                        help='解析成功后保存本次下载时的页面校验信息')
+    args = parser.parse_args()
+
+    if args.commit_validators:
+        sys.exit(commit_pending_validators())
     # 获取脚本的退出码
     exit_code = download_visa_pdfs()
     # 退出程序并返回获取的退出码
@@ -0,0 +1,126 @@
+import io
+import os
+import csv
+import json
+import zlib
+import sqlite3
+
+# 定义常量
+DB_NAME = "data/visas.db"
+PARQUET_PATH = "data/visas.parquet"
+TABLE_NAME = "visa_decisions"
+SOURCE_TABLE = "source_files"
+DECISION_TABLE = "decision_codes"
+
+EXPORT_COLUMNS = ('application_number', 'decision', 'date_range_start', 'date_range_end', 'source_file')
+FETCH_BATCH_SIZE = 1000         # 每次从游标读取的行数
+PARQUET_ROW_GROUP_SIZE = 100000
+
+
+def build_export_query(where=""):
+    """
+    导出查询。CROSS JOIN 固定以主表为外层循环：按主键 (申请号) 顺序流式扫描，
+    维度表按主键查找，无需临时排序。
+    """
+    return f"""
+    SELECT v.application_number, d.decision, s.date_range_start, s.date_range_end, s.source_file
+    FROM {TABLE_NAME} v
+    CROSS JOIN {SOURCE_TABLE} s
+    CROSS JOIN {DECISION_TABLE} d
+    WHERE s.source_id = v.source_id AND d.decision_code = v.decision_code {where}
+    """
+
+
+def iter_export_batches(db_path=DB_NAME, start_date=None, end_date=None, batch_size=FETCH_BATCH_SIZE):
+    """
+    按申请号顺序分批读取导出数据，内存占用只与 batch_size 有关。
+    start_date / end_date 为 YYYY-MM-DD，筛选完全落在该区间内的周。
+    """
+    conditions = []
+    params = []
+    if start_date:
+        conditions.append("s.date_range_start >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("s.date_range_end <= ?")
+        params.append(end_date)
+    query = build_export_query(f"AND {' AND '.join(conditions)}" if conditions else "")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield batch
+    finally:
+        conn.close()
+
+
+def iter_csv(batches):
+    """将数据批次编码为 CSV 文本块"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(batches):
+    """将数据批次编码为每行一个 JSON 对象的文本块"""
+    for batch in batches:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in batch
+        )
+
+
+def iter_gzip(chunks, level=6):
+    """增量 gzip 压缩文本块"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def write_parquet(conn, path=PARQUET_PATH, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    将全部决定导出为 Parquet 文件 (需要可选依赖 pyarrow)，供离线分析使用。
+    按行组分批写入，内存占用与数据总量无关。返回写入的行数，未安装 pyarrow 时返回 None。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+
+    schema = pa.schema([
+        ('application_number', pa.int64()),
+        ('decision', pa.string()),
+        ('date_range_start', pa.string()),
+        ('date_range_end', pa.string()),
+        ('source_file', pa.string()),
+    ])
+    rows_written = 0
+    tmp_path = f"{path}.tmp"
+    cursor = conn.execute(build_export_query())
+    with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+        while True:
+            batch = cursor.fetchmany(row_group_size)
+            if not batch:
+                break
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            rows_written += len(batch)
+    os.replace(tmp_path, path)
+    return rows_written
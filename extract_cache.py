@@ -0,0 +1,112 @@
+import os
+import sys
+import zipfile
+
+import numpy as np
+
+# 提取缓存: 每个 PDF 用 pdfplumber 提取出的原始行 (申请号, 决定) 按内容哈希保存一份，
+# 重建数据库、修改结构或重新聚合时直接从缓存读取，只有新增或内容变化的文件才需要重新提取。
+# 目录按提取器版本分开 (data/extract_cache/v<版本>/<哈希>.npz)，提取逻辑变化后旧缓存自然失效。
+CACHE_DIR = "data/extract_cache"
+
+# 文件格式: 压缩的 npz，行顺序与 PDF 中一致 (同一文件内重复的申请号以后出现的为准)
+#   numbers   int64[n]   申请号
+#   codes     uint16[n]  决定在 decisions 中的下标
+#   decisions str[k]     本文件出现过的决定文字
+CACHE_SUFFIX = ".npz"
+
+
+def cache_path(content_hash, version, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"v{version}", content_hash + CACHE_SUFFIX)
+
+
+def load_rows(content_hash, version, cache_dir=CACHE_DIR):
+    """读取缓存的行，返回 [(申请号, 决定)]；没有缓存或缓存损坏时返回 None"""
+    path = cache_path(content_hash, version, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            numbers = data['numbers'].tolist()
+            codes = data['codes'].tolist()
+            decisions = data['decisions'].tolist()
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"  提取缓存 {os.path.basename(path)} 无法读取，重新提取: {e}")
+        return None
+    return [(number, decisions[code]) for number, code in zip(numbers, codes)]
+
+
+def store_rows(content_hash, version, rows, cache_dir=CACHE_DIR):
+    """写入一个文件的提取结果 (先写临时文件再替换，中断时不会留下半个缓存)"""
+    path = cache_path(content_hash, version, cache_dir)
+    decisions = sorted({decision for _, decision in rows})
+    index = {decision: i for i, decision in enumerate(decisions)}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                numbers=np.array([number for number, _ in rows], dtype=np.int64),
+                codes=np.array([index[decision] for _, decision in rows], dtype=np.uint16),
+                decisions=np.array(decisions, dtype=str),
+            )
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # 缓存只是加速手段，写入失败不影响入库
+        print(f"  写入提取缓存失败: {e}")
+
+
+def cache_entries(cache_dir=CACHE_DIR):
+    """列出缓存文件: [(版本, 内容哈希, 路径, 字节数)]"""
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for version_dir in sorted(os.listdir(cache_dir)):
+        directory = os.path.join(cache_dir, version_dir)
+        if not (version_dir.startswith('v') and os.path.isdir(directory)):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(CACHE_SUFFIX):
+                path = os.path.join(directory, name)
+                entries.append((version_dir[1:], name[:-len(CACHE_SUFFIX)], path, os.path.getsize(path)))
+    return entries
+
+
+def prune(live_hashes, version, cache_dir=CACHE_DIR):
+    """删除其他提取器版本的缓存和已不在 PDF 目录中的文件的缓存，返回删除的文件数"""
+    removed = 0
+    for entry_version, content_hash, path, _ in cache_entries(cache_dir):
+        if entry_version != str(version) or content_hash not in live_hashes:
+            os.remove(path)
+            removed += 1
+    for version_dir in os.listdir(cache_dir) if os.path.isdir(cache_dir) else ():
+        directory = os.path.join(cache_dir, version_dir)
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+    return removed
+
+
+if __name__ == "__main__":
+    import argparse
+    from parse_pdfs import PDF_DIR, EXTRACTOR_VERSION, compute_file_hash
+
+    parser = argparse.ArgumentParser(description="查看或清理 PDF 提取缓存")
+    parser.add_argument('--prune', action='store_true', help="删除旧版本和已不存在的文件的缓存")
+    args = parser.parse_args()
+
+    live_hashes = set()
+    if os.path.isdir(PDF_DIR):
+        live_hashes = {compute_file_hash(os.path.join(PDF_DIR, name))
+                       for name in os.listdir(PDF_DIR) if name.endswith('.pdf')}
+    if args.prune:
+        print(f"已删除 {prune(live_hashes, EXTRACTOR_VERSION)} 个缓存文件")
+
+    entries = cache_entries()
+    current = [entry for entry in entries if entry[0] == str(EXTRACTOR_VERSION)]
+    print(f"提取器版本: {EXTRACTOR_VERSION}")
+    print(f"缓存文件: {len(entries)} 个，共 {sum(entry[3] for entry in entries) / 1024:.1f} KiB "
+          f"(当前版本 {len(current)} 个)")
+    missing = live_hashes - {entry[1] for entry in current}
+    print(f"PDF 目录中尚未缓存的文件: {len(missing)} 个")
+    sys.exit(0)
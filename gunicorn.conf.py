@@ -0,0 +1,39 @@
+import os
+import multiprocessing
+
+# gunicorn 配置，可通过环境变量调整
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# 多个 worker 进程，每个 worker 多个线程: 一个慢的 /api/data 聚合不会阻塞其他查询
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# 在主进程中加载应用并预热缓存，worker fork 后共享这些内存页
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") not in ("0", "false", "no")
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    """主进程启动时开始新一次运行的监控指标，worker 继承主进程的运行编号"""
+    import metrics
+    metrics.start_run(os.getpid())
+
+
+def when_ready(server):
+    """主进程就绪 (fork worker 之前) 时预热缓存"""
+    if server.cfg.preload_app:
+        from visa_dashboard import warm_up
+        warm_up()
+
+
+def post_worker_init(worker):
+    """
+    在每个 worker 中启动后台监视线程 (线程不会随 fork 继承)。
+    未使用 preload 时由 worker 自己预热，聚合结果通过共享缓存文件只计算一次。
+    """
+    from visa_dashboard import start_watcher
+    start_watcher()
@@ -0,0 +1,155 @@
+import sys
+import sqlite3
+from datetime import datetime
+
+# 定义常量
+DB_NAME = "data/visas.db"
+TABLE_NAME = "visa_decisions"
+RUNS_TABLE = "ingest_runs"
+DELTA_TABLE = "decision_deltas"
+
+# 保留可回溯查询的最近入库次数，更早的增量在压缩时删除
+KEEP_RUNS = 12
+
+# 增量操作
+OP_REMOVED = -1
+OP_ADDED = 1
+
+
+def create_history_tables(cursor):
+    """
+    创建入库历史表:
+    - ingest_runs: 每次入库一行，记录新增/删除行数；compacted=1 表示该次的历史已被压缩，不能再回溯；
+    - decision_deltas: 每次入库相对上一次的反向增量。visa_decisions 始终保存最新状态，
+      历史状态通过撤销之后各次的增量得到，热表不会因为历史而变大。
+    """
+    cursor.execute(f'''
+    CREATE TABLE {RUNS_TABLE} (
+        run_id INTEGER PRIMARY KEY,
+        started_at TIMESTAMP NOT NULL,
+        finished_at TIMESTAMP,
+        rows_added INTEGER NOT NULL DEFAULT 0,
+        rows_removed INTEGER NOT NULL DEFAULT 0,
+        compacted INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute(f'''
+    CREATE TABLE {DELTA_TABLE} (
+        application_number INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        run_id INTEGER NOT NULL,
+        op INTEGER NOT NULL,
+        decision_code INTEGER NOT NULL,
+        PRIMARY KEY (application_number, source_id, run_id, op)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute(f"CREATE INDEX idx_delta_run ON {DELTA_TABLE} (run_id)")
+
+
+def begin_run(cursor):
+    """登记一次新的入库，返回 run_id"""
+    cursor.execute(
+        f"INSERT INTO {RUNS_TABLE} (started_at) VALUES (?)",
+        (datetime.now().isoformat(sep=' ', timespec='seconds'),)
+    )
+    return cursor.lastrowid
+
+
+def finish_run(cursor, run_id, rows_added, rows_removed):
+    """记录入库完成时间与变化行数"""
+    cursor.execute(
+        f"UPDATE {RUNS_TABLE} SET finished_at = ?, rows_added = ?, rows_removed = ? WHERE run_id = ?",
+        (datetime.now().isoformat(sep=' ', timespec='seconds'), rows_added, rows_removed, run_id)
+    )
+
+
+def record_deltas(cursor, run_id, op, rows):
+    """写入一批增量，rows 为 (application_number, source_id, decision_code)"""
+    cursor.executemany(
+        f"INSERT OR REPLACE INTO {DELTA_TABLE} (application_number, source_id, run_id, op, decision_code) "
+        f"VALUES (?, ?, ?, ?, ?)",
+        [(app_number, source_id, run_id, op, code) for app_number, source_id, code in rows]
+    )
+
+
+def get_run_bounds(conn):
+    """返回 (最早可回溯的 run_id, 最新 run_id)，没有任何入库记录时为 (None, None)"""
+    row = conn.execute(f"SELECT MIN(run_id), MAX(run_id) FROM {RUNS_TABLE} WHERE compacted = 0").fetchone()
+    return row[0], row[1]
+
+
+def state_as_of_query(app_number=None):
+    """
+    返回 SQL，查询第 run_id 次入库完成时的 (application_number, source_id, decision_code)。
+    之后没有任何增量的行与当前一致；之后第一次变化是删除的行，在当时存在且决定为被删除的值。
+    参数由 bind_state_params() 生成。
+    """
+    app_filter_v = "AND v.application_number = ?" if app_number is not None else ""
+    app_filter_d = "AND application_number = ?" if app_number is not None else ""
+    query = f"""
+    SELECT v.application_number, v.source_id, v.decision_code
+    FROM {TABLE_NAME} v
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {DELTA_TABLE} d
+        WHERE d.application_number = v.application_number AND d.source_id = v.source_id AND d.run_id > ?
+    ) {app_filter_v}
+    UNION ALL
+    SELECT application_number, source_id, decision_code FROM (
+        SELECT application_number, source_id, decision_code, op,
+               ROW_NUMBER() OVER (PARTITION BY application_number, source_id ORDER BY run_id, op) AS rn
+        FROM {DELTA_TABLE}
+        WHERE run_id > ? {app_filter_d}
+    )
+    WHERE rn = 1 AND op = {OP_REMOVED}
+    """
+    return query
+
+
+def bind_state_params(run_id, app_number=None):
+    """state_as_of_query() 对应的参数"""
+    if app_number is None:
+        return [run_id, run_id]
+    return [run_id, app_number, run_id, app_number]
+
+
+def compact_through(conn, horizon):
+    """
+    以第 horizon 次入库为压缩边界: 删除边界及之前各次的增量 (回溯到边界之后的任何一次都不需要它们)，
+    并标记更早的入库为已压缩。由调用方提交事务，返回删除的增量行数。
+    """
+    cursor = conn.execute(f"DELETE FROM {DELTA_TABLE} WHERE run_id <= ?", (horizon,))
+    deleted = cursor.rowcount
+    conn.execute(f"UPDATE {RUNS_TABLE} SET compacted = 1 WHERE run_id < ?", (horizon,))
+    return deleted
+
+
+def compact_history(conn, keep_runs=KEEP_RUNS):
+    """
+    压缩历史: 只保留最近 keep_runs 次入库可回溯。返回删除的增量行数。
+    """
+    runs = [row[0] for row in conn.execute(
+        f"SELECT run_id FROM {RUNS_TABLE} WHERE compacted = 0 ORDER BY run_id DESC"
+    )]
+    if len(runs) <= keep_runs:
+        return 0
+    horizon = runs[keep_runs - 1]
+    with conn:
+        deleted = compact_through(conn, horizon)
+    return deleted
+
+
+def list_runs(conn):
+    """返回全部入库记录，按时间倒序"""
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(f"SELECT * FROM {RUNS_TABLE} ORDER BY run_id DESC").fetchall()
+    conn.row_factory = None
+    return [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    # 手动压缩历史: python history.py [保留次数]
+    keep = int(sys.argv[1]) if len(sys.argv) > 1 else KEEP_RUNS
+    conn = sqlite3.connect(DB_NAME)
+    removed = compact_history(conn, keep)
+    conn.close()
+    print(f"历史压缩完成，删除了 {removed} 条增量记录 (保留最近 {keep} 次入库)")
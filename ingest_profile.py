@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import platform
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+
+# 入库性能分析报告 (parse_pdfs.py --profile): 每次运行一个 JSON 文件，按时间命名，便于前后对比
+PROFILE_DIR = "data/profiles"
+
+# cProfile 报告中保留的函数数量 (按累计耗时排序)
+TOP_FUNCTIONS = 30
+
+
+class IngestProfiler:
+    """
+    记录一次入库的分阶段耗时、每个文件/每页的提取耗时、行数和 tracemalloc 峰值内存。
+    enabled=False 时所有方法都不做任何事，解析代码不需要判断是否开启了分析。
+    """
+
+    def __init__(self, enabled=True, use_cprofile=False, profile_dir=PROFILE_DIR):
+        self.enabled = enabled
+        self.use_cprofile = enabled and use_cprofile
+        self.profile_dir = profile_dir
+        self.phases = {}
+        self.files = []
+        self.run = {}
+        self._current = None
+        self._file_start = None
+        self._page_start = None
+        self._peak_memory = 0
+        self._profile = cProfile.Profile() if self.use_cprofile else None
+        self._started_at = None
+        self._start = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._started_at = datetime.now()
+        self._start = time.perf_counter()
+        tracemalloc.start()
+        if self._profile is not None:
+            self._profile.enable()
+
+    @contextmanager
+    def phase(self, name):
+        """累计一个阶段的耗时 (同名阶段可以多次进入)"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def begin_file(self, filename, start_date, end_date, date_source, size_bytes):
+        if not self.enabled:
+            return
+        self._current = {
+            'file': filename,
+            'date_range': [str(start_date), str(end_date)],
+            'date_source': date_source,
+            'size_bytes': size_bytes,
+            'status': 'parsed',
+            'pages': [],
+        }
+        self.files.append(self._current)
+        self._file_start = time.perf_counter()
+
+    def end_file(self, rows, error=None, cached=False):
+        if not self.enabled or self._current is None:
+            return
+        entry = self._current
+        if cached:
+            entry['status'] = 'cached'
+        entry['rows'] = rows
+        entry['page_count'] = len(entry['pages'])
+        entry['extract_s'] = round(time.perf_counter() - self._file_start, 4)
+        entry['rows_per_s'] = round(rows / entry['extract_s'], 1) if entry['extract_s'] else None
+        entry['peak_memory_kib'] = max((page['peak_memory_kib'] for page in entry['pages']), default=0)
+        if error is not None:
+            entry['status'] = 'error'
+            entry['error'] = str(error)
+        self._current = None
+
+    def skip_file(self, filename, reason):
+        """未解析的文件 (内容未变化、重复等) 也列入报告，便于核对"""
+        if self.enabled:
+            self.files.append({'file': filename, 'status': reason})
+
+    def begin_page(self):
+        if not self.enabled:
+            return
+        # 每页单独统计峰值，重置前先并入整体峰值
+        self._peak_memory = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._page_start = time.perf_counter()
+
+    def end_page(self, page_num, rows, tables):
+        if not self.enabled or self._current is None:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        self._current['pages'].append({
+            'page': page_num,
+            'rows': rows,
+            'tables': tables,
+            'extract_s': round(time.perf_counter() - self._page_start, 4),
+            'peak_memory_kib': round(peak / 1024, 1),
+        })
+
+    def _top_functions(self):
+        stats = pstats.Stats(self._profile)
+        entries = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            entries.append({
+                'function': f"{os.path.basename(filename)}:{line}({name})",
+                'calls': calls,
+                'tottime_s': round(tottime, 4),
+                'cumtime_s': round(cumtime, 4),
+            })
+        entries.sort(key=lambda entry: entry['cumtime_s'], reverse=True)
+        return entries[:TOP_FUNCTIONS]
+
+    def finish(self):
+        """停止分析并写出报告，返回报告路径；未开启时返回 None"""
+        if not self.enabled:
+            return None
+        if self._profile is not None:
+            self._profile.disable()
+        peak = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        parsed = [entry for entry in self.files if entry['status'] in ('parsed', 'error')]
+        cached = [entry for entry in self.files if entry['status'] == 'cached']
+        total_s = time.perf_counter() - self._start
+        report = {
+            'started_at': self._started_at.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'total_s': round(total_s, 4),
+            'run': self.run,
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            'summary': {
+                'files': len(self.files),
+                'files_parsed': len(parsed),
+                'pages': sum(entry['page_count'] for entry in parsed),
+                'rows_extracted': sum(entry['rows'] for entry in parsed),
+                'extract_s': round(sum(entry['extract_s'] for entry in parsed), 4),
+                'files_cached': len(cached),
+                'rows_from_cache': sum(entry['rows'] for entry in cached),
+                'cache_load_s': round(sum(entry['extract_s'] for entry in cached), 4),
+                'traced_peak_memory_kib': round(peak / 1024, 1),
+            },
+            'files': self.files,
+        }
+        # 最慢的页面，方便直接定位问题文件
+        pages = [dict(page, file=entry['file']) for entry in parsed for page in entry['pages']]
+        report['slowest_pages'] = sorted(pages, key=lambda page: page['extract_s'], reverse=True)[:10]
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stamp = self._started_at.strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.profile_dir, f"ingest-{stamp}.json")
+        if self._profile is not None:
+            # 完整的 cProfile 数据另存一份，可用 python -m pstats 或 snakeviz 打开
+            prof_path = os.path.join(self.profile_dir, f"ingest-{stamp}.prof")
+            self._profile.dump_stats(prof_path)
+            report['cprofile'] = {'dump': prof_path, 'top_functions': self._top_functions()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
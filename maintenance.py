@@ -0,0 +1,300 @@
+import os
+import sys
+import json
+import calendar
+from datetime import date, datetime
+
+import numpy as np
+
+from history import DELTA_TABLE, KEEP_RUNS, compact_history, compact_through
+
+# 定义常量
+DB_NAME = "data/visas.db"
+TABLE_NAME = "visa_decisions"
+SOURCE_TABLE = "source_files"
+DECISION_TABLE = "decision_codes"
+ARCHIVE_TABLE = "archived_weeks"
+ARCHIVE_DIR = "data/archive"
+
+# 保留期 (月): 结束日期早于该期限的周移出热表，只保留聚合计数和压缩归档。0 表示不归档
+RETENTION_MONTHS = int(os.environ.get("RETENTION_MONTHS", 0))
+
+# PRAGMA auto_vacuum 的取值
+AUTO_VACUUM_INCREMENTAL = 2
+
+# 归档文件格式: 每周一个压缩的 npz (data/archive/<开始>_<结束>.npz)
+#   application_numbers int64[n]  申请号
+#   source_index        uint16[n] 在 meta.sources 中的下标
+#   decision_codes      uint8[n]  决定编码，对应 meta.decisions
+#   meta                str       JSON: 周、源文件 (文件名、内容哈希、入库时间)、决定表、归档时间
+ARCHIVE_FORMAT_VERSION = 1
+
+
+def create_archive_table(cursor):
+    """
+    已归档的周: 每周每种决定一行计数，以及归档文件路径。
+    这些周的明细行已从 visa_decisions 删除，统计图表从这里读取它们的计数。
+    """
+    cursor.execute(f'''
+    CREATE TABLE {ARCHIVE_TABLE} (
+        date_range_start DATE NOT NULL,
+        date_range_end DATE NOT NULL,
+        decision_code INTEGER NOT NULL,
+        decisions INTEGER NOT NULL,
+        archive_file TEXT NOT NULL,
+        archived_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (date_range_start, date_range_end, decision_code)
+    )
+    ''')
+
+
+def months_before(day, months):
+    """day 之前 months 个月的同一天 (该月没有这一天时取月末)"""
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def load_archived_weeks(cursor):
+    """返回已归档的周 {(开始, 结束)}"""
+    cursor.execute(f"SELECT DISTINCT date_range_start, date_range_end FROM {ARCHIVE_TABLE}")
+    return {(str(start), str(end)) for start, end in cursor.fetchall()}
+
+
+def load_archived_counts(cursor):
+    """返回已归档各周的计数 [(开始, 结束, 决定编码, 决定数)]，按日期排序"""
+    cursor.execute(f"""
+        SELECT date_range_start, date_range_end, decision_code, decisions FROM {ARCHIVE_TABLE}
+        ORDER BY date_range_start, date_range_end, decision_code
+    """)
+    return [(str(start), str(end), code, count) for start, end, code, count in cursor.fetchall()]
+
+
+def forget_archived_weeks(cursor, weeks):
+    """
+    重新入库的周 (PDF 内容变化后又解析回热表) 不再算作已归档，删除其计数，
+    否则统计中会同时出现热表和归档中的数据。归档文件保留，再次归档时覆盖。返回删除的行数；
+    大于 0 时调用方需压缩本次入库之前的历史 (之前的入库中这些周只有归档计数，无法还原)。
+    """
+    cursor.executemany(
+        f"DELETE FROM {ARCHIVE_TABLE} WHERE date_range_start = ? AND date_range_end = ?",
+        [(str(start_date), str(end_date)) for start_date, end_date in weeks]
+    )
+    return cursor.rowcount
+
+
+def archive_path(start_date, end_date, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{start_date}_{end_date}.npz")
+
+
+def write_archive(path, meta, numbers, source_index, codes):
+    """写入一周的归档 (先写临时文件再替换)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            application_numbers=numbers.astype(np.int64),
+            source_index=source_index.astype(np.uint16),
+            decision_codes=codes.astype(np.uint8),
+            meta=np.array(json.dumps(meta, ensure_ascii=False)),
+        )
+    os.replace(tmp_path, path)
+
+
+def read_archive(path):
+    """读取归档，返回 (meta, [(申请号, 源文件, 决定)])"""
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['meta']))
+        numbers = data['application_numbers'].tolist()
+        source_index = data['source_index'].tolist()
+        codes = data['decision_codes'].tolist()
+    sources = [source['source_file'] for source in meta['sources']]
+    decisions = {int(code): name for code, name in meta['decisions'].items()}
+    rows = [(number, sources[i], decisions.get(code, 'N/A')) for number, i, code in zip(numbers, source_index, codes)]
+    return meta, rows
+
+
+def _load_rows(cursor, source_ids):
+    """分批读取指定源文件的全部行，返回 (申请号, source_id, 决定编码) 三个数组"""
+    placeholders = ', '.join('?' * len(source_ids))
+    cursor.execute(
+        f"SELECT application_number, source_id, decision_code FROM {TABLE_NAME} WHERE source_id IN ({placeholders})",
+        sorted(source_ids)
+    )
+    blocks = []
+    while True:
+        batch = cursor.fetchmany(100000)
+        if not batch:
+            break
+        blocks.append(np.array(batch, dtype=np.int64))
+    if not blocks:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(3))
+    rows = np.concatenate(blocks)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def archive_old_weeks(conn, months=RETENTION_MONTHS, archive_dir=ARCHIVE_DIR, today=None):
+    """
+    把结束日期早于 months 个月前的周移出热表: 明细写入压缩归档，每种决定的计数写入 archived_weeks，
+    然后删除 visa_decisions 中的行及其历史增量。源文件记录、每周趋势和申请号分布统计保持不变，
+    统计图表和趋势仍包含这些周，按申请号查询只覆盖保留期内的周。
+    这些周最后一次变化之前的入库无法再用 as_of 正确还原 (归档计数是最终状态)，
+    因此以该次入库为边界压缩历史，更早的 as_of 请求返回 400。
+    返回 [(开始, 结束, 行数)]。
+    """
+    if months <= 0:
+        return []
+    cutoff = months_before(today or date.today(), months)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT source_id, source_file, content_hash, date_range_start, date_range_end, processed_date
+        FROM {SOURCE_TABLE}
+        WHERE date_range_start IS NOT NULL AND date_range_end IS NOT NULL AND date_range_end < ?
+    """, (cutoff.isoformat(),))
+    sources = {}
+    source_weeks = {}
+    for source_id, source_file, content_hash, start, end, processed_date in cursor.fetchall():
+        sources[source_id] = {'source_file': source_file, 'content_hash': content_hash, 'processed_date': processed_date}
+        source_weeks[source_id] = (str(start), str(end))
+    if not sources:
+        return []
+
+    numbers, source_ids, codes = _load_rows(cursor, list(sources))
+    if not len(numbers):
+        return []
+    decisions = {str(code): name for code, name in cursor.execute(f"SELECT decision_code, decision FROM {DECISION_TABLE}")}
+
+    # 按 (周, 申请号) 排序后每周是连续的一段
+    weeks = sorted(set(source_weeks.values()))
+    week_index = {week: i for i, week in enumerate(weeks)}
+    week_lookup = np.full(max(sources) + 1, -1, dtype=np.int64)
+    for source_id, week in source_weeks.items():
+        week_lookup[source_id] = week_index[week]
+    row_weeks = week_lookup[source_ids]
+    order = np.lexsort((numbers, row_weeks))
+    numbers, source_ids, codes, row_weeks = numbers[order], source_ids[order], codes[order], row_weeks[order]
+    bounds = np.searchsorted(row_weeks, np.arange(len(weeks) + 1))
+
+    archived_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+    archived = []
+    count_rows = []
+    for i, week in enumerate(weeks):
+        left, right = bounds[i], bounds[i + 1]
+        if left == right:
+            continue
+        used_sources = np.unique(source_ids[left:right])
+        meta = {
+            'format_version': ARCHIVE_FORMAT_VERSION,
+            'date_range_start': week[0],
+            'date_range_end': week[1],
+            'archived_at': archived_at,
+            'sources': [sources[int(s)] for s in used_sources],
+            'decisions': decisions,
+        }
+        path = archive_path(week[0], week[1], archive_dir)
+        write_archive(path, meta, numbers[left:right], np.searchsorted(used_sources, source_ids[left:right]),
+                      codes[left:right])
+        for code, count in zip(*np.unique(codes[left:right], return_counts=True)):
+            count_rows.append((week[0], week[1], int(code), int(count), path, archived_at))
+        archived.append((week[0], week[1], int(right - left)))
+
+    # 归档文件全部写好之后再在一个事务中删除热表中的行，中途失败时数据库不变
+    ids = sorted(sources)
+    placeholders = ', '.join('?' * len(ids))
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO {ARCHIVE_TABLE} VALUES (?, ?, ?, ?, ?, ?)", count_rows)
+        conn.execute(f"DELETE FROM {TABLE_NAME} WHERE source_id IN ({placeholders})", ids)
+        horizon = conn.execute(
+            f"SELECT MAX(run_id) FROM {DELTA_TABLE} WHERE source_id IN ({placeholders})", ids
+        ).fetchone()[0]
+        if horizon is not None:
+            # 边界及之前的增量 (包括这些周的全部增量) 一并删除
+            compact_through(conn, horizon)
+    return archived
+
+
+def database_stats(conn):
+    """返回数据库页大小、总页数和空闲页数"""
+    return {
+        'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+        'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+        'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+
+
+def optimize_database(conn, vacuum_pages=None, analyze=False, keep_runs=KEEP_RUNS):
+    """
+    入库后的维护 (在新数据发布之后执行，不影响数据更新的及时性):
+    - 压缩历史，只保留最近 keep_runs 次入库可回溯；
+    - 数据库尚未启用增量 VACUUM 时执行一次完整 VACUUM 切换 (auto_vacuum 只能这样修改)；
+    - 增量 VACUUM 回收空闲页 (重建、删除和历史压缩留下的)，vacuum_pages 限制每次回收的页数；
+    - 还没有统计信息或 analyze=True (例如刚归档了大量数据) 时执行 ANALYZE，否则执行 PRAGMA optimize，
+      只重新分析变化较大的表。
+    返回维护前后的统计信息。
+    """
+    conn.commit()
+    before = database_stats(conn)
+    report = {'before': before, 'full_vacuum': False, 'compacted_deltas': compact_history(conn, keep_runs)}
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        report['full_vacuum'] = True
+    # incremental_vacuum 每执行一步回收一页，execute() 只执行第一步；executescript() 会执行到底
+    conn.executescript(f"PRAGMA incremental_vacuum({int(vacuum_pages or 0)});")
+
+    has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'").fetchone()
+    if analyze or not has_stats:
+        conn.execute("ANALYZE")
+        report['analyze'] = 'full'
+    else:
+        conn.execute("PRAGMA optimize")
+        report['analyze'] = 'optimize'
+    conn.commit()
+    report['after'] = database_stats(conn)
+    return report
+
+
+def print_maintenance_report(report):
+    before, after = report['before'], report['after']
+    page_size = after['page_size']
+    freed = before['page_count'] - after['page_count']
+    if report['compacted_deltas']:
+        print(f"已压缩历史，删除 {report['compacted_deltas']} 条旧增量记录")
+    print(f"数据库维护: {before['page_count'] * page_size / 1024:.1f} KiB -> {after['page_count'] * page_size / 1024:.1f} KiB，"
+          f"回收 {max(freed, 0)} 页，剩余空闲页 {after['freelist_count']}"
+          + ("，已切换为增量 VACUUM" if report['full_vacuum'] else "")
+          + f"，统计信息: {'ANALYZE' if report['analyze'] == 'full' else 'PRAGMA optimize'}")
+
+
+if __name__ == "__main__":
+    import argparse
+    from snapshot import write_snapshot
+    from exporter import write_parquet
+    from parse_pdfs import setup_database
+
+    parser = argparse.ArgumentParser(description="数据库维护: 归档超过保留期的周、压缩历史、更新统计信息并回收空闲页")
+    parser.add_argument('--retention-months', type=int, default=RETENTION_MONTHS,
+                        help="归档结束日期早于 N 个月前的周 (默认取 RETENTION_MONTHS，0 表示不归档)")
+    parser.add_argument('--vacuum-pages', type=int, default=None, help="每次最多回收的空闲页数 (默认全部)")
+    parser.add_argument('--analyze', action='store_true', help="执行完整的 ANALYZE")
+    parser.add_argument('--keep-runs', type=int, default=KEEP_RUNS, help=f"保留可回溯的最近入库次数 (默认 {KEEP_RUNS})")
+    args = parser.parse_args()
+
+    if not os.path.exists(DB_NAME):
+        print(f"错误: 数据库 '{DB_NAME}' 不存在。")
+        sys.exit(1)
+    # 结构较旧时先迁移 (归档计数表在版本 5 中加入)
+    conn = setup_database()
+    archived = archive_old_weeks(conn, args.retention_months)
+    for start_date, end_date, rows in archived:
+        print(f"已归档 {start_date} 至 {end_date}: {rows} 条记录")
+    if archived:
+        # 热表变化后重新生成快照和 Parquet，Web 服务随即切换
+        print(f"已生成快照，共 {write_snapshot(conn)} 条记录")
+        write_parquet(conn)
+    print_maintenance_report(optimize_database(conn, args.vacuum_pages, analyze=args.analyze or bool(archived),
+                                               keep_runs=args.keep_runs))
+    archived_weeks = load_archived_weeks(conn.cursor())
+    print(f"已归档的周: {len(archived_weeks)} 个")
+    conn.close()
+    sys.exit(0)
@@ -0,0 +1,325 @@
+import os
+import json
+import mmap
+import glob
+import time
+import struct
+import bisect
+import shutil
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+
+# 指标目录: 每个进程一个内存映射文件，只由该进程写入；/metrics 读取全部文件后求和，
+# 因此无论请求落在哪个 gunicorn worker 上，看到的都是所有 worker 的合计。
+SHM_DIR = "/dev/shm"
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR",
+    os.path.join(SHM_DIR, "visa_dashboard_metrics") if os.path.isdir(SHM_DIR) else "data/metrics"
+)
+
+# 每次运行 (gunicorn 主进程，或 flask run / python visa_dashboard.py / uvicorn 等单独启动的进程)
+# 使用 METRICS_DIR/<运行编号>/ 子目录，编号为开始该运行的进程号，fork 出的 worker 继承主进程的编号。
+# 只汇总本次运行的文件；已退出的运行留下的目录在下一次运行开始时删除
+
+# 延迟直方图的桶上限 (秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标定义: 名称 -> (类型, 说明)
+DEFINITIONS = {
+    'visa_http_requests_total': ('counter', 'HTTP requests by route, method and status code'),
+    'visa_http_request_duration_seconds': ('histogram', 'HTTP request latency by route and method'),
+    'visa_db_query_duration_seconds': ('histogram', 'SQLite query latency by query'),
+    'visa_search_cache_events_total': ('counter', 'Search cache and membership filter events'),
+    'visa_aggregate_cache_events_total': ('counter', 'Shared aggregate cache events'),
+    'visa_rate_limit_decisions_total': ('counter', 'Rate limiter decisions shared by all workers'),
+    'visa_index_keys': ('gauge', 'Application numbers in the search membership filter'),
+    'visa_index_bytes': ('gauge', 'Size of the search indexes by kind'),
+    'visa_snapshot_rows': ('gauge', 'Rows in the memory-mapped snapshot'),
+    'visa_data_generation_info': ('gauge', 'Data generation currently served'),
+    'visa_data_last_update_timestamp_seconds': ('gauge', 'Modification time of the database file'),
+    'visa_metrics_processes': ('gauge', 'Processes that have written metrics since the server started'),
+}
+
+# 文件布局: 已用字节数 | 条目 (键长度, 键, 对齐填充, 数值)...
+USED = struct.Struct('<Q')
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+INITIAL_SIZE = 64 * 1024
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+@lru_cache(maxsize=4096)
+def _encode_pairs(name, suffix, pairs):
+    return json.dumps([name, suffix, pairs], separators=(',', ':'))
+
+
+def _encode_key(name, suffix, labels):
+    """文件中的键: [名称, 后缀, 排序后的标签]；标签组合有限，编码结果缓存复用"""
+    return _encode_pairs(name, suffix, tuple(sorted(labels.items())))
+
+
+def _read_entries(data):
+    """解析一个指标文件的内容，依次返回 (键, 数值偏移, 数值)"""
+    used = USED.unpack_from(data, 0)[0] if len(data) >= USED.size else 0
+    offset = USED.size
+    while offset < min(used, len(data)):
+        length = KEY_LENGTH.unpack_from(data, offset)[0]
+        key = bytes(data[offset + KEY_LENGTH.size:offset + KEY_LENGTH.size + length]).decode('utf-8')
+        value_offset = _align(offset + KEY_LENGTH.size + length)
+        yield key, value_offset, VALUE.unpack_from(data, value_offset)[0]
+        offset = value_offset + VALUE.size
+
+
+class _ProcessFile:
+    """当前进程的指标文件。新条目先写内容再更新已用字节数，读取方不会看到写了一半的条目"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._size = max(os.fstat(self._fd).st_size, INITIAL_SIZE)
+        os.ftruncate(self._fd, self._size)
+        self._mmap = mmap.mmap(self._fd, self._size)
+        self._used = USED.unpack_from(self._mmap, 0)[0] or USED.size
+        self._offsets = {key: offset for key, offset, _ in _read_entries(self._mmap)}
+
+    def _offset(self, key):
+        offset = self._offsets.get(key)
+        if offset is not None:
+            return offset
+        encoded = key.encode('utf-8')
+        value_offset = _align(self._used + KEY_LENGTH.size + len(encoded))
+        end = value_offset + VALUE.size
+        if end > self._size:
+            while end > self._size:
+                self._size *= 2
+            self._mmap.close()
+            os.ftruncate(self._fd, self._size)
+            self._mmap = mmap.mmap(self._fd, self._size)
+        KEY_LENGTH.pack_into(self._mmap, self._used, len(encoded))
+        self._mmap[self._used + KEY_LENGTH.size:self._used + KEY_LENGTH.size + len(encoded)] = encoded
+        VALUE.pack_into(self._mmap, value_offset, 0.0)
+        self._used = end
+        USED.pack_into(self._mmap, 0, self._used)
+        self._offsets[key] = value_offset
+        return value_offset
+
+    def add(self, key, amount):
+        offset = self._offset(key)
+        VALUE.pack_into(self._mmap, offset, VALUE.unpack_from(self._mmap, offset)[0] + amount)
+
+    def set(self, key, value):
+        VALUE.pack_into(self._mmap, self._offset(key), value)
+
+
+_lock = threading.Lock()
+_file = None
+_file_pid = None
+_disabled = False
+_collectors = []
+_run_id = None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def start_run(run_id=None):
+    """
+    开始新的一次运行: 清空本次运行的目录，并删除已退出的运行留下的目录和旧版本的扁平文件。
+    gunicorn 主进程在 on_starting 中调用；没有继承运行编号的进程第一次读写指标时自动调用。
+    """
+    global _run_id
+    run_id = _run_id = str(run_id or os.getpid())
+    try:
+        entries = os.listdir(METRICS_DIR)
+    except OSError:
+        entries = []
+    for name in entries:
+        path = os.path.join(METRICS_DIR, name)
+        if name.endswith(".metrics"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        elif name.isdigit() and name != run_id and not _pid_alive(int(name)):
+            shutil.rmtree(path, ignore_errors=True)
+    reset()
+    return run_id
+
+
+def run_dir():
+    """本次运行的指标目录"""
+    return os.path.join(METRICS_DIR, _run_id or start_run())
+
+
+def _process_file():
+    """返回当前进程的指标文件；fork 之后的子进程会打开自己的文件"""
+    global _file, _file_pid, _disabled
+    pid = os.getpid()
+    if _file_pid != pid and not _disabled:
+        try:
+            directory = run_dir()
+            os.makedirs(directory, exist_ok=True)
+            _file = _ProcessFile(os.path.join(directory, f"{pid}.metrics"))
+            _file_pid = pid
+        except OSError as e:
+            # 指标目录不可用时不记录，避免影响正常访问
+            print(f"指标文件初始化失败，已关闭指标记录: {e}")
+            _file = None
+            _disabled = True
+    return _file
+
+
+def inc(name, labels=None, amount=1.0):
+    """计数器加 amount"""
+    with _lock:
+        store = _process_file()
+        if store is not None:
+            store.add(_encode_key(name, '', labels or {}), amount)
+
+
+def observe(name, value, labels=None):
+    """直方图记录一个观测值 (秒)。文件中保存每个桶自身的计数，输出时再累加"""
+    labels = labels or {}
+    index = bisect.bisect_left(LATENCY_BUCKETS, value)
+    with _lock:
+        store = _process_file()
+        if store is None:
+            return
+        if index < len(LATENCY_BUCKETS):
+            store.add(_encode_key(name, '_bucket', dict(labels, le=repr(LATENCY_BUCKETS[index]))), 1.0)
+        store.add(_encode_key(name, '_sum', labels), value)
+        store.add(_encode_key(name, '_count', labels), 1.0)
+
+
+@contextmanager
+def db_timer(query):
+    """记录一段 SQLite 查询的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('visa_db_query_duration_seconds', time.perf_counter() - start, {'query': query})
+
+
+def register_collector(collect):
+    """
+    注册进程内统计的采集函数，返回 [(名称, 标签, 累计值)]。
+    累计值写入本进程的文件 (覆盖)，各进程相加即为合计。
+    """
+    _collectors.append(collect)
+
+
+def collect():
+    """把进程内统计写入指标文件 (后台线程定期调用，/metrics 请求时也会调用)"""
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            print(f"采集指标失败: {e}")
+            continue
+        with _lock:
+            store = _process_file()
+            if store is None:
+                return
+            for name, labels, value in samples:
+                store.set(_encode_key(name, '', labels), float(value))
+
+
+def reset():
+    """清空本次运行的指标文件"""
+    for path in glob.glob(os.path.join(run_dir(), "*.metrics")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def aggregate():
+    """读取本次运行所有进程的指标文件并求和，返回 ({(名称, 后缀, 标签): 数值}, 进程数)"""
+    totals = {}
+    paths = glob.glob(os.path.join(run_dir(), "*.metrics"))
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        for key, _, value in _read_entries(data):
+            name, suffix, labels = json.loads(key)
+            series = (name, suffix, tuple(tuple(pair) for pair in labels))
+            totals[series] = totals.get(series, 0.0) + value
+    return totals, len(paths)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def render(gauges=()):
+    """
+    生成 Prometheus 文本格式。gauges 为请求时在当前进程计算的 [(名称, 标签, 数值)]，
+    例如索引大小和数据代数 (所有 worker 相同，不需要相加)。
+    """
+    collect()
+    totals, processes = aggregate()
+    samples = {}
+    for (name, suffix, labels), value in totals.items():
+        samples.setdefault(name, []).append((suffix, labels, value))
+    for name, labels, value in list(gauges) + [('visa_metrics_processes', {}, processes)]:
+        samples.setdefault(name, []).append(('', tuple(sorted(labels.items())), value))
+
+    lines = []
+    for name, (kind, description) in DEFINITIONS.items():
+        series = samples.get(name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind != 'histogram':
+            for _, labels, value in sorted(series):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            continue
+
+        # 直方图: 按除 le 以外的标签分组，桶计数累加，+Inf 桶等于总数
+        groups = {}
+        for suffix, labels, value in series:
+            base = tuple(pair for pair in labels if pair[0] != 'le')
+            group = groups.setdefault(base, {'buckets': {}, 'sum': 0.0, 'count': 0.0})
+            if suffix == '_bucket':
+                le = float(dict(labels)['le'])
+                group['buckets'][le] = group['buckets'].get(le, 0.0) + value
+            else:
+                group[suffix[1:]] += value
+        for base, group in sorted(groups.items()):
+            cumulative = 0.0
+            for bound in LATENCY_BUCKETS:
+                cumulative += group['buckets'].get(bound, 0.0)
+                labels = base + (('le', repr(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(labels)} {_format_value(cumulative)}")
+            lines.append(f"{name}_bucket{_format_labels(base + (('le', '+Inf'),))} {_format_value(group['count'])}")
+            lines.append(f"{name}_sum{_format_labels(base)} {repr(group['sum'])}")
+            lines.append(f"{name}_count{_format_labels(base)} {_format_value(group['count'])}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,286 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+
+from parse_pdfs import (
+    DB_NAME, PDF_DIR, TABLE_NAME, SOURCE_TABLE, DECISION_TABLE, SCHEMA_VERSION,
+    DATE_SOURCE_FILENAME, create_schema, compute_file_hash, get_decision_code,
+    WEEK_STATS_TABLE, create_week_stats_table, store_week_stats,
+)
+from history import RUNS_TABLE, DELTA_TABLE, create_history_tables
+from trends import TREND_TABLE, REFUSED, create_trend_table, update_week_trends
+from maintenance import ARCHIVE_TABLE, create_archive_table
+
+LEGACY_TABLE = f"{TABLE_NAME}_legacy"
+
+# 每组查询重复执行的次数
+LOOKUP_SAMPLES = 1000
+SCAN_REPEATS = 20
+
+# 不同结构版本下用于对比的查询: (按申请号查询, 按周聚合)
+BENCH_QUERIES = {
+    0: (
+        f"""SELECT application_number, decision, source_file, date_range_start, date_range_end, processed_date
+        FROM {TABLE_NAME} WHERE application_number = ?""",
+        f"""SELECT date_range_start, date_range_end, decision, COUNT(*)
+        FROM {TABLE_NAME} GROUP BY date_range_start, date_range_end, decision""",
+    ),
+    1: (
+        f"""SELECT v.application_number, d.decision, s.source_file, s.date_range_start, s.date_range_end, s.processed_date
+        FROM {TABLE_NAME} v
+        JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+        JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+        WHERE v.application_number = ?""",
+        f"""SELECT s.date_range_start, s.date_range_end, d.decision, COUNT(*)
+        FROM {TABLE_NAME} v
+        JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+        JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+        GROUP BY s.date_range_start, s.date_range_end, v.decision_code""",
+    ),
+}
+
+
+def get_schema_version(conn):
+    """返回数据库结构版本；旧版单表结构视为版本 0"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def table_exists(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def migrate_v0_to_v1(conn):
+    """
+    将旧版单表结构迁移为紧凑结构:
+    决定改为小整数编码, 文件名与日期移入 source_files 维度表, 主表改为按申请号聚簇的 WITHOUT ROWID 表。
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"ALTER TABLE {TABLE_NAME} RENAME TO {LEGACY_TABLE}")
+    cursor.execute("DROP INDEX IF EXISTS idx_app_source")
+
+    # 保留旧版 source_files 中的哈希与合并信息
+    legacy_sources = {}
+    if table_exists(conn, SOURCE_TABLE):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({SOURCE_TABLE})")]
+        for row in cursor.execute(f"SELECT * FROM {SOURCE_TABLE}").fetchall():
+            legacy_sources[row[columns.index('source_file')]] = dict(zip(columns, row))
+        cursor.execute(f"DROP TABLE {SOURCE_TABLE}")
+
+    create_schema(cursor)
+
+    cursor.execute(f"""
+        SELECT source_file, MIN(date_range_start), MIN(date_range_end), MIN(processed_date)
+        FROM {LEGACY_TABLE} GROUP BY source_file
+    """)
+    source_ids = {}
+    for source_file, start_date, end_date, processed_date in cursor.fetchall():
+        legacy = legacy_sources.pop(source_file, {})
+        content_hash = legacy.get('content_hash')
+        file_path = os.path.join(PDF_DIR, source_file)
+        if not content_hash and os.path.exists(file_path):
+            content_hash = compute_file_hash(file_path)
+        date_source = legacy.get('date_source') or (DATE_SOURCE_FILENAME if start_date else None)
+        cursor.execute(
+            f"""INSERT INTO {SOURCE_TABLE}
+            (source_file, content_hash, date_range_start, date_range_end, date_source, merged_into, processed_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (source_file, content_hash, start_date, end_date, date_source, legacy.get('merged_into'), processed_date)
+        )
+        source_ids[source_file] = cursor.lastrowid
+
+    # 没有数据行的旧记录 (重复文件) 也一并保留
+    for source_file, legacy in legacy_sources.items():
+        cursor.execute(
+            f"""INSERT INTO {SOURCE_TABLE}
+            (source_file, content_hash, date_range_start, date_range_end, date_source, merged_into)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            (source_file, legacy.get('content_hash'), legacy.get('date_range_start'),
+             legacy.get('date_range_end'), legacy.get('date_source'), legacy.get('merged_into'))
+        )
+
+    decision_cache = {}
+    rows = cursor.execute(
+        f"SELECT application_number, decision, source_file FROM {LEGACY_TABLE} ORDER BY application_number"
+    ).fetchall()
+    cursor.executemany(
+        f"INSERT OR IGNORE INTO {TABLE_NAME} (application_number, source_id, decision_code) VALUES (?, ?, ?)",
+        [(app_number, source_ids[source_file], get_decision_code(cursor, decision, decision_cache))
+         for app_number, decision, source_file in rows]
+    )
+    cursor.execute(f"DROP TABLE {LEGACY_TABLE}")
+    print(f"  已迁移 {len(rows)} 条记录, {len(source_ids)} 个源文件")
+
+
+def migrate_v1_to_v2(conn):
+    """新增每周申请号分布统计表，并根据现有数据回填"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {WEEK_STATS_TABLE}")
+    create_week_stats_table(cursor)
+    weeks = cursor.execute(f"""
+        SELECT DISTINCT date_range_start, date_range_end FROM {SOURCE_TABLE}
+        WHERE date_range_start IS NOT NULL AND date_range_end IS NOT NULL
+    """).fetchall()
+    for start_date, end_date in weeks:
+        numbers = [row[0] for row in cursor.execute(f"""
+            SELECT v.application_number FROM {TABLE_NAME} v
+            JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+            WHERE s.date_range_start = ? AND s.date_range_end = ?
+        """, (start_date, end_date))]
+        store_week_stats(cursor, start_date, end_date, numbers)
+    print(f"  已生成 {len(weeks)} 周的申请号分布统计")
+
+
+def migrate_v2_to_v3(conn):
+    """新增入库历史表，现有数据记为第一次入库 (之前的历史无法恢复)"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {DELTA_TABLE}")
+    cursor.execute(f"DROP TABLE IF EXISTS {RUNS_TABLE}")
+    create_history_tables(cursor)
+    last_processed = cursor.execute(f"SELECT MAX(processed_date) FROM {SOURCE_TABLE}").fetchone()[0]
+    rows = cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+    cursor.execute(
+        f"INSERT INTO {RUNS_TABLE} (started_at, finished_at, rows_added) VALUES (?, ?, ?)",
+        (last_processed or '', last_processed, rows)
+    )
+    print(f"  已将现有 {rows} 条记录登记为第 1 次入库")
+
+
+def migrate_v3_to_v4(conn):
+    """新增每周趋势表 (决定数、拒签数及累计值)，并根据现有数据回填"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {TREND_TABLE}")
+    create_trend_table(cursor)
+    cursor.execute(f"""
+        SELECT s.date_range_start, s.date_range_end, COUNT(*), SUM(d.decision = ?)
+        FROM {TABLE_NAME} v
+        JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+        JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+        WHERE s.date_range_start IS NOT NULL AND s.date_range_end IS NOT NULL
+        GROUP BY s.date_range_start, s.date_range_end
+    """, (REFUSED,))
+    week_counts = {(start, end): (decisions, refused) for start, end, decisions, refused in cursor.fetchall()}
+    update_week_trends(cursor, week_counts)
+    print(f"  已生成 {len(week_counts)} 周的趋势统计")
+
+
+def migrate_v4_to_v5(conn):
+    """新增已归档周的计数表 (保留期策略使用)；迁移完成后的 VACUUM 同时切换为增量 VACUUM"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {ARCHIVE_TABLE}")
+    create_archive_table(cursor)
+    print("  已创建归档计数表")
+
+
+# 迁移步骤: 起始版本 -> 迁移函数，按版本依次执行。
+# 版本 0 的迁移调用 create_schema() 直接建立最新结构，因此后续步骤需兼容表已存在的情况。
+MIGRATIONS = {
+    0: migrate_v0_to_v1,
+    1: migrate_v1_to_v2,
+    2: migrate_v2_to_v3,
+    3: migrate_v3_to_v4,
+    4: migrate_v4_to_v5,
+}
+
+
+def measure(conn, version):
+    """统计数据库大小、各表页数以及查询耗时"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+
+    pages = {}
+    try:
+        for name, count in conn.execute("SELECT name, COUNT(*) FROM dbstat GROUP BY name"):
+            pages[name] = count
+    except sqlite3.Error:
+        pass  # 部分 SQLite 编译版本不包含 dbstat
+
+    lookup_query, scan_query = BENCH_QUERIES[min(version, max(BENCH_QUERIES))]
+    app_numbers = [row[0] for row in conn.execute(f"SELECT application_number FROM {TABLE_NAME}")]
+    samples = random.Random(42).choices(app_numbers, k=LOOKUP_SAMPLES) if app_numbers else []
+
+    start = time.perf_counter()
+    for app_number in samples:
+        conn.execute(lookup_query, (app_number,)).fetchall()
+    lookup_us = (time.perf_counter() - start) / max(len(samples), 1) * 1e6
+
+    start = time.perf_counter()
+    for _ in range(SCAN_REPEATS):
+        conn.execute(scan_query).fetchall()
+    scan_ms = (time.perf_counter() - start) / SCAN_REPEATS * 1000
+
+    return {
+        'size_kb': page_size * page_count / 1024,
+        'pages': pages,
+        'lookup_us': lookup_us,
+        'scan_ms': scan_ms,
+    }
+
+
+def print_comparison(before, after):
+    """打印迁移前后的对比"""
+    print("\n=== 迁移前后对比 ===")
+    print(f"{'指标':<20}{'迁移前':>14}{'迁移后':>14}")
+    print(f"{'数据库大小 (KB)':<20}{before['size_kb']:>14.1f}{after['size_kb']:>14.1f}")
+    print(f"{'按申请号查询 (us)':<20}{before['lookup_us']:>14.1f}{after['lookup_us']:>14.1f}")
+    print(f"{'按周聚合 (ms)':<20}{before['scan_ms']:>14.2f}{after['scan_ms']:>14.2f}")
+    if before['pages'] or after['pages']:
+        print("\n各表/索引页数:")
+        for name, count in sorted(before['pages'].items()):
+            print(f"  迁移前 {name}: {count}")
+        for name, count in sorted(after['pages'].items()):
+            print(f"  迁移后 {name}: {count}")
+
+
+def migrate(db_path=DB_NAME):
+    """将数据库迁移到最新结构，迁移前备份为 <db>.bak"""
+    if not os.path.exists(db_path):
+        print(f"错误: 数据库 '{db_path}' 不存在。")
+        return 1
+
+    conn = sqlite3.connect(db_path)
+    version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        print(f"数据库已是最新结构 (版本 {version})，无需迁移。")
+        conn.close()
+        return 0
+
+    backup_path = f"{db_path}.bak"
+    backup = sqlite3.connect(backup_path)
+    conn.backup(backup)
+    backup.close()
+    print(f"已备份到 {backup_path}")
+
+    before = measure(conn, version)
+
+    while version < SCHEMA_VERSION:
+        print(f"正在从版本 {version} 迁移到版本 {version + 1}...")
+        try:
+            with conn:
+                # 显式开启事务，使 DDL 语句在失败时也能整体回滚
+                conn.execute("BEGIN")
+                MIGRATIONS[version](conn)
+                new_version = version + 1
+                conn.execute(f"PRAGMA user_version = {new_version}")
+        except Exception as e:
+            print(f"迁移失败，数据库未修改: {e}")
+            conn.close()
+            return 1
+        version = new_version
+
+    # auto_vacuum 只有在 VACUUM 时才会对已有数据库生效
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    conn.execute("ANALYZE")
+    after = measure(conn, version)
+    conn.close()
+
+    print_comparison(before, after)
+    print(f"\n迁移完成，当前结构版本: {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(migrate(sys.argv[1] if len(sys.argv) > 1 else DB_NAME))
@@ -1,81 +1,253 @@
 import os
+import sys
+import json
+import hashlib
 import sqlite3
 import pdfplumber
 import re
+import numpy as np
 from datetime import datetime
+from functools import lru_cache
+
+from snapshot import write_snapshot
+from exporter import write_parquet
+from history import (
+    RUNS_TABLE, DELTA_TABLE, OP_ADDED, OP_REMOVED,
+    create_history_tables, begin_run, finish_run, record_deltas, compact_through,
+)
+from trends import TREND_TABLE, REFUSED, create_trend_table, update_week_trends
+from ingest_profile import IngestProfiler
+from extract_cache import load_rows, store_rows
+from maintenance import (
+    ARCHIVE_TABLE, create_archive_table, load_archived_weeks, forget_archived_weeks,
+    archive_old_weeks, optimize_database, print_maintenance_report,
+)
 
 # 定义常量
 PDF_DIR = "data/visa_pdfs"
 DB_NAME = "data/visas.db"
 TABLE_NAME = "visa_decisions"
+SOURCE_TABLE = "source_files"
+DECISION_TABLE = "decision_codes"
+FLAT_VIEW = "visa_decisions_flat"
+WEEK_STATS_TABLE = "week_number_stats"
 
-def setup_database():
-    """初始化数据库和表"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # 删除旧表，重新创建
-    cursor.execute(f'DROP TABLE IF EXISTS {TABLE_NAME}')
-    
-    # 创建简单的表结构
+# download_visas.py 的下载清单，其中记录了每个文件的发布顺序
+MANIFEST_FILE = "data/pdf_manifest.json"
+
+# 数据库结构版本，记录在 PRAGMA user_version 中，供 migrate_db.py 判断是否需要迁移
+SCHEMA_VERSION = 5
+
+# 每周申请号分布记录的分位点
+NUMBER_QUANTILES = (10, 25, 50, 75, 90)
+
+# 提取器版本: extract_rows 的输出发生变化时加 1，提取缓存 (data/extract_cache/) 中的旧结果随之失效
+EXTRACTOR_VERSION = 1
+
+# 常见决定的固定编码，其他决定在入库时依次分配新编码
+DECISION_CODES = {'Approved': 1, 'Refused': 2}
+
+def create_schema(cursor):
+    """
+    创建紧凑的数据库结构:
+    - source_files: 源文件维度表，保存日期范围、内容哈希与入库时间；
+    - decision_codes: 决定的小整数编码；
+    - visa_decisions: 以 (application_number, source_id) 为主键的 WITHOUT ROWID 表，
+      数据按申请号聚簇存放，无需额外的唯一索引。
+    """
+    # 记录每个源文件的内容哈希；重复或被合并的文件通过 merged_into 指向实际入库的文件
     cursor.execute(f'''
-    CREATE TABLE {TABLE_NAME} (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        application_number INTEGER NOT NULL,
-        decision TEXT NOT NULL,
-        source_file TEXT NOT NULL,
+    CREATE TABLE {SOURCE_TABLE} (
+        source_id INTEGER PRIMARY KEY,
+        source_file TEXT NOT NULL UNIQUE,
+        content_hash TEXT,
         date_range_start DATE,
         date_range_end DATE,
+        date_source TEXT,
+        merged_into TEXT,
         processed_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    
-    # 创建索引防止重复
+
+    cursor.execute(f'''
+    CREATE TABLE {DECISION_TABLE} (
+        decision_code INTEGER PRIMARY KEY,
+        decision TEXT NOT NULL UNIQUE
+    )
+    ''')
+    cursor.executemany(
+        f"INSERT INTO {DECISION_TABLE} (decision_code, decision) VALUES (?, ?)",
+        [(code, decision) for decision, code in DECISION_CODES.items()]
+    )
+
+    cursor.execute(f'''
+    CREATE TABLE {TABLE_NAME} (
+        application_number INTEGER NOT NULL,
+        source_id INTEGER NOT NULL,
+        decision_code INTEGER NOT NULL,
+        PRIMARY KEY (application_number, source_id)
+    ) WITHOUT ROWID
+    ''')
+
+    # 便于手工查询的展开视图，字段与旧表结构一致
+    cursor.execute(f'''
+    CREATE VIEW {FLAT_VIEW} AS
+    SELECT v.application_number, d.decision, s.source_file,
+           s.date_range_start, s.date_range_end, s.processed_date
+    FROM {TABLE_NAME} v
+    JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+    JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+    ''')
+
+    create_week_stats_table(cursor)
+    create_history_tables(cursor)
+    create_trend_table(cursor)
+    create_archive_table(cursor)
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def create_week_stats_table(cursor):
+    """每周已决定申请号的最小/最大值与分位数，入库时维护，供排队进度估算使用"""
+    quantile_columns = ''.join(f"        p{q} INTEGER NOT NULL,\n" for q in NUMBER_QUANTILES)
     cursor.execute(f'''
-    CREATE UNIQUE INDEX idx_app_source ON {TABLE_NAME} (application_number, source_file)
+    CREATE TABLE {WEEK_STATS_TABLE} (
+        date_range_start DATE NOT NULL,
+        date_range_end DATE NOT NULL,
+        decisions INTEGER NOT NULL,
+        min_number INTEGER NOT NULL,
+{quantile_columns}        max_number INTEGER NOT NULL,
+        PRIMARY KEY (date_range_start, date_range_end)
+    )
     ''')
+
+def store_week_stats(cursor, start_date, end_date, app_numbers):
+    """计算并写入一周申请号的分布统计"""
+    if not app_numbers:
+        return
+    numbers = np.sort(np.asarray(app_numbers, dtype=np.int64))
+    quantiles = [int(round(v)) for v in np.percentile(numbers, NUMBER_QUANTILES)]
+    placeholders = ', '.join('?' * (len(NUMBER_QUANTILES) + 5))
+    cursor.execute(
+        f"INSERT OR REPLACE INTO {WEEK_STATS_TABLE} VALUES ({placeholders})",
+        [start_date, end_date, len(numbers), int(numbers[0])] + quantiles + [int(numbers[-1])]
+    )
+
+def setup_database(rebuild=False):
+    """
+    初始化数据库。已有数据时保留现有内容，入库只写入变化部分并记录增量历史；
+    结构版本较旧时先自动迁移。rebuild=True 时删除全部表 (包括历史) 后重新创建。
+    """
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE_NAME,))
+    exists = cursor.fetchone() is not None
+
+    if exists and not rebuild:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            conn.close()
+            from migrate_db import migrate
+            if migrate(DB_NAME) != 0:
+                raise RuntimeError(f"数据库 '{DB_NAME}' 迁移失败")
+            conn = sqlite3.connect(DB_NAME)
+        return conn
+
+    # 新数据库启用增量 VACUUM (只在建表之前设置有效；已有的数据库由维护阶段切换)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # 删除旧表，重新创建
+    cursor.execute(f'DROP VIEW IF EXISTS {FLAT_VIEW}')
+    for table in (TABLE_NAME, SOURCE_TABLE, DECISION_TABLE, WEEK_STATS_TABLE, RUNS_TABLE, DELTA_TABLE, TREND_TABLE,
+                  ARCHIVE_TABLE):
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
     
+    create_schema(cursor)
     conn.commit()
     return conn
 
+def register_source_file(cursor, filename, content_hash, start_date, end_date, date_source, merged_into=None):
+    """写入或更新源文件记录，返回 source_id"""
+    cursor.execute(
+        f"""INSERT INTO {SOURCE_TABLE}
+        (source_file, content_hash, date_range_start, date_range_end, date_source, merged_into)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(source_file) DO UPDATE SET
+            content_hash = excluded.content_hash,
+            date_range_start = excluded.date_range_start,
+            date_range_end = excluded.date_range_end,
+            date_source = excluded.date_source,
+            merged_into = excluded.merged_into""",
+        (filename, content_hash, start_date, end_date, date_source, merged_into)
+    )
+    cursor.execute(f"SELECT source_id FROM {SOURCE_TABLE} WHERE source_file = ?", (filename,))
+    return cursor.fetchone()[0]
+
+def get_decision_code(cursor, decision, cache):
+    """返回决定对应的编码，未知的决定分配新编码"""
+    if decision in cache:
+        return cache[decision]
+    cursor.execute(f"SELECT decision_code FROM {DECISION_TABLE} WHERE decision = ?", (decision,))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f"INSERT INTO {DECISION_TABLE} (decision) VALUES (?)", (decision,))
+        code = cursor.lastrowid
+    else:
+        code = row[0]
+    cache[decision] = code
+    return code
+
+# 文件名日期解析使用的正则，在模块加载时编译一次
+# 移除日期中的 "st", "nd", "rd", "th"
+ORDINAL_SUFFIX_PATTERN = re.compile(r'(\d+)(st|nd|rd|th)')
+
+# 优先匹配 "DD_Month_to_DD_Month_YYYY" 格式
+FULL_RANGE_PATTERN = re.compile(
+    r'(\d{1,2})'                     # start_day
+    r'(?:_|-|\s)([A-Za-z]+)'         # start_month
+    r'(?:_|-|\s)to(?:_|-|\s)'         # separator "to"
+    r'(\d{1,2})'                     # end_day
+    r'(?:_|-|\s)([A-Za-z]+)'         # end_month
+    r'(?:_|-|\s)(\d{4})'             # year
+)
+
+# 次优匹配 "DD_to_DD_Month_YYYY" 格式
+SHORT_RANGE_PATTERN = re.compile(
+    r'(\d{1,2})'                     # start_day
+    r'(?:_|-|\s)to(?:_|-|\s)'         # separator "to"
+    r'(\d{1,2})'                     # end_day
+    r'(?:_|-|\s)([A-Za-z]+)'         # end_month
+    r'(?:_|-|\s)(\d{4})'             # year
+)
+
+# PDF 第一页的标题，例如 "Decisions for period from 23/06/2025 to 29/06/2025"
+PDF_HEADER_PATTERN = re.compile(
+    r'from\s+(\d{1,2})/(\d{1,2})/(\d{4})\s+to\s+(\d{1,2})/(\d{1,2})/(\d{4})',
+    re.IGNORECASE
+)
+
+# 日期来源标记，记录在 source_files.date_source 中
+DATE_SOURCE_FILENAME = "filename"
+DATE_SOURCE_PDF_HEADER = "pdf_header"
+
+@lru_cache(maxsize=None)
 def parse_date_range_from_filename(filename):
     """
     从文件名中解析日期范围，增强对不规范文件名的处理能力。
     - 移除日期中的序数词后缀 (st, nd, rd, th)。
     - 匹配多种分隔符和格式。
     - 自动处理跨年份的日期范围 (例如 12月到1月)。
+    结果按文件名缓存，同一文件在一次运行中只解析一次。
     """
     try:
         name_without_ext = os.path.splitext(filename)[0]
-        # 移除日期中的 "st", "nd", "rd", "th"
-        clean_name = re.sub(r'(\d+)(st|nd|rd|th)', r'\1', name_without_ext)
-
-        # 优先匹配 "DD_Month_to_DD_Month_YYYY" 格式
-        pattern1 = re.compile(
-            r'(\d{1,2})'                     # start_day
-            r'(?:_|-|\s)([A-Za-z]+)'         # start_month
-            r'(?:_|-|\s)to(?:_|-|\s)'         # separator "to"
-            r'(\d{1,2})'                     # end_day
-            r'(?:_|-|\s)([A-Za-z]+)'         # end_month
-            r'(?:_|-|\s)(\d{4})'             # year
-        )
-        
-        # 次优匹配 "DD_to_DD_Month_YYYY" 格式
-        pattern2 = re.compile(
-            r'(\d{1,2})'                     # start_day
-            r'(?:_|-|\s)to(?:_|-|\s)'         # separator "to"
-            r'(\d{1,2})'                     # end_day
-            r'(?:_|-|\s)([A-Za-z]+)'         # end_month
-            r'(?:_|-|\s)(\d{4})'             # year
-        )
+        clean_name = ORDINAL_SUFFIX_PATTERN.sub(r'\1', name_without_ext)
 
         # 首先尝试匹配完整格式
-        match = pattern1.search(clean_name)
+        match = FULL_RANGE_PATTERN.search(clean_name)
         if match:
             start_day, start_month, end_day, end_month, year_str = match.groups()
         else:
             # 尝试匹配简化格式
-            match = pattern2.search(clean_name)
+            match = SHORT_RANGE_PATTERN.search(clean_name)
             if match:
                 start_day, end_day, end_month, year_str = match.groups()
                 start_month = end_month  # 如果开始月份未提供，则使用结束月份
@@ -84,34 +256,74 @@ def parse_date_range_from_filename(filename):
                 print(f"警告: 无法从文件名 '{filename}' 中解析日期。")
                 return None, None
 
-        if match:
-
-            year = int(year_str)
+        year = int(year_str)
 
-            # 解析开始和结束日期
-            start_date_str = f"{start_day} {start_month} {year}"
-            end_date_str = f"{end_day} {end_month} {year}"
-            
-            start_date = datetime.strptime(start_date_str, "%d %B %Y").date()
-            end_date = datetime.strptime(end_date_str, "%d %B %Y").date()
+        # 解析开始和结束日期
+        start_date_str = f"{start_day} {start_month} {year}"
+        end_date_str = f"{end_day} {end_month} {year}"
+        
+        start_date = datetime.strptime(start_date_str, "%d %B %Y").date()
+        end_date = datetime.strptime(end_date_str, "%d %B %Y").date()
 
-            # 处理跨年份的情况 (例如，从12月到1月)
-            if start_date > end_date:
-                # 假设结束日期在下一年
-                end_date = datetime.strptime(f"{end_day} {end_month} {year + 1}", "%d %B %Y").date()
+        # 处理跨年份的情况 (例如，从12月到1月)
+        if start_date > end_date:
+            # 假设结束日期在下一年
+            end_date = datetime.strptime(f"{end_day} {end_month} {year + 1}", "%d %B %Y").date()
 
-            return start_date, end_date
+        return start_date, end_date
         
     except Exception as e:
         print(f"错误: 解析文件名 '{filename}' 时发生异常: {e}")
         return None, None
 
+def parse_date_range_from_pdf(file_path):
+    """从 PDF 第一页的标题文字中解析日期范围"""
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            if not pdf.pages:
+                return None, None
+            text = pdf.pages[0].extract_text() or ''
+    except Exception as e:
+        print(f"错误: 读取文件 '{file_path}' 的标题时发生异常: {e}")
+        return None, None
+
+    match = PDF_HEADER_PATTERN.search(text)
+    if not match:
+        print(f"警告: 无法从文件 '{file_path}' 的标题中解析日期。")
+        return None, None
+
+    start_day, start_month, start_year, end_day, end_month, end_year = map(int, match.groups())
+    try:
+        start_date = datetime(start_year, start_month, start_day).date()
+        end_date = datetime(end_year, end_month, end_day).date()
+    except ValueError as e:
+        print(f"错误: 文件 '{file_path}' 标题中的日期无效: {e}")
+        return None, None
+    return start_date, end_date
+
+@lru_cache(maxsize=None)
+def resolve_date_range(filename):
+    """
+    确定文件的日期范围：优先使用文件名，失败时读取 PDF 第一页标题。
+    返回 (开始日期, 结束日期, 来源)，无法确定时均为 None。
+    """
+    start_date, end_date = parse_date_range_from_filename(filename)
+    if start_date and end_date:
+        return start_date, end_date, DATE_SOURCE_FILENAME
+
+    start_date, end_date = parse_date_range_from_pdf(os.path.join(PDF_DIR, filename))
+    if start_date and end_date:
+        print(f"  已从 PDF 标题中解析 '{filename}' 的日期范围: {start_date} 到 {end_date}")
+        return start_date, end_date, DATE_SOURCE_PDF_HEADER
+
+    return None, None, None
+
 def sort_files_by_date(pdf_files):
     """按文件中的日期范围排序PDF文件"""
     files_with_dates = []
     
     for filename in pdf_files:
-        start_date, end_date = parse_date_range_from_filename(filename)
+        start_date, end_date, _ = resolve_date_range(filename)
         if start_date and end_date:
             files_with_dates.append((filename, start_date))
         else:
@@ -121,76 +333,335 @@ def sort_files_by_date(pdf_files):
     files_with_dates.sort(key=lambda x: x[1])
     return [item[0] for item in files_with_dates]
 
-def parse_and_store_pdfs(conn):
-    """解析所有PDF文件并将数据存入数据库"""
+def compute_file_hash(file_path):
+    """计算文件内容的 SHA-256 哈希"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def extract_rows(file_path, profiler=None):
+    """从 PDF 中提取 (申请号, 决定) 列表；传入 profiler 时记录每页的耗时与内存"""
+    rows = []
+    with pdfplumber.open(file_path) as pdf:
+        for page_num, page in enumerate(pdf.pages, 1):
+            print(f"  处理第 {page_num} 页...")
+            if profiler is not None:
+                profiler.begin_page()
+            page_start_rows = len(rows)
+            tables = page.extract_tables()
+
+            for table in tables:
+                for row in filter(None, table):
+                    # 跳过表头
+                    if any(header in str(row) for header in ['Application Number', 'Decision']):
+                        continue
+
+                    # 验证行数据
+                    if len(row) >= 2 and row[0] and str(row[0]).strip().isdigit():
+                        app_number = int(str(row[0]).strip())
+                        decision = str(row[1]).strip() if row[1] else "N/A"
+                        rows.append((app_number, decision))
+            if profiler is not None:
+                profiler.end_page(page_num, len(rows) - page_start_rows, len(tables))
+    return rows
+
+def extract_rows_cached(file_path, content_hash, profiler=None, use_cache=True):
+    """
+    先按内容哈希读取提取缓存，未命中时用 pdfplumber 提取并写入缓存。
+    use_cache=False 时总是重新提取 (结果仍写入缓存)。返回 (行列表, 是否来自缓存)。
+    """
+    if use_cache:
+        rows = load_rows(content_hash, EXTRACTOR_VERSION)
+        if rows is not None:
+            return rows, True
+    rows = extract_rows(file_path, profiler)
+    store_rows(content_hash, EXTRACTOR_VERSION, rows)
+    return rows, False
+
+def load_publication_order():
+    """
+    读取下载清单中各文件的发布顺序: {文件名: (轮询序号, -页面位置)}，值越大发布越晚
+    (同一次轮询中页面上较新的文件排在前面)。没有清单时返回空字典。
+    """
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            published = json.load(f).get('published', {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+    return {filename: (entry['poll'], -entry['position']) for filename, entry in published.items()}
+
+def group_duplicate_files(sorted_files, file_hashes, publication_order=None):
+    """
+    按内容哈希与日期范围对文件分组。
+    - 内容完全相同的文件只保留第一个，其余记为重复。
+    - 日期范围相同但内容不同的文件 (领事馆重新发布的版本) 合并为一组，按发布顺序从旧到新排列，
+      较新版本中的决定覆盖旧版本。发布顺序取自下载清单 (并发下载时文件的修改时间只反映下载完成的先后)，
+      组内有文件不在清单中 (例如手动放入的文件) 时退回按修改时间排列。
+    返回 (分组列表, 重复文件映射 {重复文件: 保留文件})。
+    """
+    if publication_order is None:
+        publication_order = load_publication_order()
+    first_by_hash = {}
+    duplicates = {}
+    groups = {}
+    order = []
+
+    for filename in sorted_files:
+        content_hash = file_hashes[filename]
+        if content_hash in first_by_hash:
+            duplicates[filename] = first_by_hash[content_hash]
+            continue
+        first_by_hash[content_hash] = filename
+
+        start_date, end_date, _ = resolve_date_range(filename)
+        key = (start_date, end_date) if start_date and end_date else filename
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(filename)
+
+    result = []
+    for key in order:
+        files = groups[key]
+        if len(files) > 1 and all(f in publication_order for f in files):
+            files = sorted(files, key=lambda f: publication_order[f])
+        else:
+            files = sorted(files, key=lambda f: os.path.getmtime(os.path.join(PDF_DIR, f)))
+        result.append(files)
+    return result, duplicates
+
+def load_known_sources(cursor):
+    """返回已登记的源文件: {文件名: (source_id, 内容哈希, merged_into, 开始日期, 结束日期)}"""
+    cursor.execute(f"""
+        SELECT source_file, source_id, content_hash, merged_into, date_range_start, date_range_end
+        FROM {SOURCE_TABLE}
+    """)
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+def group_is_unchanged(group, file_hashes, known):
+    """组内每个文件都已入库、内容未变且合并关系相同时，该组无需重新解析"""
+    canonical = group[-1]
+    for filename in group:
+        if filename not in known:
+            return False
+        _, content_hash, merged_into, _, _ = known[filename]
+        if content_hash != file_hashes[filename] or merged_into != (None if filename == canonical else canonical):
+            return False
+    return True
+
+def load_current_rows(cursor, source_ids):
+    """读取指定源文件当前的全部行: {(申请号, source_id): 决定编码}"""
+    if not source_ids:
+        return {}
+    placeholders = ', '.join('?' * len(source_ids))
+    cursor.execute(
+        f"SELECT application_number, source_id, decision_code FROM {TABLE_NAME} WHERE source_id IN ({placeholders})",
+        sorted(source_ids)
+    )
+    return {(app_number, source_id): code for app_number, source_id, code in cursor.fetchall()}
+
+def write_changes(cursor, run_id, added, removed, week_counts, stale_weeks):
+    """写入变化的行及其历史增量，并更新每周趋势"""
+    cursor.executemany(
+        f"DELETE FROM {TABLE_NAME} WHERE application_number = ? AND source_id = ?",
+        [(app_number, source_id) for app_number, source_id, _ in removed]
+    )
+    cursor.executemany(
+        f"INSERT INTO {TABLE_NAME} (application_number, source_id, decision_code) VALUES (?, ?, ?)",
+        added
+    )
+    record_deltas(cursor, run_id, OP_REMOVED, removed)
+    record_deltas(cursor, run_id, OP_ADDED, added)
+    # 只重算变化的周之后的累计值
+    update_week_trends(cursor, week_counts, stale_weeks)
+
+def parse_and_store_pdfs(conn, profiler=None, use_cache=True):
+    """
+    解析有变化的 PDF 文件，并把数据库更新到与文件目录一致的状态。
+    内容未变的日期范围直接跳过；有变化的部分只写入新增/删除的行，
+    并作为本次入库的增量记录到历史表中，供按入库时间回溯查询。
+    提取结果按内容哈希缓存，重建数据库时只有缓存中没有的文件才调用 pdfplumber。
+    某个文件提取失败时，它所在的日期范围整体保持原样 (不登记新的内容哈希，旧的行保留)，下次运行会重试。
+    profiler 为 IngestProfiler 时记录各阶段、每个文件和每页的耗时。
+    返回是否全部成功: 目录不存在或有文件提取失败时返回 False (其余日期范围照常入库)。
+    写入数据库出错时回滚本次的全部修改并抛出 sqlite3.Error。
+    """
+    profiler = profiler or IngestProfiler(enabled=False)
     cursor = conn.cursor()
     
     if not os.path.exists(PDF_DIR):
         print(f"错误: 目录 '{PDF_DIR}' 不存在。")
-        return
+        return False
 
     pdf_files = [f for f in os.listdir(PDF_DIR) if f.endswith('.pdf')]
     
     if not pdf_files:
         print("未找到PDF文件。")
-        return
+        return True
     
     # 按日期排序文件
-    sorted_files = sort_files_by_date(pdf_files)
+    with profiler.phase('date_resolution'):
+        sorted_files = sort_files_by_date(pdf_files)
     print(f"找到 {len(sorted_files)} 个 PDF 文件待处理。")
 
-    total_new_records = 0
-    
-    for filename in sorted_files:
-        file_path = os.path.join(PDF_DIR, filename)
-        print(f"\n--- 正在处理文件: {filename} ---")
-        
-        # 解析文件名中的日期范围
-        start_date, end_date = parse_date_range_from_filename(filename)
-        if start_date and end_date:
-            print(f"  日期范围: {start_date} 到 {end_date}")
-        
-        file_records = 0
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    print(f"  处理第 {page_num} 页...")
-                    tables = page.extract_tables()
-                    
-                    for table in tables:
-                        for row in filter(None, table):
-                            # 跳过表头
-                            if any(header in str(row) for header in ['Application Number', 'Decision']):
-                                continue
-                            
-                            # 验证行数据
-                            if len(row) >= 2 and row[0] and str(row[0]).strip().isdigit():
-                                app_number = int(str(row[0]).strip())
-                                decision = str(row[1]).strip() if row[1] else "N/A"
-                                
-                                try:
-                                    cursor.execute(
-                                        f"""INSERT OR IGNORE INTO {TABLE_NAME} 
-                                        (application_number, decision, source_file, date_range_start, date_range_end) 
-                                        VALUES (?, ?, ?, ?, ?)""",
-                                        (app_number, decision, filename, start_date, end_date)
-                                    )
-                                    
-                                    if cursor.rowcount > 0:
-                                        file_records += 1
-                                        total_new_records += 1
-                                        print(f"    新记录: {app_number} - {decision}")
-                                    
-                                except sqlite3.Error as db_error:
-                                    print(f"    数据库错误: {db_error}")
-                
-            conn.commit()
-            print(f"  文件处理完成，新增 {file_records} 条记录")
-            
-        except Exception as e:
-            print(f"处理文件 {filename} 时发生错误: {e}")
-
-    print(f"\n处理完成! 总共添加了 {total_new_records} 条新记录到数据库")
+    # 计算内容哈希，相同内容的文件只解析一次
+    with profiler.phase('hash'):
+        file_hashes = {f: compute_file_hash(os.path.join(PDF_DIR, f)) for f in sorted_files}
+        file_groups, duplicates = group_duplicate_files(sorted_files, file_hashes)
+    for duplicate, original in duplicates.items():
+        print(f"跳过重复文件: {duplicate} (内容与 {original} 相同)")
+        profiler.skip_file(duplicate, 'duplicate')
+
+    known = load_known_sources(cursor)
+    decision_cache = {}
+    week_counts = {}
+    empty_weeks = set()
+
+    # 解析有变化的日期范围，得到它们应有的行
+    desired_rows = {}
+    affected_ids = set()
+    live_files = set()
+    live_weeks = set()
+    skipped_groups = 0
+    cached_files = 0
+    failed_files = []
+    for group in file_groups:
+        canonical = group[-1]
+        start_date, end_date, date_source = resolve_date_range(canonical)
+        if not (start_date and end_date):
+            # 没有日期的行无法归入任何一周，宁可跳过也不写入数据库
+            print(f"\n错误: 无法确定 {canonical} 的日期范围，跳过该文件。")
+            profiler.skip_file(canonical, 'no_date_range')
+            continue
+        live_files.update(group)
+        live_weeks.add((str(start_date), str(end_date)))
+        if group_is_unchanged(group, file_hashes, known):
+            skipped_groups += 1
+            for filename in group:
+                profiler.skip_file(filename, 'unchanged')
+            continue
+        if len(group) > 1:
+            print(f"\n--- 合并同一日期范围的 {len(group)} 个版本，以 {canonical} 为准 ---")
+
+        # 同一日期范围内，每个申请号只保留最新版本中的决定
+        merged_rows = {}
+        group_failed = False
+        for filename in group:
+            file_path = os.path.join(PDF_DIR, filename)
+            print(f"\n--- 正在处理文件: {filename} ---")
+            print(f"  日期范围: {start_date} 到 {end_date} (来源: {date_source})")
+            profiler.begin_file(filename, start_date, end_date, date_source, os.path.getsize(file_path))
+            file_rows = []
+            cached = False
+            error = None
+            try:
+                with profiler.phase('extract'):
+                    file_rows, cached = extract_rows_cached(file_path, file_hashes[filename], profiler, use_cache)
+            except Exception as e:
+                error = e
+                group_failed = True
+                failed_files.append(filename)
+                print(f"处理文件 {filename} 时发生错误: {e}")
+            if cached:
+                cached_files += 1
+                print(f"  从提取缓存读取 {len(file_rows)} 行")
+            profiler.end_file(len(file_rows), error, cached)
+            for app_number, decision in file_rows:
+                merged_rows[app_number] = (decision, filename)
+
+        if group_failed:
+            # 不登记新的哈希也不计算差异，该日期范围的旧数据保持不变，下次运行重新解析
+            print(f"  {start_date} 到 {end_date} 有文件提取失败，保留原有数据，下次运行重试")
+            continue
+
+        with profiler.phase('register_sources'):
+            source_ids = {}
+            for filename in group:
+                source_ids[filename] = register_source_file(
+                    cursor, filename, file_hashes[filename], start_date, end_date, date_source,
+                    None if filename == canonical else canonical
+                )
+            affected_ids.update(source_ids.values())
+
+            for app_number, (decision, filename) in merged_rows.items():
+                desired_rows[(app_number, source_ids[filename])] = get_decision_code(cursor, decision, decision_cache)
+            store_week_stats(cursor, start_date, end_date, list(merged_rows))
+        if merged_rows:
+            refused = sum(1 for decision, _ in merged_rows.values() if decision == REFUSED)
+            week_counts[(str(start_date), str(end_date))] = (len(merged_rows), refused)
+        else:
+            empty_weeks.add((str(start_date), str(end_date)))
+
+    if skipped_groups:
+        print(f"\n{skipped_groups} 个日期范围的文件内容未变化，已跳过解析")
+    if failed_files:
+        print(f"错误: {len(failed_files)} 个文件提取失败: {', '.join(failed_files)}")
+    if cached_files:
+        print(f"{cached_files} 个文件的行来自提取缓存，未调用 pdfplumber")
+
+    # 已从目录中删除、或变成重复文件的源文件，其数据行需要移除
+    for filename, (source_id, _, _, _, _) in known.items():
+        if filename not in live_files:
+            affected_ids.add(source_id)
+            if filename not in duplicates:
+                # 清除哈希，文件恢复后会重新解析
+                cursor.execute(f"UPDATE {SOURCE_TABLE} SET content_hash = NULL WHERE source_id = ?", (source_id,))
+    stale_weeks = {
+        (str(start), str(end)) for filename, (_, _, _, start, end) in known.items()
+        if filename not in live_files and start and end
+    } - live_weeks | empty_weeks
+    # 已归档的周只保留聚合数据，删除其 PDF 不影响统计
+    stale_weeks -= load_archived_weeks(cursor)
+    for start_date, end_date in stale_weeks:
+        cursor.execute(
+            f"DELETE FROM {WEEK_STATS_TABLE} WHERE date_range_start = ? AND date_range_end = ?",
+            (start_date, end_date)
+        )
+
+    # 与当前数据比较，只写入变化的行
+    with profiler.phase('diff'):
+        current_rows = load_current_rows(cursor, affected_ids)
+        removed = [(app_number, source_id, code) for (app_number, source_id), code in current_rows.items()
+                   if desired_rows.get((app_number, source_id)) != code]
+        added = [(app_number, source_id, code) for (app_number, source_id), code in desired_rows.items()
+                 if current_rows.get((app_number, source_id)) != code]
+
+    try:
+        with profiler.phase('db_write'):
+            forgotten = forget_archived_weeks(cursor, set(week_counts) | empty_weeks)
+            # 只有数据确实变化时才登记新的入库，否则历史中会堆积空的入库
+            run_id = begin_run(cursor) if added or removed or forgotten else None
+            if forgotten:
+                compact_through(cursor, run_id)
+            write_changes(cursor, run_id, added, removed, week_counts, stale_weeks)
+    except sqlite3.Error as db_error:
+        print(f"    数据库错误: {db_error}")
+        conn.rollback()
+        raise
+
+    decision_names = {code: decision for decision, code in decision_cache.items()}
+    for app_number, _, code in added:
+        print(f"    新记录: {app_number} - {decision_names.get(code, code)}")
+
+    for duplicate, original in duplicates.items():
+        start_date, end_date, date_source = resolve_date_range(original)
+        register_source_file(
+            cursor, duplicate, file_hashes[duplicate], start_date, end_date, date_source, original
+        )
+    if run_id is not None:
+        finish_run(cursor, run_id, len(added), len(removed))
+    with profiler.phase('commit'):
+        conn.commit()
+    profiler.run = {'run_id': run_id, 'rows_added': len(added), 'rows_removed': len(removed),
+                    'unchanged_date_ranges': skipped_groups, 'files_from_cache': cached_files}
+
+    if run_id is None:
+        print("\n处理完成! 数据没有变化，未登记新的入库")
+    else:
+        print(f"\n处理完成! 第 {run_id} 次入库: 新增 {len(added)} 条, 删除 {len(removed)} 条记录")
+    return not failed_files
 
 def print_database_summary(conn):
     """打印数据库摘要信息"""
@@ -200,7 +671,11 @@ def print_database_summary(conn):
         cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
         total_records = cursor.fetchone()[0]
         
-        cursor.execute(f"SELECT decision, COUNT(*) FROM {TABLE_NAME} GROUP BY decision")
+        cursor.execute(f"""
+            SELECT d.decision, COUNT(*) FROM {TABLE_NAME} v
+            JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+            GROUP BY v.decision_code
+        """)
         decision_stats = cursor.fetchall()
         
         print(f"\n=== 数据库摘要 ===")
@@ -213,9 +688,57 @@ def print_database_summary(conn):
         print(f"获取数据库摘要时发生错误: {e}")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="解析签证决定 PDF 并写入数据库")
+    parser.add_argument('--rebuild', action='store_true', help="删除现有数据 (包括入库历史) 后全部重新解析")
+    parser.add_argument('--profile', action='store_true',
+                        help="记录各阶段、每个文件和每页的耗时与内存，报告写入 data/profiles/")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="同时用 cProfile 分析 (包含 --profile)，报告中列出最耗时的函数")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="不读取提取缓存，全部用 pdfplumber 重新提取 (结果仍写入缓存)")
+    args = parser.parse_args()
+
+    profiler = IngestProfiler(enabled=args.profile or args.cprofile, use_cprofile=args.cprofile)
+    profiler.start()
     print("开始处理PDF文件...")
-    db_connection = setup_database()
-    parse_and_store_pdfs(db_connection)
+    with profiler.phase('setup'):
+        db_connection = setup_database(rebuild=args.rebuild)
+    try:
+        parsed_ok = parse_and_store_pdfs(db_connection, profiler, use_cache=not args.no_cache)
+    except sqlite3.Error:
+        # 什么都没有写入: 不归档、不重新生成快照和 Parquet，以非零状态退出，
+        # run_pipeline.sh 不会确认页面校验信息，下次轮询重新下载并解析
+        db_connection.close()
+        print("入库失败，已回滚，以状态 1 退出。")
+        sys.exit(1)
     print_database_summary(db_connection)
+    # 超过保留期 (RETENTION_MONTHS) 的周移入归档，需在生成快照之前完成
+    with profiler.phase('retention'):
+        archived = archive_old_weeks(db_connection)
+    if archived:
+        print(f"已归档 {len(archived)} 周，共 {sum(rows for _, _, rows in archived)} 条记录")
+    # 为 Web 服务生成列式快照，各 worker 通过 mmap 共享
+    with profiler.phase('snapshot'):
+        snapshot_rows = write_snapshot(db_connection)
+    print(f"已生成快照，共 {snapshot_rows} 条记录")
+    # 供研究者离线分析的 Parquet 文件 (需要安装 pyarrow)
+    with profiler.phase('parquet'):
+        parquet_rows = write_parquet(db_connection)
+    if parquet_rows is None:
+        print("未安装 pyarrow，跳过 Parquet 导出。")
+    else:
+        print(f"已导出 Parquet 文件，共 {parquet_rows} 条记录")
+    # 维护阶段: 压缩旧的历史增量，更新查询规划统计并回收重建、删除和压缩留下的空闲页
+    with profiler.phase('maintenance'):
+        report = optimize_database(db_connection, analyze=bool(archived))
+    print_maintenance_report(report)
     db_connection.close()
-    print("数据库连接已关闭。")
\ No newline at end of file
+    print("数据库连接已关闭。")
+    report_path = profiler.finish()
+    if report_path:
+        print(f"性能分析报告已写入 {report_path}")
+    if not parsed_ok:
+        # 已成功的部分照常发布；以非零状态退出，run_pipeline.sh 不会确认页面校验信息，下次轮询会重试
+        print("有文件未能解析，以状态 1 退出。")
+        sys.exit(1)
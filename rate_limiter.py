@@ -0,0 +1,157 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import threading
+
+# 默认参数，可通过环境变量调整
+DEFAULT_RATE = float(os.environ.get("SEARCH_RATE_LIMIT", 2))       # 每秒补充的令牌数
+DEFAULT_BURST = float(os.environ.get("SEARCH_RATE_BURST", 30))     # 桶容量 (允许的突发请求数)
+
+# 共享文件: 优先放在内存文件系统中，所有 worker 映射同一个文件
+SHM_DIR = "/dev/shm"
+DEFAULT_PATH = os.path.join(SHM_DIR, "visa_dashboard_ratelimit") if os.path.isdir(SHM_DIR) \
+    else "data/ratelimit.shm"
+
+# 文件布局: 头部 | 每个分段的计数器 (允许数, 拒绝数) | 槽位 (键哈希, 令牌数, 更新时间)
+# 每个分段有独立的锁，不同客户端的请求很少互相等待。
+MAGIC = b'VISARL01'
+HEADER = struct.Struct('<8sII')
+COUNTERS = struct.Struct('<QQ')
+SLOT = struct.Struct('<Qdd')
+STRIPES = 64
+SLOTS_PER_STRIPE = 64
+PROBES = 4
+
+
+class RateLimiter:
+    """
+    按客户端 IP 的令牌桶限流器，状态保存在共享内存映射文件中，
+    多个 gunicorn worker 共用同一组令牌桶，不需要 Redis 等外部服务。
+    槽位不足时淘汰最久未访问的客户端。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, path=DEFAULT_PATH):
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self.enabled = rate > 0
+        self._thread_locks = [threading.Lock() for _ in range(STRIPES)]
+        self._counters_offset = HEADER.size
+        self._slots_offset = self._counters_offset + STRIPES * COUNTERS.size
+        self._size = self._slots_offset + STRIPES * SLOTS_PER_STRIPE * SLOT.size
+        self._fd = None
+        self._mmap = None
+        if self.enabled:
+            try:
+                self._open()
+            except OSError as e:
+                # 共享文件不可用时不限流，避免影响正常访问
+                print(f"限流器初始化失败，已关闭限流: {e}")
+                self.enabled = False
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        # 初始化或布局不匹配时重建文件，期间持有整个文件的锁
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            expected = HEADER.pack(MAGIC, STRIPES, SLOTS_PER_STRIPE)
+            if os.fstat(self._fd).st_size != self._size or header != expected:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._size)
+                os.pwrite(self._fd, expected, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._mmap = mmap.mmap(self._fd, self._size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    @staticmethod
+    def _hash(client):
+        value = int.from_bytes(hashlib.blake2b(client.encode('utf-8'), digest_size=8).digest(), 'little')
+        return value or 1   # 0 表示空槽位
+
+    def allow(self, client, cost=1.0):
+        """
+        消耗客户端的 cost 个令牌 (批量查询按号码数计费，最多为桶容量)。
+        返回 (是否允许, 建议的重试等待秒数)。限流关闭时总是允许。
+        """
+        if not self.enabled:
+            return True, 0.0
+        cost = min(cost, self.burst)
+
+        key = self._hash(client)
+        stripe = key % STRIPES
+        start = (key >> 32) % SLOTS_PER_STRIPE
+        stripe_offset = self._slots_offset + stripe * SLOTS_PER_STRIPE * SLOT.size
+        stripe_size = SLOTS_PER_STRIPE * SLOT.size
+        counter_offset = self._counters_offset + stripe * COUNTERS.size
+        now = time.time()
+
+        with self._thread_locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, stripe_size, stripe_offset)
+            try:
+                target = None
+                empty = None
+                oldest = None
+                for i in range(PROBES):
+                    offset = stripe_offset + (start + i) % SLOTS_PER_STRIPE * SLOT.size
+                    slot_key, tokens, updated = SLOT.unpack_from(self._mmap, offset)
+                    if slot_key == key:
+                        target = (offset, tokens, updated)
+                        break
+                    if slot_key == 0:
+                        if empty is None:
+                            empty = offset
+                    elif oldest is None or updated < oldest[1]:
+                        oldest = (offset, updated)
+                if target is None:
+                    # 新客户端从满桶开始，优先使用空槽位，否则淘汰最久未访问的客户端
+                    target = (empty if empty is not None else oldest[0], self.burst, now)
+
+                offset, tokens, updated = target
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                SLOT.pack_into(self._mmap, offset, key, tokens, now)
+
+                allowed_count, throttled_count = COUNTERS.unpack_from(self._mmap, counter_offset)
+                if allowed:
+                    allowed_count += 1
+                else:
+                    throttled_count += 1
+                COUNTERS.pack_into(self._mmap, counter_offset, allowed_count, throttled_count)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, stripe_size, stripe_offset)
+
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / self.rate
+
+    def snapshot_stats(self):
+        """所有 worker 合计的允许/拒绝次数与当前跟踪的客户端数"""
+        stats = {
+            'enabled': self.enabled,
+            'rate_per_second': self.rate,
+            'burst': self.burst,
+            'allowed': 0,
+            'throttled': 0,
+            'tracked_clients': 0,
+        }
+        if not self.enabled:
+            return stats
+        for stripe in range(STRIPES):
+            allowed, throttled = COUNTERS.unpack_from(self._mmap, self._counters_offset + stripe * COUNTERS.size)
+            stats['allowed'] += allowed
+            stats['throttled'] += throttled
+        for i in range(STRIPES * SLOTS_PER_STRIPE):
+            if SLOT.unpack_from(self._mmap, self._slots_offset + i * SLOT.size)[0]:
+                stats['tracked_clients'] += 1
+        total = stats['allowed'] + stats['throttled']
+        stats['throttled_ratio'] = round(stats['throttled'] / total, 4) if total else 0.0
+        return stats
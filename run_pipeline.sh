@@ -2,28 +2,32 @@
 
 # 设置项目在容器内的绝对路径
 APP_DIR="/app"
-# 标记文件也存放在持久化的 data 目录中
-FLAG_DIR="${APP_DIR}/data"
 
-# 获取当前年份和周数，作为本周任务的唯一标识
-CURRENT_WEEK=$(date +%Y-%U)
-FLAG_FILE="${FLAG_DIR}/run_success_week_${CURRENT_WEEK}.flag"
+# 本脚本可以高频运行 (例如每 15 分钟一次)，
+# 是否真正访问网站由 scheduler.py 根据历史发布规律决定：
+# 预计发布窗口内频繁轮询，窗口外指数退避。
+cd ${APP_DIR}
+
+# 1. 检查当前是否需要轮询 (退出码 0: 需要, 3: 尚未到时间)
+python3 scheduler.py check "$@"
+SCHEDULE_STATUS=$?
 
-# 1. 检查本周任务是否已经成功完成
-if [ -f "$FLAG_FILE" ]; then
-    echo "[$(date)] 本周任务 (Week ${CURRENT_WEEK}) 已完成，跳过。"
+if [ ${SCHEDULE_STATUS} -eq 3 ]; then
+    echo "[$(date)] 尚未到下一次轮询时间，跳过。"
     exit 0
+elif [ ${SCHEDULE_STATUS} -ne 0 ]; then
+    echo "[$(date)] 错误：调度检查失败！"
+    exit 1
 fi
 
-echo "[$(date)] 开始为 Week ${CURRENT_WEEK} 执行更新任务..."
-cd ${APP_DIR}
+echo "[$(date)] 开始执行更新任务..."
 
-# 2. 运行下载脚本
+# 2. 运行下载脚本 (带条件请求，页面未变化且没有待解析的文件时直接返回 2)
 python3 download_visas.py
 DOWNLOAD_STATUS=$?
 
 # 3. 检查下载结果
-# 退出码 0: 成功下载了新文件
+# 退出码 0: 有新下载 (或上次解析失败) 的文件需要解析
 if [ ${DOWNLOAD_STATUS} -eq 0 ]; then
     echo "[$(date)] 数据下载成功。开始执行解析..."
     
@@ -33,11 +37,12 @@ if [ ${DOWNLOAD_STATUS} -eq 0 ]; then
 
     if [ ${PARSE_STATUS} -eq 0 ]; then
         echo "[$(date)] 数据解析成功。"
-        # 5. 创建成功标记文件，并记录完成时间
-        date > "$FLAG_FILE"
-        echo "[$(date)] 任务流程全部成功，已创建标记文件: ${FLAG_FILE}"
+        # 解析成功后才保存页面校验信息，之后页面未变化时下载脚本才会返回 2
+        python3 download_visas.py --commit-validators
     else
         echo "[$(date)] 错误：数据解析失败！"
+        # 页面校验信息仍处于待确认状态，下一次轮询即使得到 304 也会重新解析
+        python3 scheduler.py record --status 1
         exit 1
     fi
 # 退出码 2: 未发现新文件
@@ -46,7 +51,11 @@ elif [ ${DOWNLOAD_STATUS} -eq 2 ]; then
 # 其他退出码: 下载过程发生错误
 else
     echo "[$(date)] 错误：数据下载失败！"
+    python3 scheduler.py record --status ${DOWNLOAD_STATUS}
     exit 1
 fi
 
-echo "[$(date)] 任务执行完毕。"
\ No newline at end of file
+# 5. 记录本次轮询结果 (在解析之后记录，以便调度器从最新数据中学习发布规律)
+python3 scheduler.py record --status ${DOWNLOAD_STATUS}
+
+echo "[$(date)] 任务执行完毕。"
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+# 定义常量
+DB_NAME = "data/visas.db"
+SOURCE_TABLE = "source_files"
+STATE_FILE = "data/poll_state.json"
+
+# 轮询参数
+WINDOW_POLL_MINUTES = 30          # 发布窗口内的轮询间隔
+MIN_BACKOFF_MINUTES = 60          # 窗口外首次退避间隔
+MAX_BACKOFF_MINUTES = 24 * 60     # 窗口外最大退避间隔
+DEFAULT_LAG_HOURS = 48            # 历史数据不足时假设的发布延迟 (相对于周期结束日)
+WINDOW_PADDING_HOURS = 12         # 发布窗口两侧的余量
+RELEASE_PERIOD_DAYS = 7           # 每周发布一次
+
+# 退出码: 0 表示需要轮询, 3 表示尚未到轮询时间
+EXIT_DUE = 0
+EXIT_NOT_DUE = 3
+
+
+def load_state():
+    """读取轮询状态文件"""
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    """原子地写入轮询状态文件"""
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp_path = f"{STATE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def _parse_ts(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def learn_release_window(conn):
+    """
+    根据数据库中每个文件的 date_range_end 与首次入库时间学习发布规律。
+    返回 (下一次预计发布窗口开始, 窗口结束, 样本数)。
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT date_range_end, processed_date
+        FROM {SOURCE_TABLE}
+        WHERE date_range_end IS NOT NULL
+    """)
+    rows = cursor.fetchall()
+
+    # 同一批次入库的文件 (例如首次回填历史数据) 只有最新一周的延迟有意义
+    batches = {}
+    latest_end = None
+    for end_str, processed_str in rows:
+        end = _parse_ts(end_str)
+        processed = _parse_ts(processed_str)
+        if end is None:
+            continue
+        if latest_end is None or end > latest_end:
+            latest_end = end
+        if processed is None:
+            continue
+        batch_key = processed.replace(minute=0, second=0, microsecond=0)
+        batch_processed, batch_end = batches.get(batch_key, (processed, end))
+        batches[batch_key] = (min(batch_processed, processed), max(batch_end, end))
+
+    lags = [
+        (processed - end).total_seconds() / 3600
+        for processed, end in batches.values()
+        if processed > end
+    ]
+
+    if latest_end is None:
+        return None, None, 0
+
+    if lags:
+        # 入库时间只是发布时间的上界, 取中位数作为预计发布时间, 以最小/最大值确定窗口宽度
+        median_lag = statistics.median(lags)
+        low_lag = min(min(lags), median_lag - WINDOW_PADDING_HOURS)
+        high_lag = max(max(lags), median_lag + WINDOW_PADDING_HOURS)
+    else:
+        low_lag = DEFAULT_LAG_HOURS - WINDOW_PADDING_HOURS
+        high_lag = DEFAULT_LAG_HOURS + WINDOW_PADDING_HOURS
+
+    next_end = latest_end + timedelta(days=RELEASE_PERIOD_DAYS)
+    window_start = next_end + timedelta(hours=low_lag)
+    window_end = next_end + timedelta(hours=high_lag)
+    return window_start, window_end, len(lags)
+
+
+def next_poll_time(state, window_start, window_end, now):
+    """
+    计算下一次轮询时间:
+    - 在预计发布窗口内按固定的短间隔轮询;
+    - 窗口外按连续未命中次数指数退避, 但不会越过窗口开始时间。
+    """
+    last_poll = _parse_ts(state.get('last_poll'))
+    if last_poll is None:
+        return now
+
+    if window_start is None:
+        # 数据库为空, 无法学习规律, 只做指数退避
+        misses = state.get('misses', 0)
+        backoff = min(MIN_BACKOFF_MINUTES * (2 ** misses), MAX_BACKOFF_MINUTES)
+        return last_poll + timedelta(minutes=backoff)
+
+    if window_start <= now <= window_end:
+        return last_poll + timedelta(minutes=WINDOW_POLL_MINUTES)
+
+    # 窗口外的退避从进入退避状态开始计数, 窗口内的未命中不计入
+    misses = state.get('misses_outside_window', 0)
+    backoff = min(MIN_BACKOFF_MINUTES * (2 ** misses), MAX_BACKOFF_MINUTES)
+    candidate = last_poll + timedelta(minutes=backoff)
+    if now < window_start:
+        candidate = min(candidate, window_start)
+    return candidate
+
+
+def check_due(now=None):
+    """判断当前是否需要访问网站"""
+    now = now or datetime.utcnow()
+    state = load_state()
+
+    window_start, window_end, samples = None, None, 0
+    if os.path.exists(DB_NAME):
+        try:
+            conn = sqlite3.connect(DB_NAME)
+            window_start, window_end, samples = learn_release_window(conn)
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"读取发布规律时发生错误: {e}")
+
+    due_at = next_poll_time(state, window_start, window_end, now)
+    if window_start:
+        print(f"预计发布窗口 (UTC): {window_start:%Y-%m-%d %H:%M} 至 {window_end:%Y-%m-%d %H:%M} (样本数: {samples})")
+    print(f"下一次轮询时间 (UTC): {due_at:%Y-%m-%d %H:%M}")
+    return now >= due_at
+
+
+def record_result(download_status, now=None):
+    """
+    记录一次轮询的结果。
+    download_status 与 download_visas.py 的退出码一致: 0 新文件, 2 无新文件, 其他为错误。
+    """
+    now = now or datetime.utcnow()
+    state = load_state()
+    state['last_poll'] = now.isoformat(timespec='seconds')
+
+    if download_status == 0:
+        state['misses'] = 0
+        state['misses_outside_window'] = 0
+        state['last_success'] = state['last_poll']
+    else:
+        state['misses'] = state.get('misses', 0) + 1
+        window_start, window_end = None, None
+        if os.path.exists(DB_NAME):
+            try:
+                conn = sqlite3.connect(DB_NAME)
+                window_start, window_end, _ = learn_release_window(conn)
+                conn.close()
+            except sqlite3.Error:
+                pass
+        if window_start and window_start <= now <= window_end:
+            state['misses_outside_window'] = 0
+        else:
+            state['misses_outside_window'] = state.get('misses_outside_window', 0) + 1
+
+    save_state(state)
+    print(f"已记录轮询结果: 状态 {download_status}, 连续未命中 {state['misses']} 次")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="根据历史发布规律决定是否轮询签证决定页面")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check', help='检查当前是否需要轮询')
+    check_parser.add_argument('--force', action='store_true', help='忽略调度, 立即轮询')
+    record_parser = subparsers.add_parser('record', help='记录一次轮询结果')
+    record_parser.add_argument('--status', type=int, required=True, help='download_visas.py 的退出码')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        if args.force or check_due():
+            sys.exit(EXIT_DUE)
+        sys.exit(EXIT_NOT_DUE)
+    else:
+        record_result(args.status)
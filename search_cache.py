@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 默认参数
+DEFAULT_CACHE_SIZE = 10000     # 每代缓存的查询结果条数
+BLOOM_BITS_PER_KEY = 10        # 约 1% 的误判率
+BLOOM_HASHES = 7
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix64(keys, seed):
+    """splitmix64 风格的 64 位整数哈希 (向量化)"""
+    with np.errstate(over='ignore'):
+        z = keys.astype(np.uint64) + np.uint64(seed)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (z ^ (z >> np.uint64(31))) & _MASK64
+
+
+class MembershipFilter:
+    """
+    申请号的紧凑成员过滤器: 先判断最小/最大值范围，再查 Bloom filter。
+    返回 False 表示一定不存在，返回 True 表示可能存在。
+    """
+
+    def __init__(self, keys, bits_per_key=BLOOM_BITS_PER_KEY, n_hashes=BLOOM_HASHES):
+        keys = np.unique(np.asarray(keys, dtype=np.int64))
+        self.count = len(keys)
+        self.n_hashes = n_hashes
+        if self.count == 0:
+            self.min_key, self.max_key = 0, -1
+            self.n_bits = 8
+            self.bits = np.zeros(1, dtype=np.uint8)
+            return
+
+        self.min_key, self.max_key = int(keys[0]), int(keys[-1])
+        self.n_bits = max(64, self.count * bits_per_key)
+        positions = np.unique(self._positions(keys).ravel())
+        dense = np.zeros(self.n_bits, dtype=bool)
+        dense[positions] = True
+        self.bits = np.packbits(dense, bitorder='little')
+
+    def _positions(self, keys):
+        # 双重哈希: h1 + i * h2，生成 k 个位置
+        h1 = _mix64(keys, 0x9E3779B97F4A7C15)
+        h2 = _mix64(keys, 0x632BE59BD9B4E019) | np.uint64(1)
+        steps = np.arange(self.n_hashes, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            combined = h1[:, None] + steps[None, :] * h2[:, None]
+        return (combined % np.uint64(self.n_bits)).astype(np.int64)
+
+    def might_contain(self, key):
+        if key < self.min_key or key > self.max_key:
+            return False
+        positions = self._positions(np.array([key], dtype=np.int64))[0]
+        return bool(np.all((self.bits[positions >> 3] >> (positions & 7)) & 1))
+
+    @property
+    def nbytes(self):
+        return int(self.bits.nbytes)
+
+
+class SearchCache:
+    """
+    按数据代数 (generation) 隔离的查询缓存。
+    数据更新后代数变化，旧的 LRU 结果和成员过滤器整体丢弃，不会返回过期结果。
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._generation = None
+        self._entries = OrderedDict()
+        self._filter = None
+        self.stats = {
+            'lookups': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'filter_rejections': 0,
+            'storage_lookups': 0,
+            'generation_changes': 0,
+        }
+
+    def ensure_generation(self, generation, load_keys):
+        """代数变化时清空缓存，并用 load_keys() 返回的申请号重建成员过滤器"""
+        if generation == self._generation:
+            return
+        self.install_generation(generation, MembershipFilter(load_keys()))
+
+    def install_generation(self, generation, membership):
+        """切换到预先构建好的成员过滤器，清空旧一代的缓存结果"""
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._entries.clear()
+                self._filter = membership
+                self.stats['generation_changes'] += 1
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            self.stats['lookups'] += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return self._entries[key]
+            self.stats['cache_misses'] += 1
+            return None
+
+    def peek(self, generation, key):
+        """只查内存中的结果，不构建过滤器也不访问存储；未命中时返回 None 且不计入统计"""
+        with self._lock:
+            if generation != self._generation or key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            self.stats['lookups'] += 1
+            self.stats['cache_hits'] += 1
+            return self._entries[key]
+
+    def put(self, generation, key, value):
+        """写入 generation 代数据的查询结果；查询期间代数已经切换时丢弃，避免旧结果进入新一代的缓存"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def might_contain(self, app_number):
+        """成员过滤器判断；返回 False 时可以直接回答未找到"""
+        membership = self._filter
+        if membership is not None and not membership.might_contain(app_number):
+            with self._lock:
+                self.stats['filter_rejections'] += 1
+            return False
+        with self._lock:
+            self.stats['storage_lookups'] += 1
+        return True
+
+    def snapshot_stats(self):
+        """返回计数器与命中率"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['generation'] = self._generation
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.maxsize
+            stats['filter_keys'] = self._filter.count if self._filter else 0
+            stats['filter_bytes'] = self._filter.nbytes if self._filter else 0
+        lookups = stats['lookups']
+        stats['hit_ratio'] = round(stats['cache_hits'] / lookups, 4) if lookups else 0.0
+        stats['miss_ratio'] = round(stats['cache_misses'] / lookups, 4) if lookups else 0.0
+        misses = stats['cache_misses']
+        stats['filter_rejection_ratio'] = round(stats['filter_rejections'] / misses, 4) if misses else 0.0
+        return stats
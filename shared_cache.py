@@ -0,0 +1,122 @@
+import os
+import glob
+import json
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 默认目录: 每个聚合结果、每代数据一个文件，所有 worker 共享
+CACHE_DIR = "data/cache"
+
+# 每个聚合结果保留的代数: 新一代预热期间旧一代仍可继续提供服务
+KEEP_GENERATIONS = 2
+
+
+class SharedAggregateCache:
+    """
+    跨进程共享的聚合结果缓存，按数据代数 (generation) 失效。
+    - 进程内: 保存已解析的结果，文件未变化时不重复读取；
+    - 进程间: 结果写入 CACHE_DIR/<名称>-<代数摘要>.json (原子替换)，其他 worker 通过页缓存直接读取；
+    - 计算时持有文件锁，同一代数据的同一聚合只会被一个 worker 计算一次。
+    结果必须可以被 JSON 序列化。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._local = {}    # 名称 -> OrderedDict(代数 -> 结果)
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'builds': 0}
+
+    def _path(self, name, generation):
+        digest = hashlib.sha1(str(generation).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}-{digest}.json")
+
+    def _lock_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.lock")
+
+    def _lookup_local(self, name, generation):
+        with self._lock:
+            generations = self._local.get(name)
+            if generations is not None and generation in generations:
+                self.stats['local_hits'] += 1
+                return True, generations[generation]
+        return False, None
+
+    def _store_local(self, name, generation, value):
+        with self._lock:
+            generations = self._local.setdefault(name, OrderedDict())
+            generations[generation] = value
+            generations.move_to_end(generation)
+            while len(generations) > KEEP_GENERATIONS:
+                generations.popitem(last=False)
+
+    def _read_shared(self, name, generation):
+        try:
+            with open(self._path(name, generation), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('generation') != generation:
+            return None
+        return entry
+
+    def _write_shared(self, name, generation, value):
+        path = self._path(name, generation)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'generation': generation, 'value': value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        # 只保留最近几代的文件
+        files = sorted(glob.glob(os.path.join(self.cache_dir, f"{name}-*.json")), key=os.path.getmtime)
+        for old_path in files[:-KEEP_GENERATIONS]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def peek(self, name, generation):
+        """只查进程内的结果，不读文件也不计算；未命中时返回 None"""
+        return self._lookup_local(name, generation)[1]
+
+    def get(self, name, generation, build):
+        """返回 generation 下名称为 name 的聚合结果，三级依次为进程内、共享文件、调用 build() 计算"""
+        found, value = self._lookup_local(name, generation)
+        if found:
+            return value
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            lock_file = open(self._lock_path(name), 'w')
+        except OSError as e:
+            # 缓存目录不可写时退化为进程内缓存
+            print(f"共享缓存不可用: {e}")
+            value = build()
+            self._store_local(name, generation, value)
+            with self._lock:
+                self.stats['builds'] += 1
+            return value
+
+        with lock_file:
+            shared = self._read_shared(name, generation)
+            if shared is None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # 等锁期间其他 worker 可能已经算好
+                    shared = self._read_shared(name, generation)
+                    if shared is None:
+                        value = build()
+                        self._write_shared(name, generation, value)
+                        with self._lock:
+                            self.stats['builds'] += 1
+                        shared = {'value': value}
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                with self._lock:
+                    self.stats['shared_hits'] += 1
+
+        value = shared['value']
+        self._store_local(name, generation, value)
+        return value
@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from maintenance import ARCHIVE_TABLE, load_archived_counts
+
+# 定义常量
+DB_NAME = "data/visas.db"
+SNAPSHOT_PATH = "data/visas.snapshot"
+TABLE_NAME = "visa_decisions"
+SOURCE_TABLE = "source_files"
+DECISION_TABLE = "decision_codes"
+WEEK_STATS_TABLE = "week_number_stats"
+
+# 文件格式:
+#   MAGIC (8 字节) | 头部长度 (uint32, 小端) | 头部 JSON (补齐到 8 字节)
+#   | application_numbers int64[n] | week_ids uint16[n] | source_ids uint16[n] | decision_codes uint8[n]
+# 所有数组按 (application_number, week_id) 排序，头部 JSON 中保存周表、源文件表和决定表，
+# 以及已归档各周的计数 (这些周不在数组中)。
+MAGIC = b'VISASNP1'
+FORMAT_VERSION = 1
+COLUMNS = (
+    ('application_numbers', np.int64),
+    ('week_ids', np.uint16),
+    ('source_ids', np.uint16),
+    ('decision_codes', np.uint8),
+)
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_snapshot(conn, path=SNAPSHOT_PATH):
+    """
+    从数据库导出列式快照。先写入临时文件再原子替换，
+    已经映射旧文件的进程不受影响，下次检查时自动切换到新文件。
+    """
+    cursor = conn.cursor()
+
+    # 周表: 按开始日期排序的 (开始, 结束) 日期对
+    cursor.execute(f"""
+        SELECT DISTINCT date_range_start, date_range_end FROM {SOURCE_TABLE}
+        WHERE date_range_start IS NOT NULL AND date_range_end IS NOT NULL
+        ORDER BY date_range_start, date_range_end
+    """)
+    weeks = [{'start': str(start), 'end': str(end)} for start, end in cursor.fetchall()]
+    week_index = {(w['start'], w['end']): i for i, w in enumerate(weeks)}
+
+    # 每周申请号分布 (入库时计算)，供排队进度估算使用
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (WEEK_STATS_TABLE,))
+    if cursor.fetchone():
+        cursor.execute(f"SELECT * FROM {WEEK_STATS_TABLE}")
+        columns = [c[0] for c in cursor.description]
+        for row in cursor.fetchall():
+            record = dict(zip(columns, row))
+            i = week_index.get((str(record.pop('date_range_start')), str(record.pop('date_range_end'))))
+            if i is not None:
+                weeks[i]['numbers'] = record
+
+    cursor.execute(f"""
+        SELECT source_id, source_file, date_range_start, date_range_end, processed_date
+        FROM {SOURCE_TABLE} ORDER BY source_id
+    """)
+    sources = []
+    source_index = {}
+    for source_id, source_file, start, end, processed_date in cursor.fetchall():
+        source_index[source_id] = len(sources)
+        sources.append({
+            'source_file': source_file,
+            'week_id': week_index.get((str(start), str(end))),
+            'processed_date': processed_date,
+        })
+
+    cursor.execute(f"SELECT decision_code, decision FROM {DECISION_TABLE}")
+    decisions = {str(code): decision for code, decision in cursor.fetchall()}
+
+    # 已归档的周没有明细行，只保存每种决定的计数，统计图表照常包含这些周
+    archived_weeks = []
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ARCHIVE_TABLE,))
+    if cursor.fetchone():
+        for start, end, code, count in load_archived_counts(cursor):
+            if not archived_weeks or (archived_weeks[-1]['start'], archived_weeks[-1]['end']) != (start, end):
+                archived_weeks.append({'start': start, 'end': end, 'counts': {}})
+            archived_weeks[-1]['counts'][str(code)] = count
+
+    # 数据库中的 source_id 映射为快照源文件表中的下标
+    source_lookup = np.full(max(source_index, default=0) + 1, -1, dtype=np.int32)
+    for source_id, index in source_index.items():
+        source_lookup[source_id] = index
+
+    # 分批读取，避免一次性构造大量 Python 元组
+    columns = ([], [], [])
+    cursor.execute(f"SELECT application_number, source_id, decision_code FROM {TABLE_NAME}")
+    while True:
+        batch = cursor.fetchmany(100000)
+        if not batch:
+            break
+        block = np.array(batch, dtype=np.int64)
+        columns[0].append(block[:, 0])
+        columns[1].append(source_lookup[block[:, 1]])
+        columns[2].append(block[:, 2])
+    if columns[0]:
+        app_numbers, source_ids, decision_codes = (np.concatenate(c) for c in columns)
+    else:
+        app_numbers, source_ids, decision_codes = (np.empty(0, dtype=np.int64) for _ in columns)
+    n_rows = len(app_numbers)
+
+    # 没有日期的源文件不属于任何一周，不写入快照
+    source_week = np.array([s['week_id'] if s['week_id'] is not None else -1 for s in sources] or [-1], dtype=np.int32)
+    row_weeks = source_week[source_ids]
+    keep = row_weeks >= 0
+    app_numbers, source_ids, decision_codes, row_weeks = (
+        app_numbers[keep], source_ids[keep], decision_codes[keep], row_weeks[keep]
+    )
+
+    # 只保留仍有数据的周: 源文件被删除后，它的日期范围不再出现在快照中
+    used_weeks = np.unique(row_weeks)
+    week_remap = np.full(len(weeks) + 1, -1, dtype=np.int32)
+    week_remap[used_weeks] = np.arange(len(used_weeks), dtype=np.int32)
+    weeks = [weeks[i] for i in used_weeks]
+    for source in sources:
+        if source['week_id'] is not None:
+            new_id = int(week_remap[source['week_id']])
+            source['week_id'] = new_id if new_id >= 0 else None
+    week_ids = week_remap[row_weeks].astype(np.uint16)
+
+    order = np.lexsort((week_ids, app_numbers))
+    arrays = {
+        'application_numbers': app_numbers[order],
+        'week_ids': week_ids[order],
+        'source_ids': source_ids[order],
+        'decision_codes': decision_codes[order],
+    }
+
+    header = {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'rows': int(len(order)),
+        'weeks': weeks,
+        'sources': sources,
+        'decisions': decisions,
+        'archived_weeks': archived_weeks,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_offset = _align(len(MAGIC) + 4 + len(header_bytes))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (data_offset - f.tell()))
+        for name, dtype in COLUMNS:
+            f.write(arrays[name].astype(dtype, copy=False).tobytes())
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+    os.replace(tmp_path, path)
+    return header['rows']
+
+
+class Snapshot:
+    """
+    只读的内存映射快照。数组直接指向映射的页面，
+    多个 gunicorn worker 打开同一文件时共享操作系统的页缓存。
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"'{path}' 不是有效的快照文件")
+        (header_len,) = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        self.header = json.loads(self._mmap[header_start:header_start + header_len].decode('utf-8'))
+        if self.header.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"快照格式版本不匹配: {self.header.get('format_version')}")
+
+        n_rows = self.header['rows']
+        offset = _align(header_start + header_len)
+        for name, dtype in COLUMNS:
+            array = np.frombuffer(self._mmap, dtype=dtype, count=n_rows, offset=offset)
+            setattr(self, name, array)
+            offset = _align(offset + array.nbytes)
+
+        self.weeks = self.header['weeks']
+        self.sources = self.header['sources']
+        self.decisions = {int(code): name for code, name in self.header['decisions'].items()}
+        self.archived_weeks = self.header.get('archived_weeks', [])
+
+    def __len__(self):
+        return self.header['rows']
+
+    @property
+    def generation(self):
+        """快照文件的代数标识，文件被替换后随之变化"""
+        return f"snapshot:{self.stat.st_ino}:{self.stat.st_mtime_ns}"
+
+    def find(self, app_number):
+        """返回申请号对应的行范围 (左闭右开)，二分查找"""
+        left = int(np.searchsorted(self.application_numbers, app_number, side='left'))
+        right = int(np.searchsorted(self.application_numbers, app_number, side='right'))
+        return left, right
+
+    def find_range(self, low, high):
+        """返回申请号在闭区间 [low, high] 内的行范围 (左闭右开)"""
+        left = int(np.searchsorted(self.application_numbers, low, side='left'))
+        right = int(np.searchsorted(self.application_numbers, high, side='right'))
+        return left, right
+
+    def scan_distinct(self, start, stop, limit, step=1):
+        """
+        从下标 start 开始按 step 方向扫描 (不越过 stop)，直到覆盖 limit 个不同的申请号。
+        返回 (结束下标, 是否还有更多)。扫描的行数与结果大小成正比。
+        """
+        numbers = self.application_numbers
+        i = start
+        seen = 0
+        previous = None
+        while i != stop:
+            number = int(numbers[i])
+            if number != previous:
+                if seen == limit:
+                    return i, True
+                seen += 1
+                previous = number
+            i += step
+        return i, False
+
+    def row(self, i):
+        """返回第 i 行: (申请号, 决定, 源文件, 开始日期, 结束日期, 处理时间)"""
+        week = self.weeks[int(self.week_ids[i])]
+        source = self.sources[int(self.source_ids[i])]
+        return (
+            int(self.application_numbers[i]),
+            self.decisions.get(int(self.decision_codes[i]), 'N/A'),
+            source['source_file'],
+            week['start'],
+            week['end'],
+            source['processed_date'],
+        )
+
+    def weekly_decision_counts(self):
+        """按 (周, 决定编码) 统计行数，返回形状为 [周数, 最大编码 + 1] 的矩阵"""
+        n_codes = max(self.decisions, default=0) + 1
+        flat = self.week_ids.astype(np.int64) * n_codes + self.decision_codes
+        counts = np.bincount(flat, minlength=len(self.weeks) * n_codes)
+        return counts.reshape(len(self.weeks), n_codes)
+
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """
+    返回当前进程共享的快照对象。文件被替换 (inode 或修改时间变化) 时重新映射，
+    快照不存在或无法读取时返回 None，调用方应回退到数据库查询。
+    """
+    global _snapshot
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    current = _snapshot
+    if current is not None and current.path == path \
+            and (current.stat.st_ino, current.stat.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+        return current
+
+    with _snapshot_lock:
+        current = _snapshot
+        if current is not None and current.path == path \
+                and (current.stat.st_ino, current.stat.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+            return current
+        try:
+            _snapshot = Snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"加载快照失败: {e}")
+            return None
+        return _snapshot
+
+
+if __name__ == "__main__":
+    # 手动从现有数据库重建快照
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_NAME
+    conn = sqlite3.connect(db_path)
+    rows = write_snapshot(conn)
+    conn.close()
+    print(f"快照已写入 {SNAPSHOT_PATH}，共 {rows} 条记录")
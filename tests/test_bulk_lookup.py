@@ -0,0 +1,61 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk_lookup import MAX_DIGITS, iter_chunks, parse_chunk
+
+
+class ParseChunkTest(unittest.TestCase):
+
+    def test_canonical_numbers_use_fast_path(self):
+        texts, numbers, valid = parse_chunk(b"12, 345\n6789\n")
+        self.assertEqual(texts, ['12', '345', '6789'])
+        self.assertEqual(numbers.tolist(), [12, 345, 6789])
+        self.assertIsNone(valid)
+
+    def test_leading_zeros_are_canonicalised(self):
+        texts, numbers, valid = parse_chunk(b"0012 345\n" + b"0" * 20 + b"7\n")
+        self.assertEqual(texts, ['12', '345', '7'])
+        self.assertEqual(numbers.tolist(), [12, 345, 7])
+        self.assertEqual(valid.tolist(), [True, True, True])
+
+    def test_more_than_max_digits_is_invalid(self):
+        longest = b"9" * MAX_DIGITS
+        too_long = b"1" + b"0" * MAX_DIGITS
+        overflow = b"9" * 20
+        texts, numbers, valid = parse_chunk(b" ".join([longest, too_long, overflow, b"5"]))
+        self.assertEqual(texts, [longest.decode(), too_long.decode(), overflow.decode(), '5'])
+        self.assertEqual(valid.tolist(), [True, False, False, True])
+        self.assertEqual(numbers.tolist(), [10 ** MAX_DIGITS - 1, -1, -1, 5])
+
+    def test_invalid_tokens_are_kept_verbatim(self):
+        texts, numbers, valid = parse_chunk("12a -5 ４２ 7\n".encode('utf-8'))
+        self.assertEqual(texts, ['12a', '-5', '４２', '7'])
+        self.assertEqual(valid.tolist(), [False, False, False, True])
+        self.assertEqual(numbers.tolist(), [-1, -1, -1, 7])
+
+    def test_empty_chunk(self):
+        texts, numbers, valid = parse_chunk(b" \n,\n")
+        self.assertEqual(texts, [])
+        self.assertEqual(len(numbers), 0)
+
+
+class IterChunksTest(unittest.TestCase):
+
+    def test_numbers_are_not_split_at_chunk_boundary(self):
+        stream = io.BytesIO(b"123456\n789\n42")
+        chunks = list(iter_chunks(stream, chunk_bytes=4))
+        self.assertTrue(all(chunk.endswith(b"\n") for chunk in chunks[:-1]))
+        self.assertEqual(b"".join(chunks), b"123456\n789\n42")
+        texts = [text for chunk in chunks for text in parse_chunk(chunk)[0]]
+        self.assertEqual(texts, ['123456', '789', '42'])
+
+    def test_trailing_whitespace_yields_nothing(self):
+        self.assertEqual(list(iter_chunks(io.BytesIO(b"1\n  "), chunk_bytes=2)), [b"1\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parse_pdfs
+from history import RUNS_TABLE
+
+WEEK_FILE = "Beijing_Visa_Decisions_02_June_to_08_June_2025.pdf"
+
+# 测试用的 "PDF": 文件内容决定提取结果，内容为 BROKEN 时提取失败
+CONTENTS = {
+    b"v1": [(1001, 'Approved'), (1002, 'Refused'), (1003, 'Approved')],
+    b"v2": [(1001, 'Approved'), (1002, 'Approved'), (1004, 'Approved')],
+}
+BROKEN = b"broken"
+
+
+def fake_extract(file_path, content_hash, profiler, use_cache=True):
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    if content == BROKEN:
+        raise ValueError("无法解析的 PDF")
+    return list(CONTENTS[content]), False
+
+
+class IngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix="visa_ingest_")
+        os.makedirs(os.path.join(self.workdir, parse_pdfs.PDF_DIR))
+        os.chdir(self.workdir)
+        self.original_extract = parse_pdfs.extract_rows_cached
+        parse_pdfs.extract_rows_cached = fake_extract
+        self.conn = parse_pdfs.setup_database(rebuild=True)
+
+    def tearDown(self):
+        parse_pdfs.extract_rows_cached = self.original_extract
+        self.conn.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def publish(self, content):
+        with open(os.path.join(parse_pdfs.PDF_DIR, WEEK_FILE), 'wb') as f:
+            f.write(content)
+
+    def rows(self):
+        return sorted(self.conn.execute(
+            f"SELECT application_number, decision_code FROM {parse_pdfs.TABLE_NAME}"
+        ).fetchall())
+
+    def source_hash(self):
+        return self.conn.execute(
+            f"SELECT content_hash FROM {parse_pdfs.SOURCE_TABLE} WHERE source_file = ?", (WEEK_FILE,)
+        ).fetchone()[0]
+
+    def test_failed_extraction_keeps_old_rows_and_is_retried(self):
+        self.publish(b"v1")
+        self.assertTrue(parse_pdfs.parse_and_store_pdfs(self.conn))
+        rows, content_hash = self.rows(), self.source_hash()
+        self.assertEqual(len(rows), 3)
+
+        # 新版本无法解析: 旧的行和哈希保持不变，返回失败
+        self.publish(BROKEN)
+        self.assertFalse(parse_pdfs.parse_and_store_pdfs(self.conn))
+        self.assertEqual(self.rows(), rows)
+        self.assertEqual(self.source_hash(), content_hash)
+        self.assertEqual(self.conn.execute(f"SELECT COUNT(*) FROM {parse_pdfs.WEEK_STATS_TABLE}").fetchone()[0], 1)
+
+        # 下次运行不会把该周当作未变化而跳过
+        attempts = []
+        parse_pdfs.extract_rows_cached = lambda *args, **kwargs: attempts.append(args[0]) or fake_extract(*args, **kwargs)
+        self.assertFalse(parse_pdfs.parse_and_store_pdfs(self.conn))
+        self.assertEqual(len(attempts), 1)
+
+        # 文件修复后正常入库
+        self.publish(b"v2")
+        self.assertTrue(parse_pdfs.parse_and_store_pdfs(self.conn))
+        self.assertEqual([number for number, _ in self.rows()], [1001, 1002, 1004])
+        self.assertNotEqual(self.source_hash(), content_hash)
+
+    def test_database_error_rolls_back_and_propagates(self):
+        self.publish(b"v1")
+        self.assertTrue(parse_pdfs.parse_and_store_pdfs(self.conn))
+        rows, content_hash = self.rows(), self.source_hash()
+
+        def failing_write(*args, **kwargs):
+            raise sqlite3.OperationalError("database is locked")
+
+        original_write = parse_pdfs.write_changes
+        parse_pdfs.write_changes = failing_write
+        try:
+            self.publish(b"v2")
+            with self.assertRaises(sqlite3.Error):
+                parse_pdfs.parse_and_store_pdfs(self.conn)
+        finally:
+            parse_pdfs.write_changes = original_write
+        self.assertEqual(self.rows(), rows)
+        self.assertEqual(self.source_hash(), content_hash)
+
+    def run_count(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {RUNS_TABLE}").fetchone()[0]
+
+    def test_unchanged_rerun_records_no_run(self):
+        self.publish(b"v1")
+        self.assertTrue(parse_pdfs.parse_and_store_pdfs(self.conn))
+        self.assertEqual(self.run_count(), 1)
+
+        self.assertTrue(parse_pdfs.parse_and_store_pdfs(self.conn))
+        self.assertEqual(self.run_count(), 1)
+
+        self.publish(b"v2")
+        self.assertTrue(parse_pdfs.parse_and_store_pdfs(self.conn))
+        self.assertEqual(self.run_count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
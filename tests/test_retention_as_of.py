@@ -0,0 +1,88 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parse_pdfs
+import visa_dashboard
+from history import OP_ADDED, OP_REMOVED, begin_run, finish_run, record_deltas
+from maintenance import archive_old_weeks
+
+APPROVED = parse_pdfs.DECISION_CODES['Approved']
+REFUSED = parse_pdfs.DECISION_CODES['Refused']
+
+
+class ArchivedWeeksAsOfTest(unittest.TestCase):
+    """归档之后，无法正确还原的 as_of 入库返回 400，仍可回溯的入库结果不变"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix="visa_retention_")
+        os.makedirs(os.path.join(self.workdir, "data"))
+        os.chdir(self.workdir)
+
+        conn = parse_pdfs.setup_database(rebuild=True)
+        cursor = conn.cursor()
+        old = parse_pdfs.register_source_file(cursor, "old.pdf", "h-old", "2024-01-01", "2024-01-07", "text")
+        new = parse_pdfs.register_source_file(cursor, "new.pdf", "h-new", "2025-06-02", "2025-06-08", "text")
+
+        # 第 1 次入库: 两周的初始数据
+        self.run_1 = begin_run(cursor)
+        rows = [(1, old, APPROVED), (2, old, APPROVED), (3, old, APPROVED), (10, new, APPROVED), (11, new, REFUSED)]
+        cursor.executemany(f"INSERT INTO {parse_pdfs.TABLE_NAME} VALUES (?, ?, ?)", rows)
+        record_deltas(cursor, self.run_1, OP_ADDED, rows)
+        finish_run(cursor, self.run_1, len(rows), 0)
+
+        # 第 2 次入库: 旧的一周重新发布，申请 3 改为拒签
+        self.run_2 = begin_run(cursor)
+        cursor.execute(f"UPDATE {parse_pdfs.TABLE_NAME} SET decision_code = ? WHERE application_number = 3", (REFUSED,))
+        record_deltas(cursor, self.run_2, OP_REMOVED, [(3, old, APPROVED)])
+        record_deltas(cursor, self.run_2, OP_ADDED, [(3, old, REFUSED)])
+        finish_run(cursor, self.run_2, 1, 1)
+
+        # 第 3 次入库: 只有新的一周变化
+        self.run_3 = begin_run(cursor)
+        cursor.execute(f"INSERT INTO {parse_pdfs.TABLE_NAME} VALUES (12, ?, ?)", (new, APPROVED))
+        record_deltas(cursor, self.run_3, OP_ADDED, [(12, new, APPROVED)])
+        finish_run(cursor, self.run_3, 1, 0)
+        conn.commit()
+        self.conn = conn
+
+    def tearDown(self):
+        self.conn.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def weekly_counts(self, run_id):
+        df = visa_dashboard.load_weekly_counts(run_id)
+        return {(row.date_range_start, row.decision): row.count for row in df.itertuples()}
+
+    def test_as_of_before_archived_change_is_rejected(self):
+        self.assertEqual(visa_dashboard.resolve_as_of(str(self.run_1)), (self.run_1, None))
+
+        archived = archive_old_weeks(self.conn, months=6, archive_dir="data/archive", today=date(2025, 7, 1))
+        self.assertEqual(archived, [("2024-01-01", "2024-01-07", 3)])
+
+        # 第 1 次入库时旧的一周与归档计数不同，不能再还原
+        payload, status = visa_dashboard.data_payload(str(self.run_1))
+        self.assertEqual(status, 400)
+        self.assertFalse(payload['success'])
+
+        # 第 2 次入库之后旧的一周没有变化，归档计数即当时的状态
+        run_id, error = visa_dashboard.resolve_as_of(str(self.run_2))
+        self.assertIsNone(error)
+        self.assertEqual(self.weekly_counts(run_id), {
+            ("2024-01-01", "Approved"): 2,
+            ("2024-01-01", "Refused"): 1,
+            ("2025-06-02", "Approved"): 1,
+            ("2025-06-02", "Refused"): 1,
+        })
+        self.assertEqual(visa_dashboard.resolve_as_of(str(self.run_3)), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_cache import MembershipFilter, SearchCache
+
+
+class SearchCacheTest(unittest.TestCase):
+
+    def test_put_after_generation_change_is_dropped(self):
+        cache = SearchCache()
+        cache.install_generation("g1", MembershipFilter([1, 2, 3]))
+
+        # 查询在 g1 开始，完成前数据切换到 g2: 旧结果不能进入 g2 的缓存
+        cache.install_generation("g2", MembershipFilter([1, 2, 4]))
+        cache.put("g1", "3", {'success': True})
+        self.assertIsNone(cache.get("3"))
+        self.assertIsNone(cache.peek("g2", "3"))
+
+        cache.put("g2", "4", {'success': True})
+        self.assertEqual(cache.peek("g2", "4"), {'success': True})
+        self.assertIsNone(cache.peek("g1", "4"))
+
+    def test_generation_change_clears_entries(self):
+        cache = SearchCache()
+        cache.install_generation("g1", MembershipFilter([1]))
+        cache.put("g1", "1", {'success': True})
+        cache.ensure_generation("g2", lambda: [1])
+        self.assertIsNone(cache.get("1"))
+        self.assertEqual(cache.snapshot_stats()['generation_changes'], 2)
+
+
+class MembershipFilterTest(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        rng = np.random.default_rng(42)
+        keys = rng.integers(10 ** 7, 10 ** 9, size=20000)
+        membership = MembershipFilter(keys)
+        self.assertTrue(all(membership.might_contain(int(key)) for key in keys))
+        # 范围两端与重复的申请号
+        self.assertTrue(membership.might_contain(int(keys.min())))
+        self.assertTrue(membership.might_contain(int(keys.max())))
+        self.assertEqual(membership.count, len(np.unique(keys)))
+
+    def test_rejects_out_of_range_and_most_absent_keys(self):
+        keys = np.arange(1000, 200000, 7)
+        membership = MembershipFilter(keys)
+        self.assertFalse(membership.might_contain(999))
+        self.assertFalse(membership.might_contain(200001))
+        absent = np.arange(1001, 200000, 7)
+        false_positives = sum(membership.might_contain(int(key)) for key in absent)
+        self.assertLess(false_positives / len(absent), 0.05)
+
+    def test_empty_filter_contains_nothing(self):
+        membership = MembershipFilter([])
+        self.assertFalse(membership.might_contain(0))
+        self.assertFalse(membership.might_contain(12345))
+
+
+if __name__ == "__main__":
+    unittest.main()
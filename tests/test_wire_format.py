@@ -0,0 +1,113 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wire_format
+from wire_format import (
+    COLUMNAR_TYPE, MSGPACK_TYPE, negotiate, encode, decode,
+    columnar_data, expand_data, columnar_search, expand_search,
+)
+
+DATA_PAYLOAD = {
+    'labels': ['6月2日-8日', '6月9日-15日', '6月30日-7月6日'],
+    'total_applications': [120, 98, 0],
+    'refused_count': [15, 7, 0],
+    'refusal_rate': [12.5, 7.14, None],
+    'summary': {'total_applications': 218, 'refusal_rate': 10.09, 'date_range': '6月2日 至 7月6日'},
+}
+
+SEARCH_PAYLOAD = {
+    'success': True,
+    'results': [
+        {'application_number': 65220982, 'decision': 'Refused', 'week': '6月9日-15日',
+         'source_file': 'Beijing_Visa_Decisions_09_June_to_15_June_2025.pdf', 'processed_date': '2025-06-16 08:00:00'},
+        {'application_number': 65221242, 'decision': 'Approved', 'week': '6月9日-15日',
+         'source_file': 'Beijing_Visa_Decisions_09_June_to_15_June_2025.pdf', 'processed_date': '2025-06-16 08:00:00'},
+        {'application_number': 65221242, 'decision': 'Refused', 'week': '6月2日-8日',
+         'source_file': 'Beijing_Visa_Decisions_02_June_to_08_June_2025.pdf', 'processed_date': '2025-06-09 08:00:00'},
+    ],
+    'count': 3,
+    'found': 2,
+    'not_found': [1],
+}
+
+
+def formats():
+    return ['columnar', 'msgpack'] if wire_format.msgpack_available() else ['columnar']
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def test_data_round_trip(self):
+        for fmt in formats():
+            with self.subTest(fmt=fmt):
+                self.assertEqual(expand_data(decode(*encode(columnar_data(DATA_PAYLOAD), fmt))), DATA_PAYLOAD)
+
+    def test_search_round_trip(self):
+        for fmt in formats():
+            with self.subTest(fmt=fmt):
+                document = columnar_search(SEARCH_PAYLOAD)
+                self.assertEqual(document['decisions'], ['Refused', 'Approved'])
+                self.assertEqual(len(document['weeks']['label']), 2)
+                self.assertEqual(expand_search(decode(*encode(document, fmt))), SEARCH_PAYLOAD)
+
+    def test_empty_search_round_trip(self):
+        payload = {'success': True, 'results': [], 'count': 0, 'found': 0, 'not_found': [5, 6]}
+        self.assertEqual(expand_search(decode(*encode(columnar_search(payload), 'columnar'))), payload)
+
+
+class NegotiateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.original_available = wire_format.msgpack_available
+
+    def tearDown(self):
+        wire_format.msgpack_available = self.original_available
+
+    def test_default_and_wildcard_are_json(self):
+        self.assertEqual(negotiate(''), ('json', None))
+        self.assertEqual(negotiate(None), ('json', None))
+        self.assertEqual(negotiate('*/*'), ('json', None))
+        self.assertEqual(negotiate('text/html, application/*;q=0.8'), ('json', None))
+        # 通配符 q 值更高时仍返回 JSON，q 值相同时选更具体的紧凑格式
+        self.assertEqual(negotiate(f'{COLUMNAR_TYPE};q=0.5, */*'), ('json', None))
+        self.assertEqual(negotiate(f'*/*, {COLUMNAR_TYPE}'), ('columnar', None))
+
+    def test_q_zero_excludes_type(self):
+        self.assertEqual(negotiate(f'{COLUMNAR_TYPE};q=0'), ('json', None))
+        self.assertEqual(negotiate(f'{COLUMNAR_TYPE};q=0, application/json;q=0.1'), ('json', None))
+        self.assertEqual(negotiate(f'{COLUMNAR_TYPE};q=bogus'), ('json', None))
+        self.assertEqual(negotiate(f'application/json;q=0.2, {COLUMNAR_TYPE};q=0.3'), ('columnar', None))
+
+    def test_msgpack_missing(self):
+        wire_format.msgpack_available = lambda: True
+        self.assertEqual(negotiate(MSGPACK_TYPE), ('msgpack', None))
+
+        wire_format.msgpack_available = lambda: False
+        self.assertEqual(negotiate(MSGPACK_TYPE), ('json', None))
+        self.assertEqual(negotiate(f'{MSGPACK_TYPE}, {COLUMNAR_TYPE};q=0.5'), ('columnar', None))
+        fmt, error = negotiate('', 'msgpack')
+        self.assertIsNone(fmt)
+        self.assertIsNotNone(error)
+
+    def test_format_param_overrides_accept(self):
+        self.assertEqual(negotiate(COLUMNAR_TYPE, 'json'), ('json', None))
+        self.assertEqual(negotiate('', ' Columnar '), ('columnar', None))
+        self.assertEqual(negotiate(COLUMNAR_TYPE, '  '), ('columnar', None))
+
+    def test_bad_format_param_returns_406(self):
+        fmt, error = negotiate(COLUMNAR_TYPE, 'xml')
+        self.assertIsNone(fmt)
+        self.assertIn('xml', error)
+
+        import visa_dashboard
+        with visa_dashboard.app.test_request_context('/api/search/batch?format=xml'):
+            response = visa_dashboard.negotiated_response(SEARCH_PAYLOAD, columnar_search)
+        self.assertEqual(response.status_code, 406)
+        self.assertFalse(response.get_json()['success'])
+
+
+if __name__ == "__main__":
+    unittest.main()
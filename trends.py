@@ -0,0 +1,138 @@
+import numpy as np
+
+# 定义常量
+TREND_TABLE = "week_trends"
+REFUSED = "Refused"
+
+# 滚动拒签率的窗口 (周数)
+ROLLING_WINDOWS = (4, 12)
+
+# 每周决定数量的分位点
+VOLUME_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def create_trend_table(cursor):
+    """
+    每周决定数与拒签数，以及截至该周的累计值 (前缀和)。
+    任意窗口的滚动拒签率都可以由两行累计值相减得到，无需扫描历史。
+    """
+    cursor.execute(f'''
+    CREATE TABLE {TREND_TABLE} (
+        date_range_start DATE NOT NULL,
+        date_range_end DATE NOT NULL,
+        decisions INTEGER NOT NULL,
+        refused INTEGER NOT NULL,
+        cum_decisions INTEGER NOT NULL,
+        cum_refused INTEGER NOT NULL,
+        PRIMARY KEY (date_range_start, date_range_end)
+    )
+    ''')
+
+
+def update_week_trends(cursor, week_counts, removed_weeks=()):
+    """
+    写入有变化的周 {(开始, 结束): (决定数, 拒签数)}，删除 removed_weeks 中的周，
+    然后只从最早变化的一周开始重算累计值。新增最新一周时只更新一行。
+    """
+    for (start_date, end_date), (decisions, refused) in week_counts.items():
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {TREND_TABLE} VALUES (?, ?, ?, ?, 0, 0)",
+            (str(start_date), str(end_date), decisions, refused)
+        )
+    for start_date, end_date in removed_weeks:
+        cursor.execute(
+            f"DELETE FROM {TREND_TABLE} WHERE date_range_start = ? AND date_range_end = ?",
+            (str(start_date), str(end_date))
+        )
+
+    changed = [str(start) for start, _ in week_counts] + [str(start) for start, _ in removed_weeks]
+    if not changed:
+        return
+    earliest = min(changed)
+
+    cursor.execute(f"""
+        SELECT cum_decisions, cum_refused FROM {TREND_TABLE}
+        WHERE date_range_start < ? ORDER BY date_range_start DESC, date_range_end DESC LIMIT 1
+    """, (earliest,))
+    row = cursor.fetchone()
+    cum_decisions, cum_refused = row if row else (0, 0)
+
+    cursor.execute(f"""
+        SELECT date_range_start, date_range_end, decisions, refused FROM {TREND_TABLE}
+        WHERE date_range_start >= ? ORDER BY date_range_start, date_range_end
+    """, (earliest,))
+    updates = []
+    for start_date, end_date, decisions, refused in cursor.fetchall():
+        cum_decisions += decisions
+        cum_refused += refused
+        updates.append((cum_decisions, cum_refused, start_date, end_date))
+    cursor.executemany(
+        f"UPDATE {TREND_TABLE} SET cum_decisions = ?, cum_refused = ? "
+        f"WHERE date_range_start = ? AND date_range_end = ?",
+        updates
+    )
+
+
+def load_week_trends(conn):
+    """按时间顺序读取每周趋势行"""
+    cursor = conn.execute(f"""
+        SELECT date_range_start, date_range_end, decisions, refused, cum_decisions, cum_refused
+        FROM {TREND_TABLE} ORDER BY date_range_start, date_range_end
+    """)
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _rate(refused, decisions):
+    return round(refused / decisions * 100, 2) if decisions else None
+
+
+def compute_trends(rows):
+    """
+    根据累计值计算趋势: 每周拒签率、滚动拒签率 (按决定数加权)、
+    环比变化，以及每周决定数的分位数。每周的计算量为常数。
+    """
+    weeks = []
+    for i, row in enumerate(rows):
+        week = {
+            'date_range_start': row['date_range_start'],
+            'date_range_end': row['date_range_end'],
+            'decisions': row['decisions'],
+            'refused': row['refused'],
+            'refusal_rate': _rate(row['refused'], row['decisions']),
+        }
+        for window in ROLLING_WINDOWS:
+            # 窗口不足 window 周时按已有的周计算
+            base = rows[i - window] if i >= window else {'cum_decisions': 0, 'cum_refused': 0}
+            week[f'rolling_{window}w_refusal_rate'] = _rate(
+                row['cum_refused'] - base['cum_refused'], row['cum_decisions'] - base['cum_decisions']
+            )
+        if i > 0:
+            previous = weeks[-1]
+            week['decisions_change'] = row['decisions'] - previous['decisions']
+            week['refusal_rate_change'] = (
+                round(week['refusal_rate'] - previous['refusal_rate'], 2)
+                if week['refusal_rate'] is not None and previous['refusal_rate'] is not None else None
+            )
+        else:
+            week['decisions_change'] = None
+            week['refusal_rate_change'] = None
+        weeks.append(week)
+
+    summary = {'weeks': len(rows)}
+    if rows:
+        last = rows[-1]
+        volumes = np.array([row['decisions'] for row in rows], dtype=np.int64)
+        rates = [week['refusal_rate'] for week in weeks if week['refusal_rate'] is not None]
+        summary.update({
+            'total_decisions': last['cum_decisions'],
+            'total_refused': last['cum_refused'],
+            'weighted_refusal_rate': _rate(last['cum_refused'], last['cum_decisions']),
+            'unweighted_refusal_rate': round(sum(rates) / len(rates), 2) if rates else None,
+            'volume_percentiles': {
+                f'p{q}': round(float(v), 1) for q, v in zip(VOLUME_PERCENTILES, np.percentile(volumes, VOLUME_PERCENTILES))
+            },
+            # 最近一周的决定数在历史中的百分位
+            'latest_volume_rank': round(float((volumes <= volumes[-1]).mean() * 100), 1),
+        })
+    return {'weeks': weeks, 'summary': summary}
@@ -2,46 +2,89 @@ import sqlite3
 import pandas as pd
 import json
 import re
-from datetime import datetime
-from flask import Flask, render_template, jsonify, request
+import math
+import gzip
+import numpy as np
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, jsonify, request, g
 import threading
 import time
 import os # <-- 1. 增加 os 模块导入
+from snapshot import load_snapshot
+from date_labels import format_date_range_chinese
+from search_cache import SearchCache, MembershipFilter
+from shared_cache import SharedAggregateCache
+from rate_limiter import RateLimiter
+from exporter import iter_export_batches, iter_csv, iter_ndjson, iter_gzip
+from history import get_run_bounds, state_as_of_query, bind_state_params, list_runs
+from trends import load_week_trends, compute_trends
+from wire_format import negotiate, encode, columnar_data, columnar_search
+from maintenance import ARCHIVE_TABLE
+import metrics
 
 # 数据库配置
 DB_NAME = "data/visas.db"
 TABLE_NAME = "visa_decisions"
+SOURCE_TABLE = "source_files"
+DECISION_TABLE = "decision_codes"
+WEEK_STATS_TABLE = "week_number_stats"
+
+# 查询缓存: 每代数据最多缓存的查询结果条数
+SEARCH_CACHE_SIZE = 10000
+
+# 范围查询的硬性上限，防止被用来导出整张表
+RANGE_MAX_SPAN = 100000         # from 与 to 之间最多相差的申请号数量
+RANGE_DEFAULT_PAGE_SIZE = 50    # 每页默认返回的不同申请号数量
+RANGE_MAX_PAGE_SIZE = 200
+AROUND_DEFAULT_K = 10           # around 查询默认前后各取的申请号数量
+AROUND_MAX_K = 50
+BATCH_MAX_NUMBERS = 200         # 批量查询一次最多的申请号数量
+BATCH_NUMBERS_PER_TOKEN = 10    # 批量查询每多少个申请号消耗一个限流令牌
+
+# 排队进度估算: 用最近多少周的中位数拟合处理速度
+ESTIMATE_TREND_WEEKS = 8
 
 app = Flask(__name__)
+search_cache = SearchCache(maxsize=SEARCH_CACHE_SIZE)
 
-def format_date_range_chinese(start_date, end_date):
-    """将日期范围格式化为中文显示"""
-    try:
-        start = datetime.strptime(start_date, '%Y-%m-%d')
-        end = datetime.strptime(end_date, '%Y-%m-%d')
-        
-        # 月份映射
-        month_map = {
-            1: '1月', 2: '2月', 3: '3月', 4: '4月', 5: '5月', 6: '6月',
-            7: '7月', 8: '8月', 9: '9月', 10: '10月', 11: '11月', 12: '12月'
-        }
-        
-        start_month_cn = month_map[start.month]
-        end_month_cn = month_map[end.month]
-        
-        if start.month == end.month:
-            return f"{start_month_cn}{start.day}日-{end.day}日"
-        else:
-            return f"{start_month_cn}{start.day}日-{end_month_cn}{end.day}日"
-    except:
-        return f"{start_date} 至 {end_date}"
+# 聚合结果缓存: 按数据代数失效，多个 gunicorn worker 通过共享文件复用同一份结果
+aggregate_cache = SharedAggregateCache()
+
+# 查询接口按客户端 IP 限流，令牌桶在所有 worker 之间共享
+search_limiter = RateLimiter()
+THROTTLED_BODY = json.dumps({'success': False, 'message': '请求过于频繁，请稍后再试'}).encode('utf-8')
+
+# 后台监视线程检查数据代数的间隔 (秒)
+WATCH_INTERVAL = float(os.environ.get("DATA_WATCH_INTERVAL", 5))
+
+# 后台线程预热完成后才发布新的数据代数，请求始终使用已预热的一代
+_serving_generation = None
+_watcher_thread = None
+_watcher_lock = threading.Lock()
+
+# 预先压缩的响应: (名称, 代数) -> gzip 数据，只保留最近两代
+_compressed_responses = {}
+_compressed_lock = threading.Lock()
 
 def get_date_range():
     """获取数据的日期范围"""
     try:
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            weeks = snapshot.weeks + snapshot.archived_weeks
+            if not weeks:
+                return "暂无数据", "暂无数据"
+            min_date = min(week['start'] for week in weeks)
+            max_date = max(week['end'] for week in weeks)
+            start_str = datetime.strptime(min_date, '%Y-%m-%d').strftime('%Y年%m月%d日')
+            end_str = datetime.strptime(max_date, '%Y-%m-%d').strftime('%Y年%m月%d日')
+            return start_str, end_str
+
         conn = sqlite3.connect(DB_NAME)
-        query = f"SELECT MIN(date_range_start) as min_date, MAX(date_range_end) as max_date FROM {TABLE_NAME}"
-        df = pd.read_sql_query(query, conn)
+        # 每周统计表只包含仍有数据的周
+        query = f"SELECT MIN(date_range_start) as min_date, MAX(date_range_end) as max_date FROM {WEEK_STATS_TABLE}"
+        with metrics.db_timer('date_range'):
+            df = pd.read_sql_query(query, conn)
         conn.close()
         
         if df.empty or df['min_date'].isna().any():
@@ -61,73 +104,107 @@ def get_date_range():
         print(f"获取日期范围时发生错误: {e}")
         return "未知", "未知"
 
-def get_visa_data():
-    """从数据库获取签证数据"""
+def resolve_as_of(value):
+    """
+    解析 as_of 参数 (入库编号)，返回 (run_id, 错误信息)。
+    未指定或等于最新一次入库时 run_id 为 None，按当前数据查询。
+    """
+    value = (value or '').strip()
+    if not value:
+        return None, None
+    if not value.isdigit():
+        return None, 'as_of 应为入库编号 (整数)'
+    run_id = int(value)
+    conn = sqlite3.connect(DB_NAME)
     try:
+        with metrics.db_timer('run_bounds'):
+            earliest, latest = get_run_bounds(conn)
+    finally:
+        conn.close()
+    if latest is None or not earliest <= run_id <= latest:
+        return None, f'入库记录 {run_id} 不存在，或其历史已被压缩或归档 (可查询范围: {earliest}-{latest})'
+    if run_id == latest:
+        return None, None
+    return run_id, None
+
+# 已归档的周没有明细行，计数直接取自归档计数表
+ARCHIVED_COUNTS_QUERY = f"""
+    SELECT a.date_range_start, a.date_range_end, d.decision, a.decisions AS count
+    FROM {ARCHIVE_TABLE} a
+    JOIN {DECISION_TABLE} d ON d.decision_code = a.decision_code
+"""
+
+def load_weekly_counts(as_of=None):
+    """
+    读取按周和决定聚合后的计数，列为 date_range_start, date_range_end, decision, count。
+    优先使用内存映射快照，快照不可用时回退到数据库聚合。
+    指定 as_of 时根据历史增量还原该次入库完成时的数据后聚合。
+    已归档的周 (超过保留期) 使用归档时记录的计数。
+    """
+    if as_of is not None:
         conn = sqlite3.connect(DB_NAME)
-        query = f"SELECT application_number, decision, source_file, date_range_start, date_range_end FROM {TABLE_NAME}"
-        df = pd.read_sql_query(query, conn)
+        query = f"""
+        WITH state AS ({state_as_of_query()})
+        SELECT s.date_range_start, s.date_range_end, d.decision, COUNT(*) AS count
+        FROM state v
+        JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+        JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+        GROUP BY s.date_range_start, s.date_range_end, v.decision_code
+        UNION ALL
+        {ARCHIVED_COUNTS_QUERY}
+        """
+        with metrics.db_timer('weekly_counts_as_of'):
+            df = pd.read_sql_query(query, conn, params=bind_state_params(as_of))
         conn.close()
-        
-        # 获取日期范围
-        start_date, end_date = get_date_range()
-        
-        if df.empty:
-            return {
-                'labels': [],
-                'total_applications': [],
-                'refused_count': [],
-                'refusal_rate': [],
-                'summary': {
-                    'total_apps': 0,
-                    'total_refused': 0,
-                    'avg_refusal_rate': 0,
-                    'start_date': start_date,
-                    'end_date': end_date
-                    # 移除这里的 last_updated，因为它将由新的API提供
-                    # 'last_updated': datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
-                }
-            }
-        
-        # 使用数据库中的日期范围创建周期标签
-        df['week'] = df.apply(lambda row: format_date_range_chinese(row['date_range_start'], row['date_range_end']), axis=1)
-        
-        # 按周统计
-        weekly_stats = df.groupby(['week', 'decision']).size().unstack(fill_value=0)
-        
-        # 计算总申请数和拒签率
-        weekly_stats['total_applications'] = weekly_stats.sum(axis=1)
-        weekly_stats['refused_count'] = weekly_stats.get('Refused', 0)
-        weekly_stats['approved_count'] = weekly_stats.get('Approved', 0)
-        weekly_stats['refusal_rate'] = (weekly_stats['refused_count'] / weekly_stats['total_applications'] * 100).round(2)
-        
-        # 按日期排序 - 使用原始数据的date_range_start进行排序
-        df_for_sort = df[['week', 'date_range_start']].drop_duplicates().sort_values('date_range_start')
-        sorted_weeks = df_for_sort['week'].tolist()
-        weekly_stats = weekly_stats.reindex(sorted_weeks)
-        
-        # 准备返回数据
-        data = {
-            'labels': weekly_stats.index.tolist(),
-            'total_applications': weekly_stats['total_applications'].tolist(),
-            'refused_count': weekly_stats['refused_count'].tolist(),
-            'refusal_rate': weekly_stats['refusal_rate'].tolist(),
-            'summary': {
-                'total_apps': int(weekly_stats['total_applications'].sum()),
-                'total_refused': int(weekly_stats['refused_count'].sum()),
-                'avg_refusal_rate': round(weekly_stats['refusal_rate'].mean(), 1),
-                'start_date': start_date,
-                'end_date': end_date
-                # 移除这里的 last_updated，因为它将由新的API提供
-                # 'last_updated': datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
-            }
-        }
-        
-        return data
-        
-    except Exception as e:
-        print(f"获取数据时发生错误: {e}")
+        return df
+
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        counts = snapshot.weekly_decision_counts()
+        records = []
+        for week_id, week in enumerate(snapshot.weeks):
+            for code in counts[week_id].nonzero()[0]:
+                records.append((week['start'], week['end'], snapshot.decisions.get(int(code), 'N/A'), int(counts[week_id, code])))
+        for week in snapshot.archived_weeks:
+            for code, count in week['counts'].items():
+                records.append((week['start'], week['end'], snapshot.decisions.get(int(code), 'N/A'), count))
+        return pd.DataFrame(records, columns=['date_range_start', 'date_range_end', 'decision', 'count'])
+
+    conn = sqlite3.connect(DB_NAME)
+    # 在数据库中按周和决定聚合，只把聚合结果读入 pandas
+    query = f"""
+    SELECT s.date_range_start, s.date_range_end, d.decision, COUNT(*) AS count
+    FROM {TABLE_NAME} v
+    JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+    JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+    GROUP BY s.date_range_start, s.date_range_end, v.decision_code
+    UNION ALL
+    {ARCHIVED_COUNTS_QUERY}
+    """
+    with metrics.db_timer('weekly_counts'):
+        df = pd.read_sql_query(query, conn)
+    conn.close()
+    return df
+
+def get_date_range_from_counts(df):
+    """根据聚合结果计算日期范围 (用于历史数据)"""
+    if df.empty:
+        return "暂无数据", "暂无数据"
+    start_str = datetime.strptime(df['date_range_start'].min(), '%Y-%m-%d').strftime('%Y年%m月%d日')
+    end_str = datetime.strptime(df['date_range_end'].max(), '%Y-%m-%d').strftime('%Y年%m月%d日')
+    return start_str, end_str
+
+def build_visa_data(as_of=None):
+    """从数据库计算签证数据；as_of 为入库编号时返回该次入库完成时的数据。出错时抛出异常"""
+    df = load_weekly_counts(as_of)
+
+    # 获取日期范围
+    if as_of is None:
         start_date, end_date = get_date_range()
+    else:
+        start_date, end_date = get_date_range_from_counts(df)
+
+    if df.empty:
         return {
             'labels': [],
             'total_applications': [],
@@ -139,95 +216,892 @@ def get_visa_data():
                 'avg_refusal_rate': 0,
                 'start_date': start_date,
                 'end_date': end_date
-                # 移除这里的 last_updated
+                # 移除这里的 last_updated，因为它将由新的API提供
                 # 'last_updated': datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
             }
         }
 
+    # 使用数据库中的日期范围创建周期标签
+    df['week'] = df.apply(lambda row: format_date_range_chinese(row['date_range_start'], row['date_range_end']), axis=1)
+
+    # 按周统计
+    weekly_stats = df.pivot_table(index='week', columns='decision', values='count', aggfunc='sum', fill_value=0)
+    weekly_stats.columns.name = None
+
+    # 计算总申请数和拒签率
+    weekly_stats['total_applications'] = weekly_stats.sum(axis=1)
+    weekly_stats['refused_count'] = weekly_stats.get('Refused', 0)
+    weekly_stats['approved_count'] = weekly_stats.get('Approved', 0)
+    weekly_stats['refusal_rate'] = (weekly_stats['refused_count'] / weekly_stats['total_applications'] * 100).round(2)
+
+    # 按日期排序 - 使用原始数据的date_range_start进行排序
+    df_for_sort = df[['week', 'date_range_start']].drop_duplicates().sort_values('date_range_start')
+    sorted_weeks = df_for_sort['week'].tolist()
+    weekly_stats = weekly_stats.reindex(sorted_weeks)
+
+    # 准备返回数据
+    data = {
+        'labels': weekly_stats.index.tolist(),
+        'total_applications': weekly_stats['total_applications'].tolist(),
+        'refused_count': weekly_stats['refused_count'].tolist(),
+        'refusal_rate': weekly_stats['refusal_rate'].tolist(),
+        'summary': {
+            'total_apps': int(weekly_stats['total_applications'].sum()),
+            'total_refused': int(weekly_stats['refused_count'].sum()),
+            'avg_refusal_rate': round(weekly_stats['refusal_rate'].mean(), 1),
+            'start_date': start_date,
+            'end_date': end_date
+            # 移除这里的 last_updated，因为它将由新的API提供
+            # 'last_updated': datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
+        }
+    }
+
+    return data
+
+def empty_visa_data():
+    """计算失败时返回的空数据"""
+    start_date, end_date = get_date_range()
+    return {
+        'labels': [],
+        'total_applications': [],
+        'refused_count': [],
+        'refusal_rate': [],
+        'summary': {
+            'total_apps': 0,
+            'total_refused': 0,
+            'avg_refusal_rate': 0,
+            'start_date': start_date,
+            'end_date': end_date
+        }
+    }
+
+def get_visa_data(as_of=None):
+    """从数据库获取签证数据；as_of 为入库编号时返回该次入库完成时的数据。出错时返回空数据"""
+    try:
+        return build_visa_data(as_of)
+    except Exception as e:
+        print(f"获取数据时发生错误: {e}")
+        return empty_visa_data()
+
+def get_current_visa_data(generation=None):
+    """
+    当前数据的签证数据 (按数据代数缓存)，返回 (数据, 是否计算成功)。
+    计算失败时返回空数据，且不写入进程内和共享缓存，下一次请求会重新计算。
+    """
+    try:
+        return get_cached_aggregate('data', build_visa_data, generation), True
+    except Exception as e:
+        print(f"获取数据时发生错误: {e}")
+        return empty_visa_data(), False
+
 @app.route('/')
 def dashboard():
     """主页面"""
     return render_template('index.html')
 
+def data_payload(as_of_value=None):
+    """/api/data 的返回内容与状态码，Flask 与 ASGI 入口共用"""
+    as_of, error = resolve_as_of(as_of_value)
+    if error:
+        return {
+            'success': False,
+            'message': error
+        }, 400
+    if as_of is None:
+        return get_current_visa_data()[0], 200
+    return get_visa_data(as_of), 200
+
+def get_compressed_data(generation=None):
+    """返回 /api/data 的 gzip 响应体 (按数据代数缓存)"""
+    generation = generation if generation is not None else get_serving_generation()
+    key = ('data', generation)
+    with _compressed_lock:
+        body = _compressed_responses.get(key)
+    if body is not None:
+        return body
+    data, ok = get_current_visa_data(generation)
+    with app.app_context():
+        raw = jsonify(data).get_data()
+    body = gzip.compress(raw, compresslevel=6, mtime=0)
+    if not ok:
+        return body
+    with _compressed_lock:
+        _compressed_responses[key] = body
+        while len(_compressed_responses) > 2:
+            _compressed_responses.pop(next(iter(_compressed_responses)))
+    return body
+
+def negotiated_response(payload, to_columnar, status=200):
+    """
+    按 Accept 或 ?format= 返回默认 JSON 或紧凑编码 (见 wire_format.py)。
+    出错的返回内容总是使用默认 JSON。
+    """
+    fmt, error = negotiate(request.headers.get('Accept', ''), request.args.get('format'))
+    if error:
+        response = jsonify({'success': False, 'message': error})
+        response.status_code = 406
+    elif fmt == 'json' or status != 200 or payload.get('success') is False:
+        response = jsonify(payload)
+        response.status_code = status
+    else:
+        body, mimetype = encode(to_columnar(payload), fmt)
+        response = Response(body, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept'
+    return response
+
 @app.route('/api/data')
 def api_data():
-    """API接口：获取最新数据"""
-    data = get_visa_data()
-    return jsonify(data)
+    """API接口：获取最新数据；as_of=<入库编号> 时返回历史数据。支持紧凑编码"""
+    as_of_value = request.args.get('as_of')
+    fmt, _ = negotiate(request.headers.get('Accept', ''), request.args.get('format'))
+    if (fmt == 'json' and not (as_of_value or '').strip()
+            and 'gzip' in request.headers.get('Accept-Encoding', '')):
+        # 当前数据直接返回预先压缩好的响应
+        return Response(get_compressed_data(), mimetype='application/json', headers={
+            'Content-Encoding': 'gzip',
+            'Vary': 'Accept, Accept-Encoding',
+        })
+    data, status = data_payload(as_of_value)
+    return negotiated_response(data, columnar_data, status)
 
-# --- 2. 新增一个API接口，专门用于获取数据库文件更新时间 ---
-@app.route('/api/last_update')
-def get_last_update_time():
-    """获取数据库文件的最后修改时间"""
+@app.route('/api/runs')
+def api_runs():
+    """API接口：列出历次入库，compacted 为 1 的入库已不能用 as_of 回溯"""
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        with metrics.db_timer('runs'):
+            runs = list_runs(conn)
+    finally:
+        conn.close()
+    return jsonify({
+        'success': True,
+        'runs': runs
+    })
+
+def last_update_payload():
+    """数据库文件的最后修改时间"""
     try:
         mtime = os.path.getmtime(DB_NAME)
         last_update_dt = datetime.fromtimestamp(mtime)
         last_update_str = last_update_dt.strftime('%Y年%m月%d日 %H:%M:%S')
-        return jsonify({'last_update_time': last_update_str})
+        return {'last_update_time': last_update_str}
     except Exception as e:
         print(f"获取最后更新时间失败: {e}") # 在服务器端打印错误日志
-        return jsonify({'last_update_time': '无法获取'})
+        return {'last_update_time': '无法获取'}
+
+# --- 2. 新增一个API接口，专门用于获取数据库文件更新时间 ---
+@app.route('/api/last_update')
+def get_last_update_time():
+    """获取数据库文件的最后修改时间"""
+    return jsonify(last_update_payload())
+
+def get_data_generation():
+    """当前数据的代数标识：优先使用快照，否则使用数据库文件的修改时间"""
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        return snapshot.generation
+    try:
+        return f"db:{os.stat(DB_NAME).st_mtime_ns}"
+    except OSError:
+        return None
+
+def load_application_numbers():
+    """读取全部申请号，用于构建查询的成员过滤器"""
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        return snapshot.application_numbers
+    conn = sqlite3.connect(DB_NAME)
+    with metrics.db_timer('application_numbers'):
+        numbers = [row[0] for row in conn.execute(f"SELECT application_number FROM {TABLE_NAME}")]
+    conn.close()
+    return numbers
+
+def search_application(app_number, as_of=None):
+    """
+    按申请号查询，返回 (申请号, 决定, 源文件, 开始日期, 结束日期, 处理时间) 列表。
+    优先在快照上二分查找，快照不可用时回退到数据库。
+    指定 as_of 时查询该次入库完成时的数据。
+    """
+    if as_of is not None:
+        conn = sqlite3.connect(DB_NAME)
+        query = f"""
+        SELECT v.application_number, d.decision, s.source_file, s.date_range_start, s.date_range_end, s.processed_date
+        FROM ({state_as_of_query(app_number)}) v
+        JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+        JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+        ORDER BY s.date_range_start
+        """
+        with metrics.db_timer('search_as_of'):
+            results = conn.execute(query, bind_state_params(as_of, app_number)).fetchall()
+        conn.close()
+        return results
+
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        left, right = snapshot.find(app_number)
+        return [snapshot.row(i) for i in range(left, right)]
+
+    conn = sqlite3.connect(DB_NAME)
+    query = f"""
+    SELECT v.application_number, d.decision, s.source_file, s.date_range_start, s.date_range_end, s.processed_date 
+    FROM {TABLE_NAME} v
+    JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+    JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+    WHERE v.application_number = ?
+    """
+    cursor = conn.cursor()
+    with metrics.db_timer('search'):
+        cursor.execute(query, (app_number,))
+        results = cursor.fetchall()
+    conn.close()
+    return results
+
+def format_search_row(row):
+    """将查询结果行转换为接口返回的字典"""
+    app_num, decision, source_file, date_start, date_end, processed_date = row
+    return {
+        'application_number': app_num,
+        'decision': decision,
+        'week': format_date_range_chinese(date_start, date_end),
+        'source_file': source_file,
+        'processed_date': processed_date
+    }
+
+def _query_rows_between(conn, low, high):
+    """按申请号顺序返回闭区间 [low, high] 内的全部行"""
+    query = f"""
+    SELECT v.application_number, d.decision, s.source_file, s.date_range_start, s.date_range_end, s.processed_date
+    FROM {TABLE_NAME} v
+    JOIN {SOURCE_TABLE} s ON s.source_id = v.source_id
+    JOIN {DECISION_TABLE} d ON d.decision_code = v.decision_code
+    WHERE v.application_number BETWEEN ? AND ?
+    ORDER BY v.application_number, s.date_range_start
+    """
+    return conn.execute(query, (low, high)).fetchall()
+
+def search_range(low, high, limit):
+    """
+    查询 [low, high] 内前 limit 个不同申请号的全部记录。
+    返回 (行列表, 下一页游标)，游标为本页最后一个申请号，没有更多数据时为 None。
+    """
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        left, right = snapshot.find_range(low, high)
+        end, has_more = snapshot.scan_distinct(left, right, limit)
+        rows = [snapshot.row(i) for i in range(left, end)]
+        return rows, (rows[-1][0] if has_more and rows else None)
+
+    # 主键 (application_number, source_id) 即有序索引，DISTINCT + LIMIT 只读取结果所需的页
+    conn = sqlite3.connect(DB_NAME)
+    with metrics.db_timer('search_range'):
+        numbers = [row[0] for row in conn.execute(
+            f"""SELECT DISTINCT application_number FROM {TABLE_NAME}
+            WHERE application_number BETWEEN ? AND ? ORDER BY application_number LIMIT ?""",
+            (low, high, limit + 1)
+        )]
+        has_more = len(numbers) > limit
+        numbers = numbers[:limit]
+        rows = _query_rows_between(conn, numbers[0], numbers[-1]) if numbers else []
+    conn.close()
+    return rows, (numbers[-1] if has_more else None)
+
+def search_around(center, k):
+    """查询 center 本身及其前后各 k 个已决定的申请号"""
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        left, right = snapshot.find(center)
+        before, _ = snapshot.scan_distinct(left - 1, -1, k, step=-1)
+        after, _ = snapshot.scan_distinct(right, len(snapshot), k)
+        return [snapshot.row(i) for i in range(before + 1, after)]
+
+    conn = sqlite3.connect(DB_NAME)
+    with metrics.db_timer('search_around'):
+        lower = [row[0] for row in conn.execute(
+            f"""SELECT DISTINCT application_number FROM {TABLE_NAME}
+            WHERE application_number < ? ORDER BY application_number DESC LIMIT ?""", (center, k)
+        )]
+        upper = [row[0] for row in conn.execute(
+            f"""SELECT DISTINCT application_number FROM {TABLE_NAME}
+            WHERE application_number > ? ORDER BY application_number LIMIT ?""", (center, k)
+        )]
+        low = lower[-1] if lower else center
+        high = upper[-1] if upper else center
+        rows = _query_rows_between(conn, low, high)
+    conn.close()
+    return rows
+
+def _parse_int_arg(name, default=None):
+    """读取非负整数参数，格式错误时抛出 ValueError"""
+    value = request.args.get(name, '').strip()
+    if not value:
+        if default is None:
+            raise ValueError(f'缺少参数 {name}')
+        return default
+    if not value.isdigit():
+        raise ValueError(f'参数 {name} 应为数字')
+    return int(value)
+
+def throttled_response(retry_after):
+    """限流拒绝: 预先编码好的响应体，不做任何查询"""
+    return Response(THROTTLED_BODY, status=429, mimetype='application/json', headers={
+        'Retry-After': str(max(1, math.ceil(retry_after)))
+    })
+
+@app.route('/api/search/range')
+def api_search_range():
+    """
+    API接口：按申请号范围查询，支持两种方式:
+    - ?from=A&to=B[&cursor=C&page_size=N]: 范围内的记录，按申请号分页；
+    - ?around=N[&k=K]: N 前后各 K 个已决定的申请号。
+    """
+    allowed, retry_after = search_limiter.allow(request.remote_addr or 'unknown')
+    if not allowed:
+        return throttled_response(retry_after)
+    try:
+        if request.args.get('around', '').strip():
+            center = _parse_int_arg('around')
+            k = _parse_int_arg('k', AROUND_DEFAULT_K)
+            if not 1 <= k <= AROUND_MAX_K:
+                raise ValueError(f'k 应在 1 到 {AROUND_MAX_K} 之间')
+            results = [format_search_row(row) for row in search_around(center, k)]
+            return jsonify({
+                'success': True,
+                'center': center,
+                'k': k,
+                'results': results,
+                'count': len(results)
+            })
+
+        low = _parse_int_arg('from')
+        high = _parse_int_arg('to')
+        page_size = _parse_int_arg('page_size', RANGE_DEFAULT_PAGE_SIZE)
+        if low > high:
+            raise ValueError('from 不能大于 to')
+        if high - low > RANGE_MAX_SPAN:
+            raise ValueError(f'查询范围不能超过 {RANGE_MAX_SPAN} 个申请号')
+        if not 1 <= page_size <= RANGE_MAX_PAGE_SIZE:
+            raise ValueError(f'page_size 应在 1 到 {RANGE_MAX_PAGE_SIZE} 之间')
+
+        # 游标为上一页最后一个申请号，本页从其后开始
+        cursor = request.args.get('cursor', '').strip()
+        start = _parse_int_arg('cursor') + 1 if cursor else low
+        rows, next_cursor = search_range(max(start, low), high, page_size)
+        results = [format_search_row(row) for row in rows]
+        return jsonify({
+            'success': True,
+            'from': low,
+            'to': high,
+            'results': results,
+            'count': len(results),
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'查询时发生错误: {str(e)}'
+        })
+
+def cached_search(app_number, generation):
+    """
+    查询 generation 代数据中的一个申请号 (数字字符串)，经过查询缓存和成员过滤器并计入其统计。
+    调用前需先 search_cache.ensure_generation(generation)；查询期间代数变化时结果不写入缓存。
+    """
+    # 同一代数据内重复的查询直接返回缓存结果
+    cached = search_cache.get(app_number)
+    if cached is not None:
+        return cached
+
+    # 成员过滤器判定一定不存在的申请号无需访问存储
+    if search_cache.might_contain(int(app_number)):
+        results = search_application(int(app_number))
+    else:
+        results = []
+
+    if not results:
+        payload = {
+            'success': False,
+            'message': f'未找到申请号 {app_number} 的记录'
+        }
+        search_cache.put(generation, app_number, payload)
+        return payload
+
+    # 处理结果（可能有多条记录，因为同一个申请号可能在不同文件中出现）
+    formatted_results = [format_search_row(row) for row in results]
+
+    payload = {
+        'success': True,
+        'results': formatted_results,
+        'count': len(formatted_results)
+    }
+    search_cache.put(generation, app_number, payload)
+    return payload
+
+def search_payload(app_number, as_of_value=None):
+    """/api/search 的返回内容，Flask 与 ASGI 入口共用"""
+    app_number = (app_number or '').strip()
+    
+    if not app_number:
+        return {
+            'success': False,
+            'message': '请输入申请号'
+        }
+    
+    if not app_number.isdigit():
+        return {
+            'success': False,
+            'message': '申请号应为数字'
+        }
+
+    as_of, error = resolve_as_of(as_of_value)
+    if error:
+        return {
+            'success': False,
+            'message': error
+        }
+    
+    try:
+        if as_of is not None:
+            # 历史查询不经过缓存
+            results = search_application(int(app_number), as_of)
+            if not results:
+                return {
+                    'success': False,
+                    'message': f'第 {as_of} 次入库时未找到申请号 {app_number} 的记录'
+                }
+            formatted_results = [format_search_row(row) for row in results]
+            return {
+                'success': True,
+                'results': formatted_results,
+                'count': len(formatted_results),
+                'as_of': as_of
+            }
+
+        generation = get_serving_generation()
+        search_cache.ensure_generation(generation, load_application_numbers)
+        return cached_search(app_number, generation)
+        
+    except Exception as e:
+        return {
+            'success': False,
+            'message': f'查询时发生错误: {str(e)}'
+        }
 
 @app.route('/api/search')
 def api_search():
     """API接口：查询申请号"""
+    allowed, retry_after = search_limiter.allow(request.remote_addr or 'unknown')
+    if not allowed:
+        return throttled_response(retry_after)
+    return jsonify(search_payload(request.args.get('app_number', ''), request.args.get('as_of')))
+
+def batch_search_payload(values):
+    """/api/search/batch 的返回内容: 各申请号的全部记录 (按请求顺序) 与没有记录的申请号"""
+    numbers = []
+    for value in values:
+        value = str(value).strip()
+        if not value.isdigit():
+            raise ValueError(f'申请号应为数字: {value}')
+        numbers.append(int(value))
+    if not numbers:
+        raise ValueError('请输入申请号')
+    numbers = list(dict.fromkeys(numbers))
+    if len(numbers) > BATCH_MAX_NUMBERS:
+        raise ValueError(f'一次最多查询 {BATCH_MAX_NUMBERS} 个申请号')
+
+    generation = get_serving_generation()
+    search_cache.ensure_generation(generation, load_application_numbers)
+    results = []
+    not_found = []
+    for number in numbers:
+        # 与 /api/search 共用查询缓存，命中、未命中和过滤器统计口径一致
+        payload = cached_search(str(number), generation)
+        if payload['success']:
+            results.extend(payload['results'])
+        else:
+            not_found.append(number)
+    return {
+        'success': True,
+        'results': results,
+        'count': len(results),
+        'found': len(numbers) - len(not_found),
+        'not_found': not_found
+    }
+
+@app.route('/api/search/batch', methods=['GET', 'POST'])
+def api_search_batch():
+    """
+    API接口：批量查询申请号，GET ?app_numbers=1,2,3 或 POST JSON {"app_numbers": [...]}。
+    每 BATCH_NUMBERS_PER_TOKEN 个申请号消耗一个限流令牌。支持紧凑编码。
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        values = body.get('app_numbers', []) if isinstance(body, dict) else []
+    else:
+        values = request.args.get('app_numbers', '')
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    if not isinstance(values, list):
+        values = []
+
+    cost = max(1, math.ceil(len(values) / BATCH_NUMBERS_PER_TOKEN))
+    allowed, retry_after = search_limiter.allow(request.remote_addr or 'unknown', cost)
+    if not allowed:
+        return throttled_response(retry_after)
+    try:
+        payload = batch_search_payload(values)
+    except ValueError as e:
+        payload = {
+            'success': False,
+            'message': str(e)
+        }
+    except Exception as e:
+        payload = {
+            'success': False,
+            'message': f'查询时发生错误: {str(e)}'
+        }
+    return negotiated_response(payload, columnar_search)
+
+def get_published_generation():
+    """后台线程已预热发布的数据代数，只读内存；线程未运行或尚未发布时为 None"""
+    return _serving_generation if _watcher_thread is not None else None
+
+def get_serving_generation():
+    """请求使用的数据代数: 后台线程运行时为其已预热发布的一代，否则为当前数据的代数 (需要读取快照)"""
+    generation = get_published_generation()
+    if generation is not None:
+        return generation
+    return get_data_generation()
+
+def get_cached_aggregate(name, build, generation=None):
+    """返回指定 (默认为当前服务的) 数据代数下的聚合结果，缺失时由一个 worker 调用 build() 计算"""
+    if generation is None:
+        generation = get_serving_generation()
+    return aggregate_cache.get(name, generation, build)
+
+def build_trends():
+    """从每周趋势表计算趋势数据"""
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        with metrics.db_timer('trends'):
+            rows = load_week_trends(conn)
+        trends = compute_trends(rows)
+    finally:
+        conn.close()
+    for week in trends['weeks']:
+        week['label'] = format_date_range_chinese(week['date_range_start'], week['date_range_end'])
+    return trends
+
+@app.route('/api/trends')
+def api_trends():
+    """API接口：拒签率趋势 (加权平均、4/12 周滚动拒签率、环比变化、每周决定数分位数)"""
+    try:
+        trends = get_cached_aggregate('trends', build_trends)
+        return jsonify(dict(trends, success=True))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'计算趋势时发生错误: {str(e)}'
+        })
+
+@app.route('/api/search/stats')
+def api_search_stats():
+    """API接口：查询缓存与成员过滤器的命中统计，以及限流统计"""
+    return jsonify(dict(search_cache.snapshot_stats(), rate_limit=search_limiter.snapshot_stats()))
+
+# --- 监控指标: 每个请求记录耗时与状态码，/metrics 输出所有 worker 的合计 ---
+SEARCH_CACHE_EVENTS = ('lookups', 'cache_hits', 'cache_misses', 'filter_rejections', 'storage_lookups', 'generation_changes')
+
+def cache_metric_samples():
+    """进程内缓存统计 (累计值)，由 metrics.collect() 写入本进程的指标文件"""
+    stats = search_cache.snapshot_stats()
+    samples = [('visa_search_cache_events_total', {'event': event}, stats[event]) for event in SEARCH_CACHE_EVENTS]
+    samples += [('visa_aggregate_cache_events_total', {'event': event}, count)
+                for event, count in aggregate_cache.stats.items()]
+    return samples
+
+metrics.register_collector(cache_metric_samples)
+
+def metric_gauges():
+    """请求 /metrics 时在当前进程计算的指标: 索引大小、数据代数和限流统计"""
+    search_stats = search_cache.snapshot_stats()
+    gauges = [
+        ('visa_index_keys', {}, search_stats['filter_keys']),
+        ('visa_index_bytes', {'index': 'membership_filter'}, search_stats['filter_bytes']),
+    ]
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        gauges.append(('visa_index_bytes', {'index': 'snapshot'}, snapshot.stat.st_size))
+        gauges.append(('visa_snapshot_rows', {}, len(snapshot)))
+    generation = get_serving_generation()
+    if generation is not None:
+        gauges.append(('visa_data_generation_info', {'generation': generation}, 1))
+    try:
+        gauges.append(('visa_data_last_update_timestamp_seconds', {}, os.path.getmtime(DB_NAME)))
+    except OSError:
+        pass
+    limiter_stats = search_limiter.snapshot_stats()
+    if limiter_stats['enabled']:
+        # 限流计数本身就保存在共享文件中，不需要再按进程相加
+        gauges.append(('visa_rate_limit_decisions_total', {'result': 'allowed'}, limiter_stats['allowed']))
+        gauges.append(('visa_rate_limit_decisions_total', {'result': 'throttled'}, limiter_stats['throttled']))
+    return gauges
+
+def record_request(route, method, status, seconds):
+    """记录一个请求的耗时和状态码，Flask 与 ASGI 入口共用"""
+    metrics.inc('visa_http_requests_total', {'route': route, 'method': method, 'status': str(status)})
+    metrics.observe('visa_http_request_duration_seconds', seconds, {'route': route, 'method': method})
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        # 按路由规则而不是实际路径记录，未匹配的路径合并为一类，避免标签数量无限增长
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        record_request(route, request.method, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.route('/metrics')
+def api_metrics():
+    """Prometheus 文本格式的监控指标"""
+    return Response(metrics.render(metric_gauges()), mimetype='text/plain; version=0.0.4')
+
+def load_week_number_stats():
+    """
+    读取每周已决定申请号的分布统计 (按开始日期排序)。
+    数据来自快照头部或 week_number_stats 小表，不扫描 visa_decisions。
+    """
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        return [
+            dict(week['numbers'], date_range_start=week['start'], date_range_end=week['end'])
+            for week in snapshot.weeks if 'numbers' in week
+        ]
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    with metrics.db_timer('week_number_stats'):
+        rows = conn.execute(f"SELECT * FROM {WEEK_STATS_TABLE} ORDER BY date_range_start").fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def number_percentile(app_number, week):
+    """按分位点线性插值，估算申请号在某一周已决定申请号中的百分位"""
+    points = [(0, week['min_number'])]
+    points += sorted((int(key[1:]), value) for key, value in week.items() if re.fullmatch(r'p\d+', key))
+    points.append((100, week['max_number']))
+    if app_number <= points[0][1]:
+        return 0.0
+    if app_number >= points[-1][1]:
+        return 100.0
+    for (low_pct, low_value), (high_pct, high_value) in zip(points, points[1:]):
+        if low_value <= app_number <= high_value:
+            if high_value == low_value:
+                return float(high_pct)
+            ratio = (app_number - low_value) / (high_value - low_value)
+            return round(low_pct + ratio * (high_pct - low_pct), 1)
+    return 100.0
+
+def estimate_queue_position(app_number, weeks):
+    """
+    根据每周已决定申请号的分位数估算申请号的排队位置:
+    - 与最近一周的分布比较，判断处理进度是否已经到达该申请号；
+    - 用最近几周中位数的线性趋势估算每周推进的申请号数量，推算预计决定的周。
+    """
+    latest = weeks[-1]
+    latest_label = format_date_range_chinese(latest['date_range_start'], latest['date_range_end'])
+
+    if app_number < latest['min_number']:
+        position = 'behind'     # 已在最近一周的处理范围之前
+    elif app_number > latest['max_number']:
+        position = 'ahead'      # 尚未到达
+    else:
+        position = 'within'
+
+    matching_weeks = [
+        {
+            'week': format_date_range_chinese(week['date_range_start'], week['date_range_end']),
+            'percentile': number_percentile(app_number, week),
+        }
+        for week in weeks if week['min_number'] <= app_number <= week['max_number']
+    ]
+
+    recent = weeks[-ESTIMATE_TREND_WEEKS:]
+    progress_per_week = None
+    projected = None
+    if len(recent) >= 2:
+        medians = [week['p50'] for week in recent]
+        progress_per_week = float(np.polyfit(range(len(medians)), medians, 1)[0])
+    if progress_per_week and progress_per_week > 0:
+        weeks_ahead = max(0, math.ceil((app_number - latest['p50']) / progress_per_week))
+        latest_end = datetime.strptime(latest['date_range_end'], '%Y-%m-%d')
+        start = latest_end + timedelta(days=7 * weeks_ahead - 6)
+        end = latest_end + timedelta(days=7 * weeks_ahead)
+        projected = {
+            'weeks_from_latest': weeks_ahead,
+            'date_range_start': start.strftime('%Y-%m-%d'),
+            'date_range_end': end.strftime('%Y-%m-%d'),
+            'week': format_date_range_chinese(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')),
+        }
+
+    return {
+        'success': True,
+        'application_number': app_number,
+        'position': position,
+        'latest_week': {
+            'week': latest_label,
+            'decisions': latest['decisions'],
+            'min_number': latest['min_number'],
+            'median_number': latest['p50'],
+            'max_number': latest['max_number'],
+            'percentile': number_percentile(app_number, latest),
+        },
+        'matching_weeks': matching_weeks,
+        'progress_per_week': round(progress_per_week) if progress_per_week else None,
+        'projected_week': projected,
+    }
+
+@app.route('/api/estimate')
+def api_estimate():
+    """API接口：根据每周申请号分布估算排队进度"""
     app_number = request.args.get('app_number', '').strip()
-    
+
     if not app_number:
         return jsonify({
             'success': False,
             'message': '请输入申请号'
         })
-    
+
     if not app_number.isdigit():
         return jsonify({
             'success': False,
             'message': '申请号应为数字'
         })
-    
+
     try:
-        conn = sqlite3.connect(DB_NAME)
-        query = f"""
-        SELECT application_number, decision, source_file, date_range_start, date_range_end, processed_date 
-        FROM {TABLE_NAME} 
-        WHERE application_number = ?
-        """
-        cursor = conn.cursor()
-        cursor.execute(query, (int(app_number),))
-        results = cursor.fetchall()
-        conn.close()
-        
-        if not results:
+        weeks = load_week_number_stats()
+        if not weeks:
             return jsonify({
                 'success': False,
-                'message': f'未找到申请号 {app_number} 的记录'
+                'message': '暂无数据'
             })
-        
-        # 处理结果（可能有多条记录，因为同一个申请号可能在不同文件中出现）
-        formatted_results = []
-        for row in results:
-            app_num, decision, source_file, date_start, date_end, processed_date = row
-            week_info = format_date_range_chinese(date_start, date_end)
-            formatted_results.append({
-                'application_number': app_num,
-                'decision': decision,
-                'week': week_info,
-                'source_file': source_file,
-                'processed_date': processed_date
-            })
-        
-        return jsonify({
-            'success': True,
-            'results': formatted_results,
-            'count': len(formatted_results)
-        })
-        
+        return jsonify(estimate_queue_position(int(app_number), weeks))
     except Exception as e:
         return jsonify({
             'success': False,
-            'message': f'查询时发生错误: {str(e)}'
+            'message': f'估算时发生错误: {str(e)}'
         })
 
+# 导出格式: 格式名 -> (编码函数, MIME 类型, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv', 'csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson', 'ndjson'),
+}
+
+@app.route('/api/export')
+def api_export():
+    """
+    API接口：流式导出原始决定数据。
+    参数: format=csv|ndjson, start / end=YYYY-MM-DD (按周筛选), gzip=1 (压缩输出)。
+    数据从数据库游标分批读取并边编码边发送，内存占用与表大小无关。
+    """
+    export_format = request.args.get('format', 'csv').strip().lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'message': f'不支持的导出格式: {export_format}'
+        }), 400
+
+    dates = {}
+    for name in ('start', 'end'):
+        value = request.args.get(name, '').strip()
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'message': f'参数 {name} 应为 YYYY-MM-DD 格式'
+                }), 400
+        dates[name] = value or None
+
+    encode, mimetype, extension = EXPORT_FORMATS[export_format]
+    body = encode(iter_export_batches(DB_NAME, dates['start'], dates['end']))
+    filename = f"visa_decisions.{extension}"
+    if request.args.get('gzip', '').strip().lower() in ('1', 'true', 'yes'):
+        body = iter_gzip(body)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+def warm_generation(generation):
+    """
+    为指定的数据代数构建聚合结果、压缩响应和查询成员过滤器，全部完成后再切换，
+    切换前的请求继续使用上一代已预热的缓存。
+    """
+    global _serving_generation
+    get_cached_aggregate('data', build_visa_data, generation)
+    get_cached_aggregate('trends', build_trends, generation)
+    get_compressed_data(generation)
+    membership = MembershipFilter(load_application_numbers())
+    # 先切换查询缓存再公布新的代数: 拿到新代数的请求不会因缓存仍是上一代而同步重建过滤器
+    search_cache.install_generation(generation, membership)
+    _serving_generation = generation
+
+def warm_up():
+    """
+    预热缓存: 映射快照、构建查询成员过滤器并计算聚合结果。
+    gunicorn 使用 --preload 时在主进程中调用，fork 出的 worker 直接继承这些结果。
+    """
+    start = time.perf_counter()
+    load_snapshot()
+    try:
+        warm_generation(get_data_generation())
+    except Exception as e:
+        # 预热失败时不缓存任何结果，请求到来时再计算
+        print(f"缓存预热失败: {e}")
+        return
+    print(f"缓存预热完成，用时 {time.perf_counter() - start:.2f} 秒")
+
+def watch_data_generation(interval):
+    """后台线程: 发现数据代数变化后在请求路径之外重新预热"""
+    while True:
+        time.sleep(interval)
+        # 定期把进程内的缓存统计写入指标文件
+        metrics.collect()
+        try:
+            generation = get_data_generation()
+            if generation != _serving_generation:
+                start = time.perf_counter()
+                warm_generation(generation)
+                print(f"数据已更新，缓存已在后台重建，用时 {time.perf_counter() - start:.2f} 秒")
+        except Exception as e:
+            print(f"后台重建缓存失败: {e}")
+
+def start_watcher(interval=WATCH_INTERVAL):
+    """在当前进程中启动后台监视线程 (fork 之后在每个 worker 中调用)"""
+    global _watcher_thread
+    with _watcher_lock:
+        if _watcher_thread is not None and _watcher_thread.is_alive():
+            return
+        if _serving_generation is None:
+            warm_up()
+        _watcher_thread = threading.Thread(
+            target=watch_data_generation, args=(interval,), name='data-watcher', daemon=True
+        )
+        _watcher_thread.start()
+
 def create_template():
     """创建HTML模板"""
     template_content = '''<!DOCTYPE html>
@@ -0,0 +1,171 @@
+import json
+import importlib.util
+
+# /api/data 与 /api/search/batch 的紧凑编码，按内容协商选择。默认仍返回原来的 JSON；
+# 客户端在 Accept 中请求 (或用 ?format= 指定) 时返回:
+#   columnar  列式 JSON: 每个字段一个数组，周表与决定字典编码后行中只存下标，
+#             拒签率存为整数 (乘以 RATE_SCALE)，中文不转义为 \uXXXX
+#   msgpack   同样的列式文档用 MessagePack 编码 (需要可选依赖 msgpack)
+JSON_TYPE = 'application/json'
+COLUMNAR_TYPE = 'application/vnd.visa-dashboard.columnar+json'
+MSGPACK_TYPE = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK_TYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+
+FORMATS = ('json', 'columnar', 'msgpack')
+COLUMNAR_VERSION = 1
+
+# 拒签率为保留两位小数的百分比，乘以 100 后可以无损地存为整数
+RATE_SCALE = 100
+
+
+def msgpack_available():
+    return importlib.util.find_spec('msgpack') is not None
+
+
+def _media_format(media_type):
+    """媒体类型 -> (格式, 具体程度)；紧凑格式比 application/json 更具体，通配符最不具体"""
+    if media_type == COLUMNAR_TYPE:
+        return 'columnar', 2
+    if media_type in MSGPACK_TYPES:
+        return ('msgpack', 2) if msgpack_available() else (None, 0)
+    if media_type == JSON_TYPE:
+        return 'json', 1
+    if media_type in ('*/*', 'application/*'):
+        return 'json', 0
+    return None, 0
+
+
+def negotiate(accept, format_param=None):
+    """
+    选择响应格式，返回 (格式, 错误信息)。?format= 优先于 Accept；
+    Accept 中按 q 值选择，q 值相同时选更具体的类型，没有可用的类型时返回默认的 JSON。
+    """
+    if format_param and format_param.strip():
+        fmt = format_param.strip().lower()
+        if fmt not in FORMATS:
+            return None, f"不支持的格式 {format_param}，可选: {'、'.join(FORMATS)}"
+        if fmt == 'msgpack' and not msgpack_available():
+            return None, '服务器未安装 msgpack，请使用 columnar 格式'
+        return fmt, None
+
+    best = ('json', -1.0, -1)
+    for item in (accept or '').split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        fmt, specificity = _media_format(media_type.lower())
+        if fmt is None:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0 and (q, specificity) > best[1:]:
+            best = (fmt, q, specificity)
+    return best[0], None
+
+
+def _scaled_rates(rates):
+    return [None if rate is None or rate != rate else int(round(rate * RATE_SCALE)) for rate in rates]
+
+
+def columnar_data(payload):
+    """把 /api/data 的返回内容转换为列式文档；各列与周表按下标对齐"""
+    return {
+        'format': 'columnar',
+        'version': COLUMNAR_VERSION,
+        'weeks': {'label': payload['labels']},
+        'columns': {
+            'total_applications': [int(value) for value in payload['total_applications']],
+            'refused_count': [int(value) for value in payload['refused_count']],
+            'refusal_rate': _scaled_rates(payload['refusal_rate']),
+        },
+        'scale': {'refusal_rate': RATE_SCALE},
+        'summary': payload['summary'],
+    }
+
+
+def columnar_search(payload):
+    """
+    把批量查询的返回内容转换为列式文档。每个源文件 (一周) 在周表中只出现一次，
+    决定文字只出现一次，每行只保存申请号和两个下标；其余字段原样保留。
+    """
+    week_ids = {}
+    weeks = {'label': [], 'source_file': [], 'processed_date': []}
+    decision_ids = {}
+    rows = {'application_number': [], 'decision': [], 'week': []}
+    for result in payload['results']:
+        week_key = (result['week'], result['source_file'], result['processed_date'])
+        if week_key not in week_ids:
+            week_ids[week_key] = len(week_ids)
+            weeks['label'].append(result['week'])
+            weeks['source_file'].append(result['source_file'])
+            weeks['processed_date'].append(result['processed_date'])
+        decision = decision_ids.setdefault(result['decision'], len(decision_ids))
+        rows['application_number'].append(result['application_number'])
+        rows['decision'].append(decision)
+        rows['week'].append(week_ids[week_key])
+
+    document = {key: value for key, value in payload.items() if key != 'results'}
+    document.update({
+        'format': 'columnar',
+        'version': COLUMNAR_VERSION,
+        'weeks': weeks,
+        'decisions': list(decision_ids),
+        'rows': rows,
+    })
+    return document
+
+
+def encode(document, fmt):
+    """编码列式文档，返回 (响应体, 媒体类型)"""
+    if fmt == 'msgpack':
+        import msgpack
+        return msgpack.packb(document, use_bin_type=True), MSGPACK_TYPE
+    body = json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return body, f"{COLUMNAR_TYPE}; charset=utf-8"
+
+
+def decode(body, content_type):
+    """按响应的媒体类型解码 (客户端与基准测试使用)"""
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type in MSGPACK_TYPES:
+        import msgpack
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def expand_data(document):
+    """列式文档 -> 原来的 /api/data 结构"""
+    columns = document['columns']
+    scale = document['scale']['refusal_rate']
+    return {
+        'labels': document['weeks']['label'],
+        'total_applications': columns['total_applications'],
+        'refused_count': columns['refused_count'],
+        'refusal_rate': [None if rate is None else rate / scale for rate in columns['refusal_rate']],
+        'summary': document['summary'],
+    }
+
+
+def expand_search(document):
+    """列式文档 -> 原来的批量查询结构"""
+    weeks = document['weeks']
+    decisions = document['decisions']
+    rows = document['rows']
+    results = [
+        {
+            'application_number': number,
+            'decision': decisions[decision],
+            'week': weeks['label'][week],
+            'source_file': weeks['source_file'][week],
+            'processed_date': weeks['processed_date'][week],
+        }
+        for number, decision, week in zip(rows['application_number'], rows['decision'], rows['week'])
+    ]
+    payload = {key: value for key, value in document.items()
+               if key not in ('format', 'version', 'weeks', 'decisions', 'rows')}
+    payload['results'] = results
+    return payload